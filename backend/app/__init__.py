@@ -134,6 +134,9 @@ def create_app(config_name: str = None) -> Flask:
     app.register_blueprint(assistant.bp)
     app.register_blueprint(financial.bp)
 
+    from .cli import register_commands
+    register_commands(app)
+
     # Initialize scheduler for background tasks (only in production or if explicitly enabled)
     if not app.config.get('TESTING', False) and os.getenv('ENABLE_SCHEDULER', 'true').lower() == 'true':
         from .scheduler import init_scheduler
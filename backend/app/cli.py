@@ -0,0 +1,39 @@
+"""
+Flask CLI commands for the long-running background processes that run next
+to the web workers (see Procfile).
+"""
+import logging
+
+import click
+
+logger = logging.getLogger(__name__)
+
+
+def register_commands(app):
+    @app.cli.command('webhook-worker')
+    @click.option('--threads', default=4, show_default=True, help='Consumer threads in this process.')
+    def webhook_worker(threads):
+        """Consume the durable Evolution webhook queue (WEBHOOK_ASYNC_INGEST)."""
+        from app.routes.webhook import handle_queued_payload
+        from app.services.webhook_queue import WebhookWorker
+
+        worker = WebhookWorker(app, handle_queued_payload, threads=threads)
+        logger.info(
+            'Webhook worker started: %s threads over %s partitions',
+            worker.threads, worker.partitions
+        )
+        worker.run()
+
+    @app.cli.command('chat-worker')
+    @click.option('--concurrency', default=4, show_default=True, help='Replies handled in parallel by this process.')
+    def chat_worker(concurrency):
+        """Consume AI reply jobs (CHAT_WORKER_QUEUE) off the web workers."""
+        from app.services.message_processor import run_reply_job, start_dispatcher
+        from app.services.reply_queue import ReplyWorker
+
+        worker = ReplyWorker(app, run_reply_job, concurrency=concurrency)
+        # Chat workers also (compete to) run the debounce dispatcher, so
+        # replies keep firing while the web tier restarts
+        start_dispatcher(app)
+        logger.info('Chat worker started: concurrency %s', worker.concurrency)
+        worker.run()
@@ -1,5 +1,6 @@
 import os
 import logging
+import tempfile
 from datetime import timedelta
 from dotenv import load_dotenv
 
@@ -57,6 +58,16 @@ class Config:
     # Evolution API (default - can be overridden per clinic)
     EVOLUTION_API_URL = os.getenv('EVOLUTION_API_URL')
     EVOLUTION_API_KEY = os.getenv('EVOLUTION_API_KEY')
+    # Outbound pacing per WhatsApp instance (services/outbound_queue.py):
+    # sustained messages per second, burst size, and attempts per message
+    # on 429/5xx/network errors.
+    EVOLUTION_SEND_RATE = float(os.getenv('EVOLUTION_SEND_RATE', '1'))
+    EVOLUTION_SEND_BURST = int(os.getenv('EVOLUTION_SEND_BURST', '5'))
+    EVOLUTION_SEND_MAX_ATTEMPTS = int(os.getenv('EVOLUTION_SEND_MAX_ATTEMPTS', '3'))
+    # Sends in flight per instance during bulk sends (reminder runs, recall)
+    EVOLUTION_BULK_CONCURRENCY = int(os.getenv('EVOLUTION_BULK_CONCURRENCY', '4'))
+    # Keep-alive connections kept open to the gateway per process
+    EVOLUTION_HTTP_POOL_SIZE = int(os.getenv('EVOLUTION_HTTP_POOL_SIZE', '20'))
 
     # Inbound chat processing. Patient messages are answered by the AI in a
     # background worker after a short quiet window, so rapid-fire messages
@@ -64,12 +75,62 @@ class Config:
     # of one reply each. 0 disables aggregation and processes inline
     # (synchronously) - used by the test suite.
     MESSAGE_AGGREGATION_SECONDS = float(os.getenv('MESSAGE_AGGREGATION_SECONDS', '8'))
+    # Run those background replies in `flask chat-worker` (see Procfile),
+    # fed through a Redis queue, instead of threads inside the web workers.
+    # Needs REDIS_URL; without it replies stay in-process.
+    CHAT_WORKER_QUEUE = os.getenv('CHAT_WORKER_QUEUE', 'false').lower() == 'true'
+    # Replies are shared fairly between clinics (weighted fair queuing), with
+    # caps on concurrent LLM calls per clinic and overall. Weights are
+    # "<clinic id>=<weight>,..." (default 1 for every clinic).
+    CHAT_MAX_CONCURRENT_PER_CLINIC = int(os.getenv('CHAT_MAX_CONCURRENT_PER_CLINIC', '2'))
+    CHAT_MAX_CONCURRENT_TOTAL = int(os.getenv('CHAT_MAX_CONCURRENT_TOTAL', '16'))
+    CHAT_CLINIC_WEIGHTS = os.getenv('CHAT_CLINIC_WEIGHTS', '')
+    # Run independent read-only tool calls from one model round (e.g.
+    # check_availability for several dates) concurrently, each on its own
+    # DB session. false runs every tool inline - used by the test suite.
+    AGENT_PARALLEL_TOOLS = os.getenv('AGENT_PARALLEL_TOOLS', 'true').lower() == 'true'
+    # Default token budget for the conversation history sent verbatim to
+    # the agent each turn (clinic.agent_history_token_budget overrides it);
+    # older messages are covered by the rolling summary. The message cap
+    # bounds the rows fetched to fill it.
+    AGENT_HISTORY_TOKEN_BUDGET = int(os.getenv('AGENT_HISTORY_TOKEN_BUDGET', '6000'))
+    AGENT_HISTORY_MAX_MESSAGES = int(os.getenv('AGENT_HISTORY_MAX_MESSAGES', '100'))
+    # Rolling conversation summaries and human-handoff summaries are
+    # generated in a background thread, off the patient's reply path.
+    # false generates them inline - used by the test suite.
+    SUMMARY_ASYNC = os.getenv('SUMMARY_ASYNC', 'true').lower() == 'true'
     # Multimodal model used to transcribe patient voice notes so the bot can
     # keep handling them (any audio-capable model on OpenRouter works).
     AUDIO_TRANSCRIPTION_MODEL = os.getenv('AUDIO_TRANSCRIPTION_MODEL', 'google/gemini-2.5-flash')
+    # Inbound media download (via Evolution) and voice-note transcription
+    # run in a background thread after the webhook has stored a placeholder
+    # message. false processes inline - used by the test suite.
+    MEDIA_INGEST_ASYNC = os.getenv('MEDIA_INGEST_ASYNC', 'true').lower() == 'true'
+    # Where media bytes live (rows only keep metadata + SHA-256): 's3' for
+    # any S3-compatible store (needs boto3), or 'local' (MEDIA_STORAGE_PATH,
+    # a persistent volume shared by every process). Must be set explicitly
+    # in production; unset uses <instance>/media, for development only.
+    MEDIA_STORAGE_BACKEND = os.getenv('MEDIA_STORAGE_BACKEND')
+    MEDIA_STORAGE_PATH = os.getenv('MEDIA_STORAGE_PATH')
+    MEDIA_S3_BUCKET = os.getenv('MEDIA_S3_BUCKET')
+    MEDIA_S3_PREFIX = os.getenv('MEDIA_S3_PREFIX', 'media')
+    MEDIA_S3_ENDPOINT_URL = os.getenv('MEDIA_S3_ENDPOINT_URL')
+    MEDIA_S3_REGION = os.getenv('MEDIA_S3_REGION')
+    MEDIA_S3_ACCESS_KEY_ID = os.getenv('MEDIA_S3_ACCESS_KEY_ID')
+    MEDIA_S3_SECRET_ACCESS_KEY = os.getenv('MEDIA_S3_SECRET_ACCESS_KEY')
 
     # Webhook authentication
     WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+    # Durable webhook ingestion: accept Evolution webhooks with 202 after
+    # appending them to a Redis Stream, and process them in
+    # `flask webhook-worker` (which must be running - see Procfile). Needs
+    # REDIS_URL; without it webhooks keep being processed inline.
+    WEBHOOK_ASYNC_INGEST = os.getenv('WEBHOOK_ASYNC_INGEST', 'false').lower() == 'true'
+    # Streams the queue is split into (per-chat ordering is kept within one);
+    # also the upper bound on useful worker threads fleet-wide.
+    WEBHOOK_QUEUE_PARTITIONS = int(os.getenv('WEBHOOK_QUEUE_PARTITIONS', '8'))
+    # Failed deliveries of one payload before it goes to the dead-letter stream
+    WEBHOOK_QUEUE_MAX_ATTEMPTS = int(os.getenv('WEBHOOK_QUEUE_MAX_ATTEMPTS', '5'))
 
     # Kiwify (subscription billing)
     # KIWIFY_WEBHOOK_TOKEN must match the "token" configured for the webhook
@@ -145,6 +206,14 @@ class TestingConfig(Config):
     # Process chat messages inline (no aggregation window, no background
     # thread) so tests stay deterministic.
     MESSAGE_AGGREGATION_SECONDS = 0.0
+    MEDIA_INGEST_ASYNC = False
+    AGENT_PARALLEL_TOOLS = False
+    SUMMARY_ASYNC = False
+    # No outbound pacing in tests (sends are mocked)
+    EVOLUTION_SEND_RATE = 1000.0
+    EVOLUTION_SEND_BURST = 1000
+    MEDIA_STORAGE_BACKEND = 'local'
+    MEDIA_STORAGE_PATH = os.path.join(tempfile.gettempdir(), 'sdental-test-media')
     # Deterministic secret so webhook-signature tests don't depend on the
     # environment having WEBHOOK_SECRET set (webhook auth fails closed
     # without one - see utils/webhook_auth.py).
@@ -175,6 +244,13 @@ def validate_config(app):
     if app.config['JWT_SECRET_KEY'] == 'jwt-secret-key-change-in-production':
         errors.append('JWT_SECRET_KEY ainda esta com o valor padrao. Defina um valor seguro.')
 
+    # Critical: media bytes on the container's ephemeral disk are lost on
+    # every deploy (and invisible to the worker processes)
+    from app.utils.media_storage import persistent_storage_problem
+    media_problem = persistent_storage_problem(app.config)
+    if media_problem:
+        errors.append(f'Armazenamento de midia nao persistente: {media_problem}')
+
     # Recommended: services that won't work without these
     if not app.config.get('OPENROUTER_API_KEY'):
         warnings.append('OPENROUTER_API_KEY nao definida. Chatbot IA nao funcionara.')
@@ -5,7 +5,7 @@ from .appointment import Appointment
 from .appointment import Appointment, AppointmentStatus
 from .pipeline_stage import PipelineStage
 from .pipeline_stage_history import PipelineStageHistory
-from .conversation import Conversation, ConversationStatus
+from .conversation import Conversation, ConversationMessage, ConversationStatus
 from .availability_slot import AvailabilitySlot
 from .bot_transfer import BotTransfer
 from .reminder import AppointmentReminder, ReminderStatus, ReminderType
@@ -20,6 +20,7 @@ from .finance import (
 )
 from .ai_usage_log import AiUsageLog, AiUsageService
 from .media_asset import MediaAsset, MAX_MEDIA_BYTES
+from .audio_transcript import AudioTranscript
 
 __all__ = [
     'Clinic',
@@ -29,6 +30,7 @@ __all__ = [
     'Appointment',
     'AppointmentStatus',
     'Conversation',
+    'ConversationMessage',
     'ConversationStatus',
     'AvailabilitySlot',
     'BotTransfer',
@@ -56,4 +58,5 @@ __all__ = [
     'AiUsageService',
     'MediaAsset',
     'MAX_MEDIA_BYTES',
+    'AudioTranscript',
 ]
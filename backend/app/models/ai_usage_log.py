@@ -40,6 +40,13 @@ class AiUsageLog(db.Model, TimestampMixin):
     # OpenRouter's own cost figure for the call (already accounts for the
     # specific model's pricing and any cache discount), in USD.
     cost_usd = db.Column(db.Numeric(12, 6), nullable=True)
+    # Served from one of our own result caches (e.g. the transcript cache)
+    # instead of calling the model - counted so the hit rate is visible.
+    cache_hit = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
+    # Conversation history packed into the prompt for this call (agent
+    # turns only): how many messages, and their locally estimated tokens.
+    history_messages = db.Column(db.Integer, nullable=True)
+    history_tokens = db.Column(db.Integer, nullable=True)
 
     def to_dict(self) -> dict:
         return {
@@ -53,6 +60,9 @@ class AiUsageLog(db.Model, TimestampMixin):
             'total_tokens': self.total_tokens,
             'cached_tokens': self.cached_tokens,
             'cost_usd': float(self.cost_usd) if self.cost_usd is not None else None,
+            'cache_hit': bool(self.cache_hit),
+            'history_messages': self.history_messages,
+            'history_tokens': self.history_tokens,
             'created_at': self.created_at.isoformat() + 'Z' if self.created_at else None,
         }
 
@@ -0,0 +1,34 @@
+"""
+AudioTranscript: cached voice-note transcription, keyed by audio content.
+
+Re-delivered webhooks, forwarded voice notes and re-synced history carry
+byte-identical audio; ClaudeService.transcribe_audio looks the SHA-256 of
+the decoded bytes (plus the transcription model) up here before calling
+OpenRouter, and stores every successful transcript. Scoped per clinic so a
+patient's words never surface in another clinic's data.
+"""
+import uuid
+
+from app import db
+from app.models.types import UUID
+from .mixins import TimestampMixin
+
+
+class AudioTranscript(db.Model, TimestampMixin):
+    __tablename__ = 'audio_transcripts'
+
+    id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    clinic_id = db.Column(UUID(as_uuid=True), db.ForeignKey('clinics.id', ondelete='CASCADE'), nullable=False)
+    sha256 = db.Column(db.String(64), nullable=False)
+    model = db.Column(db.String(100), nullable=False)
+    transcript = db.Column(db.Text, nullable=False)
+
+    def __repr__(self) -> str:
+        return f'<AudioTranscript {self.sha256[:12]} {self.model}>'
+
+
+db.Index(
+    'ix_audio_transcripts_lookup',
+    AudioTranscript.clinic_id, AudioTranscript.sha256, AudioTranscript.model,
+    unique=True,
+)
@@ -4,6 +4,7 @@ import uuid
 import re
 from datetime import timedelta
 from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy import inspect
 from sqlalchemy.orm import validates
 
 from app.utils.datetime_utils import utcnow
@@ -13,6 +14,13 @@ from .mixins import TimestampMixin
 
 PASSWORD_RESET_TOKEN_TTL = timedelta(hours=1)
 
+# Clinic fields the AI agent's compiled prompt bundle is built from
+PROMPT_CONFIG_FIELDS = ('name', 'services', 'business_hours')
+
+# Allowed range for agent_history_token_budget
+MIN_HISTORY_TOKEN_BUDGET = 500
+MAX_HISTORY_TOKEN_BUDGET = 32000
+
 
 class SubscriptionStatus:
     PENDING_PAYMENT = 'pending_payment'  # signed up, no confirmed payment yet
@@ -64,6 +72,10 @@ class Clinic(db.Model, TimestampMixin):
     agent_system_prompt = db.Column(db.Text, nullable=True)
     agent_context = db.Column(db.Text, nullable=True)
     agent_enabled = db.Column(db.Boolean, default=True)
+    # Estimated tokens of recent messages sent verbatim to the agent each
+    # turn; older messages are left to the rolling summary. None uses
+    # AGENT_HISTORY_TOKEN_BUDGET.
+    agent_history_token_budget = db.Column(db.Integer, nullable=True)
 
     # Reminder configuration
     reminders_enabled = db.Column(db.Boolean, default=True)
@@ -108,6 +120,11 @@ class Clinic(db.Model, TimestampMixin):
     # each request, so tokens minted before the bump stop being accepted.
     token_version = db.Column(db.Integer, default=0, nullable=False)
 
+    # Bumped on every change to what the AI agent's prompt is compiled from
+    # (PROMPT_CONFIG_FIELDS, professionals, pipeline stages); the cached
+    # prompt bundle is keyed by it (services/prompt_bundle.py).
+    config_version = db.Column(db.Integer, default=0, nullable=False)
+
     __table_args__ = (
         db.CheckConstraint('agent_temperature >= 0 AND agent_temperature <= 1', name='check_temperature_range'),
     )
@@ -167,6 +184,16 @@ class Clinic(db.Model, TimestampMixin):
                 raise ValueError("Temperature must be between 0 and 1")
         return temperature
 
+    @validates('agent_history_token_budget')
+    def validate_history_token_budget(self, key, budget):
+        """Validate the history budget is within sane bounds."""
+        if budget is not None:
+            if not (MIN_HISTORY_TOKEN_BUDGET <= budget <= MAX_HISTORY_TOKEN_BUDGET):
+                raise ValueError(
+                    f"History token budget must be between {MIN_HISTORY_TOKEN_BUDGET} and {MAX_HISTORY_TOKEN_BUDGET}"
+                )
+        return budget
+
     def set_password(self, password: str) -> None:
         self.password_hash = generate_password_hash(password)
 
@@ -233,9 +260,28 @@ class Clinic(db.Model, TimestampMixin):
             data['has_openrouter_key'] = bool(self.openrouter_api_key)
         return data
 
+    @staticmethod
+    def bump_config_version(connection, clinic_id) -> None:
+        """Bump a clinic's config_version from inside a flush (related-row changes)."""
+        table = Clinic.__table__
+        connection.execute(
+            table.update()
+            .where(table.c.id == clinic_id)
+            .values(config_version=table.c.config_version + 1)
+        )
+
     def __repr__(self) -> str:
         return f'<Clinic {self.name}>'
 
 
+@db.event.listens_for(Clinic, 'before_update')
+def _bump_config_version(mapper, connection, target):
+    state = inspect(target)
+    if any(state.attrs[field].history.has_changes() for field in PROMPT_CONFIG_FIELDS):
+        # SQL-side increment: a bump made earlier by a related row in the
+        # same transaction isn't reflected on this instance yet.
+        target.config_version = Clinic.__table__.c.config_version + 1
+
+
 # Create index
 db.Index('ix_clinics_email', Clinic.email)
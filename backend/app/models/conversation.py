@@ -1,6 +1,8 @@
 import uuid
 from datetime import datetime
 
+from sqlalchemy import inspect
+
 from app.utils.datetime_utils import utcnow
 from app import db
 from app.models.types import JSONB, UUID
@@ -19,6 +21,14 @@ class MessageStatus:
     READ = 'read'
     FAILED = 'failed'
 
+    # Delivery progression. ACKs arrive out of order (a 'delivered' can land
+    # after the 'read'), so a status is only ever moved forward.
+    RANK = {FAILED: 0, SENT: 1, DELIVERED: 2, READ: 3}
+
+    @classmethod
+    def is_upgrade(cls, current: str, new: str) -> bool:
+        return cls.RANK.get(new, 0) > cls.RANK.get(current, 0)
+
 
 class MessageType:
     TEXT = 'text'
@@ -27,6 +37,70 @@ class MessageType:
     DOCUMENT = 'document'
 
 
+class ConversationMessage(db.Model):
+    """
+    One message of a Conversation, as an append-only row.
+
+    History used to live in a `conversations.messages` JSONB array that was
+    locked, copied and rewritten in full on every inbound message, ACK and
+    evolution-id attach - megabytes per write for long-lived patient chats,
+    and every writer serialized on the conversation row. Messages are now
+    appended with a single INSERT and updated by primary key.
+
+    `id` is an internal sequence (it also breaks ties between messages with
+    the same timestamp); `message_id` is the stable public identifier the
+    frontend and realtime events use (the `id` key of `to_dict()`).
+    """
+    __tablename__ = 'conversation_messages'
+
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True, autoincrement=True)
+    message_id = db.Column(db.String(32), nullable=False, default=lambda: uuid.uuid4().hex)
+    conversation_id = db.Column(
+        UUID(as_uuid=True), db.ForeignKey('conversations.id', ondelete='CASCADE'), nullable=False
+    )
+    # Denormalized from the conversation so clinic-wide lookups (ACK matching,
+    # search) don't need a join.
+    clinic_id = db.Column(UUID(as_uuid=True), db.ForeignKey('clinics.id', ondelete='CASCADE'), nullable=False)
+    evolution_id = db.Column(db.String(128), nullable=True)
+    role = db.Column(db.String(20), nullable=False)
+    content = db.Column(db.Text, nullable=True)
+    message_type = db.Column(db.String(20), nullable=False, default=MessageType.TEXT)
+    status = db.Column(db.String(20), nullable=False, default=MessageStatus.SENT)
+    media_url = db.Column(db.Text, nullable=True)
+    media_mimetype = db.Column(db.String(120), nullable=True)
+    caption = db.Column(db.Text, nullable=True)
+    sent_via = db.Column(db.String(30), nullable=True)
+    timestamp = db.Column(db.DateTime, nullable=False, default=utcnow)
+
+    def to_dict(self) -> dict:
+        """Same shape the JSONB array entries had, so API consumers are unaffected."""
+        data = {
+            'id': self.message_id,
+            'evolution_id': self.evolution_id,
+            'role': self.role,
+            'content': self.content,
+            'timestamp': self.timestamp.isoformat() + 'Z' if self.timestamp else None,
+            'status': self.status,
+            'type': self.message_type,
+        }
+        if self.media_url:
+            data['media_url'] = self.media_url
+        if self.media_mimetype:
+            data['media_mimetype'] = self.media_mimetype
+        if self.caption:
+            data['caption'] = self.caption
+        if self.sent_via:
+            data['sent_via'] = self.sent_via
+        return data
+
+    def __repr__(self) -> str:
+        return f'<ConversationMessage {self.message_id} {self.role}>'
+
+
+# Length of Conversation.last_message_preview (the inbox shows ~60 chars)
+PREVIEW_LENGTH = 160
+
+
 class Conversation(db.Model, SoftDeleteMixin, TimestampMixin):
     __tablename__ = 'conversations'
 
@@ -34,7 +108,6 @@ class Conversation(db.Model, SoftDeleteMixin, TimestampMixin):
     clinic_id = db.Column(UUID(as_uuid=True), db.ForeignKey('clinics.id'), nullable=False)
     patient_id = db.Column(UUID(as_uuid=True), db.ForeignKey('patients.id'), nullable=True)
     phone_number = db.Column(db.String(20), nullable=False)
-    messages = db.Column(JSONB, default=list)  # [{role, content, timestamp}]
     context = db.Column(JSONB, default=dict)  # Context for Claude
     status = db.Column(db.String(30), default=ConversationStatus.ACTIVE)
     last_message_at = db.Column(db.DateTime, default=utcnow)
@@ -43,41 +116,158 @@ class Conversation(db.Model, SoftDeleteMixin, TimestampMixin):
     # patient messages newer than this count as unread.
     last_read_at = db.Column(db.DateTime, nullable=True)
 
+    # Denormalized inbox summary, maintained on every message write so the
+    # conversation list never touches conversation_messages.
+    last_message_preview = db.Column(db.String(PREVIEW_LENGTH), nullable=True)
+    last_message_role = db.Column(db.String(20), nullable=True)
+    last_message_type = db.Column(db.String(20), nullable=True)
+    # Patient messages newer than last_read_at; reset by mark-as-read
+    unread_count = db.Column(db.Integer, default=0, nullable=False, server_default='0')
+    message_count = db.Column(db.Integer, default=0, nullable=False, server_default='0')
+
     # Relationships
     bot_transfers = db.relationship(
         'BotTransfer', backref='conversation', lazy='dynamic',
         cascade='all, delete-orphan'
     )
+    message_rows = db.relationship(
+        'ConversationMessage', backref='conversation', lazy='dynamic',
+        cascade='all, delete-orphan', passive_deletes=True
+    )
+
+    def _ordered_messages(self, newest_first: bool = False):
+        """Query over this conversation's messages in chronological (or reverse) order."""
+        if newest_first:
+            order = (ConversationMessage.timestamp.desc(), ConversationMessage.id.desc())
+        else:
+            order = (ConversationMessage.timestamp.asc(), ConversationMessage.id.asc())
+        return self.message_rows.order_by(*order)
+
+    @property
+    def messages(self) -> list:
+        """
+        Full history as a list of message dicts, oldest first.
 
-    def _lock_row(self) -> None:
+        Loads every row - fine for exports and tests, but hot paths should use
+        the targeted helpers below (`recent_messages`, `last_message`,
+        `find_message`...) instead.
+        """
+        return [m.to_dict() for m in self._ordered_messages()]
+
+    @messages.setter
+    def messages(self, value) -> None:
+        """Replace the history with a list of message dicts (same shape as `to_dict()`)."""
+        for row in self.message_rows:
+            self.message_rows.remove(row)
+        for msg in value or []:
+            timestamp = msg.get('timestamp')
+            if isinstance(timestamp, str):
+                timestamp = datetime.fromisoformat(timestamp.replace('Z', '+00:00')).replace(tzinfo=None)
+            self.message_rows.append(ConversationMessage(
+                message_id=msg.get('id') or uuid.uuid4().hex,
+                evolution_id=msg.get('evolution_id'),
+                role=msg.get('role'),
+                content=msg.get('content'),
+                message_type=msg.get('type') or MessageType.TEXT,
+                status=msg.get('status') or MessageStatus.SENT,
+                media_url=msg.get('media_url'),
+                media_mimetype=msg.get('media_mimetype'),
+                caption=msg.get('caption'),
+                sent_via=msg.get('sent_via'),
+                timestamp=timestamp or utcnow(),
+            ))
+        self.refresh_message_summary()
+
+    def refresh_message_summary(self) -> None:
+        """
+        Recompute the denormalized summary columns from the message rows.
+        Only for bulk rewrites (seeding, LGPD erase); regular writes keep them
+        current incrementally.
+        """
+        rows = list(self.message_rows)
+        latest = max(rows, key=lambda r: (r.timestamp, r.id or 0), default=None)
+        self.message_count = len(rows)
+        self.unread_count = sum(
+            1 for r in rows
+            if r.role == 'user' and (not self.last_read_at or r.timestamp > self.last_read_at)
+        )
+        self._set_last_message_summary(latest)
+
+    def _increment(self, **by: int) -> None:
+        """
+        Bump counter columns with a SQL-side `col = col + n`, so concurrent
+        writers (webhook, workers) can't lose each other's updates. Flushed
+        right away: until then the attribute would hold the SQL expression
+        rather than an int; after the flush it is expired and reads back the
+        current value. Not-yet-inserted conversations just add in Python.
         """
-        Lock this conversation's row (SELECT ... FOR UPDATE) and sync
-        `self.messages` to the latest committed value.
-
-        The `messages` JSONB column is mutated via read-modify-write
-        (`self.messages = self.messages + [...]`), which races if two
-        requests for the same conversation run concurrently (the gthread
-        worker allows this). Locking the row first forces the second
-        writer to wait for the first to commit and see its changes,
-        instead of silently overwriting them.
-
-        Uses the raw table (not the ORM entity) because `Conversation.patient`
-        is a `lazy='joined'` backref, and Postgres refuses `FOR UPDATE` on the
-        nullable side of an outer join - going through `Session.refresh()`
-        would pull that join in and fail.
+        state = inspect(self)
+        if not state.persistent:
+            for column, n in by.items():
+                setattr(self, column, (getattr(self, column) or 0) + n)
+            return
+        for column, n in by.items():
+            setattr(self, column, getattr(Conversation, column) + n)
+        state.session.flush()
+
+    def _set_last_message_summary(self, row) -> None:
+        if row is None:
+            self.last_message_preview = self.last_message_role = self.last_message_type = None
+            return
+        self.last_message_preview = (row.content or row.caption or '')[:PREVIEW_LENGTH] or None
+        self.last_message_role = row.role
+        self.last_message_type = row.message_type
+
+    def recent_messages(self, limit: int) -> list:
+        """The last `limit` messages as dicts, oldest first."""
+        rows = self._ordered_messages(newest_first=True).limit(limit).all()
+        return [m.to_dict() for m in reversed(rows)]
+
+    def messages_page(self, before: str = None, limit: int = 50):
         """
-        # Core selects bypass the session's autoflush (it only runs for ORM
-        # statements), so push any pending local mutations first - otherwise
-        # the read-back below would overwrite messages added earlier in this
-        # same transaction with the stale committed value.
-        db.session.flush()
-        row = db.session.execute(
-            db.select(self.__table__.c.messages)
-            .where(self.__table__.c.id == self.id)
-            .with_for_update()
+        Keyset page of the history for lazy loading in the dashboard: the
+        `limit` messages immediately older than message `before` (a public
+        message id), or the most recent ones when `before` is omitted.
+
+        Returns (messages oldest-first, has_more), or None when `before`
+        doesn't name a message of this conversation.
+        """
+        query = self._ordered_messages(newest_first=True)
+        if before:
+            cursor = self.message_rows.filter(ConversationMessage.message_id == before).first()
+            if cursor is None:
+                return None
+            query = query.filter(db.or_(
+                ConversationMessage.timestamp < cursor.timestamp,
+                db.and_(
+                    ConversationMessage.timestamp == cursor.timestamp,
+                    ConversationMessage.id < cursor.id,
+                ),
+            ))
+        rows = query.limit(limit + 1).all()
+        has_more = len(rows) > limit
+        return [m.to_dict() for m in reversed(rows[:limit])], has_more
+
+    def message_slice(self, offset: int, limit: int) -> list:
+        """`limit` messages starting at chronological position `offset`, as dicts."""
+        rows = self._ordered_messages().offset(offset).limit(limit).all()
+        return [m.to_dict() for m in rows]
+
+    def last_message(self, role: str = None) -> dict:
+        """The most recent message (optionally of a given role), or None."""
+        query = self._ordered_messages(newest_first=True)
+        if role:
+            query = query.filter(ConversationMessage.role == role)
+        row = query.first()
+        return row.to_dict() if row else None
+
+    def _find_message_row(self, message_id: str):
+        return self.message_rows.filter(
+            db.or_(
+                ConversationMessage.message_id == message_id,
+                ConversationMessage.evolution_id == message_id,
+            )
         ).first()
-        if row is not None:
-            self.messages = row.messages
 
     def add_message(
         self,
@@ -103,58 +293,67 @@ class Conversation(db.Model, SoftDeleteMixin, TimestampMixin):
         (e.g. 'whatsapp_app' for a staff member replying directly from the
         linked phone) - omitted for normal bot/dashboard-sent messages.
         """
-        self._lock_row()
-
-        if self.messages is None:
-            self.messages = []
-
-        message = {
-            'id': message_id or uuid.uuid4().hex,
-            'evolution_id': evolution_id,
-            'role': role,
-            'content': content,
-            'timestamp': utcnow().isoformat() + 'Z',
-            'status': status,
-            'type': message_type
-        }
-        if media_url:
-            message['media_url'] = media_url
-        if media_mimetype:
-            message['media_mimetype'] = media_mimetype
-        if caption:
-            message['caption'] = caption
-        if sent_via:
-            message['sent_via'] = sent_via
-
-        self.messages = self.messages + [message]
-        self.last_message_at = utcnow()
-        return message
+        now = utcnow()
+        row = ConversationMessage(
+            message_id=message_id or uuid.uuid4().hex,
+            clinic_id=self.clinic_id,
+            evolution_id=evolution_id,
+            role=role,
+            content=content,
+            message_type=message_type,
+            status=status,
+            media_url=media_url or None,
+            media_mimetype=media_mimetype or None,
+            caption=caption or None,
+            sent_via=sent_via or None,
+            timestamp=now,
+        )
+        self.message_rows.append(row)
+        self.last_message_at = now
+        if role == 'user':
+            self._increment(message_count=1, unread_count=1)
+        else:
+            self._increment(message_count=1)
+        self._set_last_message_summary(row)
+        return row.to_dict()
 
     def find_message(self, message_id: str) -> dict:
-        for msg in (self.messages or []):
-            if msg.get('id') == message_id or msg.get('evolution_id') == message_id:
-                return msg
-        return None
+        row = self._find_message_row(message_id)
+        return row.to_dict() if row else None
 
     def update_message_status(self, message_id: str, status: str) -> dict:
         """Update the delivery/read status of a message, matched by its id or evolution_id."""
-        self._lock_row()
-
-        if not self.messages:
+        row = self._find_message_row(message_id)
+        if row is None:
             return None
+        row.status = status
+        return row.to_dict()
 
-        updated = None
-        new_messages = []
-        for msg in self.messages:
-            if msg.get('id') == message_id or msg.get('evolution_id') == message_id:
-                msg = {**msg, 'status': status}
-                updated = msg
-            new_messages.append(msg)
-
-        if updated:
-            self.messages = new_messages
-
-        return updated
+    def patch_message(self, message_id: str, **fields) -> dict:
+        """
+        Update a stored message in place (content, caption, media_url,
+        media_mimetype) - e.g. a media placeholder once its asset and
+        transcript are ready. Keeps the inbox preview in sync when the
+        patched message is the latest one.
+        """
+        row = self._find_message_row(message_id)
+        if row is None:
+            return None
+        for name in ('content', 'caption', 'media_url', 'media_mimetype'):
+            if name in fields:
+                setattr(row, name, fields[name])
+        latest = self._ordered_messages(newest_first=True).first()
+        if latest is not None and latest.id == row.id:
+            self._set_last_message_summary(row)
+        return row.to_dict()
+
+    def set_evolution_id(self, message_id: str, evolution_id: str) -> dict:
+        """Attach the real Evolution/WhatsApp message id to a stored message, matched by its id."""
+        row = self._find_message_row(message_id)
+        if row is None or not evolution_id:
+            return None
+        row.evolution_id = evolution_id
+        return row.to_dict()
 
     def set_evolution_id_for_last_message(self, evolution_id: str, role: str = None) -> dict:
         """
@@ -165,23 +364,15 @@ class Conversation(db.Model, SoftDeleteMixin, TimestampMixin):
         if not evolution_id:
             return None
 
-        self._lock_row()
-
-        if not self.messages:
+        query = self._ordered_messages(newest_first=True)
+        if role:
+            query = query.filter(ConversationMessage.role == role)
+        row = query.first()
+        if row is None or row.evolution_id:
             return None
 
-        new_messages = list(self.messages)
-        for i in range(len(new_messages) - 1, -1, -1):
-            msg = new_messages[i]
-            if role and msg.get('role') != role:
-                continue
-            if msg.get('evolution_id'):
-                break
-            new_messages[i] = {**msg, 'evolution_id': evolution_id}
-            self.messages = new_messages
-            return new_messages[i]
-
-        return None
+        row.evolution_id = evolution_id
+        return row.to_dict()
 
     def attach_evolution_id_by_content(
         self, evolution_id: str, content: str, role: str = 'assistant', lookback: int = 8
@@ -196,17 +387,12 @@ class Conversation(db.Model, SoftDeleteMixin, TimestampMixin):
         if not evolution_id or not content:
             return None
 
-        self._lock_row()
-
-        messages = list(self.messages or [])
-        for i in range(len(messages) - 1, max(len(messages) - 1 - lookback, -1), -1):
-            msg = messages[i]
-            if msg.get('role') != role or msg.get('evolution_id') or msg.get('sent_via'):
+        for row in self._ordered_messages(newest_first=True).limit(lookback):
+            if row.role != role or row.evolution_id or row.sent_via:
                 continue
-            if (msg.get('content') or '') == content:
-                messages[i] = {**msg, 'evolution_id': evolution_id}
-                self.messages = messages
-                return messages[i]
+            if (row.content or '') == content:
+                row.evolution_id = evolution_id
+                return row.to_dict()
         return None
 
     def merge_history_messages(self, historical: list) -> int:
@@ -217,17 +403,27 @@ class Conversation(db.Model, SoftDeleteMixin, TimestampMixin):
         `historical` items are normalized dicts as produced by
         `app.utils.whatsapp_message.normalize_raw_message`: {evolution_id,
         from_me, timestamp (datetime), content, message_type, media_url,
-        media_mimetype, caption}. The merged list is re-sorted by timestamp so
+        media_mimetype, caption}. Rows are ordered by timestamp on read, so
         history stays chronological regardless of fetch/page order.
 
         Returns the number of messages actually added.
         """
-        self._lock_row()
-
-        existing = self.messages or []
-        existing_evolution_ids = {m.get('evolution_id') for m in existing if m.get('evolution_id')}
-
-        new_entries = []
+        incoming_ids = [h['evolution_id'] for h in historical if h.get('evolution_id')]
+        existing_evolution_ids = set()
+        # Only look up the ids in this batch (chunked to stay under the
+        # bind-parameter limits), instead of walking the whole history.
+        for i in range(0, len(incoming_ids), 500):
+            chunk = incoming_ids[i:i + 500]
+            existing_evolution_ids.update(
+                evo_id for (evo_id,) in db.session.query(ConversationMessage.evolution_id).filter(
+                    ConversationMessage.conversation_id == self.id,
+                    ConversationMessage.evolution_id.in_(chunk),
+                )
+            )
+
+        added = 0
+        unread = 0
+        latest = None
         for h in historical:
             evo_id = h.get('evolution_id')
             if evo_id and evo_id in existing_evolution_ids:
@@ -236,52 +432,40 @@ class Conversation(db.Model, SoftDeleteMixin, TimestampMixin):
                 existing_evolution_ids.add(evo_id)
 
             from_me = bool(h.get('from_me'))
-            message = {
-                'id': uuid.uuid4().hex,
-                'evolution_id': evo_id,
-                'role': 'assistant' if from_me else 'user',
-                'content': h['content'],
-                'timestamp': h['timestamp'].isoformat() + 'Z',
-                'status': MessageStatus.READ if from_me else MessageStatus.DELIVERED,
-                'type': h.get('message_type', MessageType.TEXT),
-            }
-            if h.get('media_url'):
-                message['media_url'] = h['media_url']
-            if h.get('media_mimetype'):
-                message['media_mimetype'] = h['media_mimetype']
-            if h.get('caption'):
-                message['caption'] = h['caption']
-            if from_me:
-                message['sent_via'] = 'whatsapp_app'
-            new_entries.append(message)
-
-        if not new_entries:
+            row = ConversationMessage(
+                clinic_id=self.clinic_id,
+                evolution_id=evo_id,
+                role='assistant' if from_me else 'user',
+                content=h['content'],
+                message_type=h.get('message_type', MessageType.TEXT),
+                status=MessageStatus.READ if from_me else MessageStatus.DELIVERED,
+                media_url=h.get('media_url') or None,
+                media_mimetype=h.get('media_mimetype') or None,
+                caption=h.get('caption') or None,
+                sent_via='whatsapp_app' if from_me else None,
+                timestamp=h['timestamp'],
+            )
+            self.message_rows.append(row)
+            added += 1
+            if not from_me and (not self.last_read_at or row.timestamp > self.last_read_at):
+                unread += 1
+            if latest is None or row.timestamp > latest.timestamp:
+                latest = row
+
+        if not added:
             return 0
 
-        merged = existing + new_entries
-        merged.sort(key=lambda m: m['timestamp'])
-        self.messages = merged
+        self._increment(message_count=added, unread_count=unread)
+        if not self.last_message_at or latest.timestamp > self.last_message_at:
+            self.last_message_at = latest.timestamp
+            self._set_last_message_summary(latest)
 
-        last_ts = datetime.fromisoformat(merged[-1]['timestamp'].replace('Z', '+00:00')).replace(tzinfo=None)
-        if not self.last_message_at or last_ts > self.last_message_at:
-            self.last_message_at = last_ts
+        return added
 
-        return len(new_entries)
-
-    def unread_count(self) -> int:
-        """
-        Number of patient messages newer than last_read_at. Message
-        timestamps are fixed-format ISO strings ('...Z'), so lexicographic
-        comparison is chronologically correct.
-        """
-        messages = self.messages or []
-        if not messages:
-            return 0
-        cutoff = self.last_read_at.isoformat() + 'Z' if self.last_read_at else ''
-        return sum(
-            1 for m in messages
-            if m.get('role') == 'user' and (m.get('timestamp') or '') > cutoff
-        )
+    def mark_read(self) -> None:
+        """Staff opened the conversation: everything up to now is read."""
+        self.last_read_at = utcnow()
+        self.unread_count = 0
 
     def to_dict(self, include_messages: bool = True, include_last_message_only: bool = False) -> dict:
         data = {
@@ -292,7 +476,8 @@ class Conversation(db.Model, SoftDeleteMixin, TimestampMixin):
             'phone_number': self.phone_number,
             'status': self.status,
             'urgent': self.urgent,
-            'unread_count': self.unread_count(),
+            'unread_count': self.unread_count or 0,
+            'message_count': self.message_count or 0,
             'last_read_at': self.last_read_at.isoformat() + 'Z' if self.last_read_at else None,
             'last_message_at': self.last_message_at.isoformat() + 'Z' if self.last_message_at else None,
             'created_at': self.created_at.isoformat() if self.created_at else None,
@@ -302,18 +487,47 @@ class Conversation(db.Model, SoftDeleteMixin, TimestampMixin):
         if include_messages:
             data['messages'] = self.messages
             data['context'] = self.context
-        elif include_last_message_only and self.messages:
-            # Include only the last message for list views
-            data['messages'] = [self.messages[-1]] if self.messages else []
+        elif include_last_message_only:
+            # List views: the denormalized summary, no message rows loaded
+            data['last_message_preview'] = self.last_message_preview
+            data['last_message_role'] = self.last_message_role
+            data['last_message_type'] = self.last_message_type
         return data
 
     def __repr__(self) -> str:
         return f'<Conversation {self.id} - {self.phone_number}>'
 
 
+@db.event.listens_for(ConversationMessage, 'before_insert')
+def _inherit_clinic_id(mapper, connection, target):
+    # Rows seeded through `Conversation.messages = [...]` may be built before
+    # the parent's clinic_id is assigned (constructor kwargs order).
+    if target.clinic_id is None and target.conversation is not None:
+        target.clinic_id = target.conversation.clinic_id
+
+
 # Create indexes
 db.Index('ix_conversations_clinic_id', Conversation.clinic_id)
 db.Index('ix_conversations_last_message_at', Conversation.last_message_at)
 db.Index('ix_conversations_phone_number', Conversation.phone_number)
 # Composite index for common queries
 db.Index('ix_conversations_clinic_patient', Conversation.clinic_id, Conversation.patient_id)
+
+db.Index('ix_conversation_messages_message_id', ConversationMessage.message_id, unique=True)
+# Chronological reads (history window, pagination) and ACK matching within a conversation
+db.Index(
+    'ix_conversation_messages_conversation_ts',
+    ConversationMessage.conversation_id, ConversationMessage.timestamp, ConversationMessage.id
+)
+db.Index(
+    'ix_conversation_messages_conversation_evolution',
+    ConversationMessage.conversation_id, ConversationMessage.evolution_id
+)
+# Clinic-wide ACK matching: a delivery/read webhook only carries the WhatsApp
+# message id, so it resolves straight to the one message row through this.
+db.Index(
+    'ix_conversation_messages_clinic_evolution',
+    ConversationMessage.clinic_id, ConversationMessage.evolution_id
+)
+# Search indexes (tsvector + pg_trgm GIN over content) are PostgreSQL-only
+# and live in migration 26 - see app/services/search_service.py.
@@ -4,13 +4,18 @@ MediaAsset: our own copy of WhatsApp media (images, voice notes, documents).
 The media URLs Evolution/Baileys deliver point at WhatsApp's CDN, where the
 content is end-to-end encrypted and the links expire - rendering them in the
 dashboard breaks within days. Media is instead downloaded (decrypted) via
-Evolution at webhook time and stored here, and messages reference it through
-the authenticated `/api/media/<id>` endpoint.
+Evolution and stored by us, and messages reference it through the
+authenticated `/api/media/<id>` endpoint.
+
+The row holds metadata only; the bytes live in the content-addressed media
+store (utils/media_storage.py) under `sha256`, shared by every asset with
+the same content.
 """
 import uuid
 
 from app import db
 from app.models.types import UUID
+from app.utils.media_storage import get_media_storage
 from .mixins import TimestampMixin
 
 # Aligned with the frontend composer's client-side cap.
@@ -24,7 +29,24 @@ class MediaAsset(db.Model, TimestampMixin):
     clinic_id = db.Column(UUID(as_uuid=True), db.ForeignKey('clinics.id'), nullable=False, index=True)
     mimetype = db.Column(db.String(120), nullable=False)
     filename = db.Column(db.String(255), nullable=True)
-    data = db.Column(db.LargeBinary, nullable=False)
+    sha256 = db.Column(db.String(64), nullable=False, index=True)
+    size = db.Column(db.Integer, nullable=False)
+
+    @property
+    def data(self) -> bytes:
+        """The full content, read from the media store."""
+        return get_media_storage().get(self.sha256)
+
+    @data.setter
+    def data(self, value: bytes) -> None:
+        # Written to the store right away (a no-op for known content), so the
+        # blob exists before this row can commit.
+        self.sha256 = get_media_storage().put(value)
+        self.size = len(value)
+
+    def iter_content(self, start: int = 0, end: int = None):
+        """Stream the content (optionally bytes [start, end]) from the media store."""
+        return get_media_storage().iter_chunks(self.sha256, start, end)
 
     @property
     def public_path(self) -> str:
@@ -36,7 +58,7 @@ class MediaAsset(db.Model, TimestampMixin):
             'id': str(self.id),
             'mimetype': self.mimetype,
             'filename': self.filename,
-            'size': len(self.data) if self.data is not None else 0,
+            'size': self.size or 0,
             'url': self.public_path,
         }
 
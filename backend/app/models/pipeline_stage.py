@@ -54,6 +54,16 @@ class PipelineStage(db.Model, TimestampMixin):
     def __repr__(self) -> str:
         return f'<PipelineStage {self.name}>'
 
+
+@event.listens_for(PipelineStage, 'after_insert')
+@event.listens_for(PipelineStage, 'after_update')
+@event.listens_for(PipelineStage, 'after_delete')
+def _bump_clinic_config_version(mapper, connection, target):
+    # The agent's prompt lists the clinic's pipeline stages
+    from app.models.clinic import Clinic
+    Clinic.bump_config_version(connection, target.clinic_id)
+
+
 # Create indexes
 db.Index('ix_pipeline_stages_clinic_id', PipelineStage.clinic_id)
 db.Index('ix_pipeline_stages_order', PipelineStage.order)
@@ -97,6 +97,15 @@ class Professional(db.Model, TimestampMixin):
         return f'<Professional {self.name}>'
 
 
+@db.event.listens_for(Professional, 'after_insert')
+@db.event.listens_for(Professional, 'after_update')
+@db.event.listens_for(Professional, 'after_delete')
+def _bump_clinic_config_version(mapper, connection, target):
+    # The agent's prompt lists the clinic's active professionals
+    from app.models.clinic import Clinic
+    Clinic.bump_config_version(connection, target.clinic_id)
+
+
 # Create indexes
 db.Index('ix_professionals_clinic_id', Professional.clinic_id)
 db.Index('ix_professionals_active', Professional.active)
@@ -21,6 +21,16 @@ def update_agent_config(current_clinic):
         current_clinic.agent_system_prompt = data['system_prompt']
     if 'context' in data:
         current_clinic.agent_context = data['context']
+    if 'history_token_budget' in data:
+        budget = data['history_token_budget']
+        try:
+            budget = int(budget) if budget is not None else None
+        except (TypeError, ValueError):
+            return jsonify({'error': 'history_token_budget must be an integer'}), 400
+        try:
+            current_clinic.agent_history_token_budget = budget
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
 
     db.session.commit()
 
@@ -31,7 +41,8 @@ def update_agent_config(current_clinic):
             'model': current_app.config.get('OPENROUTER_MODEL', 'anthropic/claude-sonnet-4.5'),
             'temperature': current_clinic.agent_temperature,
             'system_prompt': current_clinic.agent_system_prompt,
-            'context': current_clinic.agent_context
+            'context': current_clinic.agent_context,
+            'history_token_budget': current_clinic.agent_history_token_budget
         }
     }), 200
 
@@ -43,7 +54,11 @@ def get_agent_config(current_clinic):
         'model': current_app.config.get('OPENROUTER_MODEL', 'anthropic/claude-sonnet-4.5'),
         'temperature': current_clinic.agent_temperature if current_clinic.agent_temperature is not None else 0.7,
         'system_prompt': current_clinic.agent_system_prompt or '',
-        'context': current_clinic.agent_context or ''
+        'context': current_clinic.agent_context or '',
+        'history_token_budget': (
+            current_clinic.agent_history_token_budget
+            or current_app.config.get('AGENT_HISTORY_TOKEN_BUDGET', 6000)
+        )
     }), 200
 
 @bp.route('/test', methods=['POST'])
@@ -9,6 +9,7 @@ from app.models import (
     Appointment, Patient, Conversation, AppointmentStatus, ConversationStatus,
     AgentAction,
 )
+from app.services import reply_queue
 from app.utils.auth import clinic_required
 
 logger = logging.getLogger(__name__)
@@ -283,3 +284,13 @@ def agent_actions(current_clinic):
         'actions': [a.to_dict() for a in actions],
         'summary_30d': summary,
     })
+
+
+@bp.route('/reply-queue', methods=['GET'])
+@clinic_required
+def reply_queue_stats(current_clinic):
+    """
+    This clinic's AI reply backlog: replies queued and in flight, and how long
+    replies waited for a worker over the current hour.
+    """
+    return jsonify(reply_queue.clinic_queue_stats(str(current_clinic.id)))
@@ -5,13 +5,13 @@ import logging
 from flask import Blueprint, request, jsonify, Response, stream_with_context
 
 from app import db
-from app.models import Conversation, BotTransfer, ConversationStatus, Patient, MediaAsset
+from app.models import Conversation, BotTransfer, ConversationStatus, MediaAsset
 from app.services.conversation_service import ConversationService
+from app.services.search_service import ConversationSearchService
 from app.services.evolution_service import EvolutionService
 from app.services.patient_service import PatientService
-from app.services import realtime_service
+from app.services import outbound_queue, realtime_service
 from app.utils.auth import clinic_required, clinic_required_stream
-from app.utils.datetime_utils import utcnow
 from app.utils.pagination import get_pagination_params
 from app.utils.validators import normalize_phone
 
@@ -23,6 +23,29 @@ ALLOWED_MEDIA_TYPES = {'image', 'audio', 'document'}
 # WhatsApp rejects text bodies longer than this
 MAX_TEXT_LENGTH = 4096
 MAX_QUICK_REPLIES = 50
+# Message page size for the chat view (GET /<id>?before=&limit=)
+DEFAULT_MESSAGES_PAGE = 50
+MAX_MESSAGES_PAGE = 200
+
+
+def _conversation_detail(conversation, before: str = None, limit: int = DEFAULT_MESSAGES_PAGE):
+    """
+    Conversation payload for the chat view with one page of messages (the
+    most recent, or those older than `before`). Returns None for an unknown
+    cursor.
+    """
+    page = conversation.messages_page(before=before, limit=limit)
+    if page is None:
+        return None
+    messages, has_more = page
+
+    data = conversation.to_dict(include_messages=False)
+    data['context'] = conversation.context
+    data['messages'] = messages
+    data['has_more_messages'] = has_more
+    # Cursor for the next (older) page
+    data['next_before'] = messages[0]['id'] if has_more and messages else None
+    return data
 
 
 @bp.route('/stream', methods=['GET'])
@@ -61,7 +84,11 @@ def list_conversations(current_clinic):
     needs_attention = request.args.get('needs_attention', type=bool)
     search = request.args.get('search')
 
-    query = Conversation.query.filter_by(clinic_id=current_clinic.id)
+    # Inbox rows render from the denormalized summary columns; never load
+    # the (potentially large) Claude context for a list page.
+    query = Conversation.query.filter_by(clinic_id=current_clinic.id).options(
+        db.defer(Conversation.context)
+    )
 
     if status:
         query = query.filter_by(status=status)
@@ -69,25 +96,29 @@ def list_conversations(current_clinic):
     if needs_attention:
         query = query.filter_by(status=ConversationStatus.TRANSFERRED_TO_HUMAN)
 
-    if search:
-        search_term = f'%{search}%'
-        query = query.join(Patient, Conversation.patient_id == Patient.id, isouter=True).filter(
-            db.or_(
-                Patient.name.ilike(search_term),
-                Conversation.phone_number.ilike(search_term),
-                # Also match message content ("cadê aquela conversa sobre
-                # clareamento?"). Casting the JSONB to text is a full scan,
-                # acceptable at per-clinic volumes.
-                db.cast(Conversation.messages, db.Text).ilike(search_term)
-            )
-        )
-
-    query = query.order_by(Conversation.last_message_at.desc())
+    search = (search or '').strip()
+    search_service = ConversationSearchService(current_clinic) if search else None
+    if search_service:
+        # Ranked match on message content ("cadê aquela conversa sobre
+        # clareamento?"), patient name or phone - index-backed on Postgres.
+        query = search_service.conversations_query(search, base_query=query)
+    else:
+        query = query.order_by(Conversation.last_message_at.desc())
 
     pagination = query.paginate(page=page, per_page=per_page, error_out=False)
 
+    items = [c.to_dict(include_messages=False, include_last_message_only=True) for c in pagination.items]
+    if search_service:
+        snippets = search_service.snippets([c.id for c in pagination.items], search)
+        for item in items:
+            hit = snippets.get(item['id'])
+            if hit:
+                item['search_snippet'] = hit['snippet']
+                item['search_highlights'] = hit['highlights']
+                item['search_message_id'] = hit['message_id']
+
     return jsonify({
-        'conversations': [c.to_dict(include_messages=False, include_last_message_only=True) for c in pagination.items],
+        'conversations': items,
         'total': pagination.total,
         'pages': pagination.pages,
         'current_page': page,
@@ -119,7 +150,18 @@ def sync_all_conversations_history(current_clinic):
 @bp.route('/<conversation_id>', methods=['GET'])
 @clinic_required
 def get_conversation(conversation_id, current_clinic):
-    """Get conversation details with full message history."""
+    """
+    Get conversation details with a page of its message history.
+
+    Keyset-paginated: returns the `limit` most recent messages by default;
+    `?before=<message_id>` returns the page just older than that message,
+    so the dashboard can lazy-load history on scroll. `has_more_messages` /
+    `next_before` drive the next request.
+    """
+    limit = request.args.get('limit', DEFAULT_MESSAGES_PAGE, type=int)
+    limit = min(max(1, limit), MAX_MESSAGES_PAGE)
+    before = request.args.get('before') or None
+
     conversation = Conversation.query.filter_by(
         id=conversation_id,
         clinic_id=current_clinic.id
@@ -133,7 +175,9 @@ def get_conversation(conversation_id, current_clinic):
         conversation_id=conversation.id
     ).order_by(BotTransfer.transferred_at.desc()).all()
 
-    data = conversation.to_dict(include_messages=True)
+    data = _conversation_detail(conversation, before=before, limit=limit)
+    if data is None:
+        return jsonify({'error': 'Invalid cursor'}), 400
     data['transfers'] = [t.to_dict() for t in transfers]
 
     return jsonify(data)
@@ -160,7 +204,7 @@ def sync_conversation_history(conversation_id, current_clinic):
     return jsonify({
         'message': f'{added} mensagem(ns) importada(s)' if added else 'Nenhuma mensagem nova encontrada',
         'added': added,
-        'conversation': conversation.to_dict(include_messages=True)
+        'conversation': _conversation_detail(conversation)
     })
 
 
@@ -176,7 +220,7 @@ def mark_conversation_read(conversation_id, current_clinic):
     if not conversation:
         return jsonify({'error': 'Conversation not found'}), 404
 
-    conversation.last_read_at = utcnow()
+    conversation.mark_read()
     db.session.commit()
 
     return jsonify({'unread_count': 0, 'last_read_at': conversation.last_read_at.isoformat() + 'Z'})
@@ -375,7 +419,7 @@ def send_manual_message(conversation_id, current_clinic):
     evolution = EvolutionService(current_clinic)
 
     try:
-        result = evolution.send_message(conversation.phone_number, message)
+        result = outbound_queue.send(evolution, conversation.phone_number, message)
     except Exception:
         logger.exception('Failed to send manual message on conversation %s', conversation_id)
         return jsonify({'error': 'Falha ao enviar a mensagem'}), 500
@@ -478,7 +522,7 @@ def send_media_message(conversation_id, current_clinic):
     evolution_message_id = ((result or {}).get('key') or {}).get('id')
 
     # Persist our own copy and reference it by URL - storing multi-MB data
-    # URIs inside the conversation JSONB bloats every later read of the
+    # URIs inside the message history bloats every later read of the
     # thread.
     asset = MediaAsset(
         clinic_id=current_clinic.id,
@@ -31,6 +31,10 @@ def readiness_check():
     Readiness check - verifies all dependencies are available.
     Returns 200 if ready to serve traffic, 503 otherwise.
     """
+    # Unauthenticated: only healthy/unhealthy checks here. The reply
+    # backlog is logged by `flask chat-worker` and, per clinic, served by
+    # the authenticated /api/analytics/reply-queue; HTTP pool reuse is
+    # logged by each process (utils/http_pool.py).
     checks = {
         'database': check_database(),
     }
@@ -4,11 +4,19 @@ Serve stored WhatsApp media (see models/media_asset.py).
 Media is rendered by the browser via <img src>/<audio src>, which cannot set
 an Authorization header - so, like the SSE stream, this endpoint also accepts
 the JWT as a `?token=` query param (JWT_QUERY_STRING_NAME).
+
+Content is streamed from the media store in chunks, never loaded whole.
+Responses carry a strong ETag (the content hash) and Last-Modified, and
+honour If-None-Match (304) and single byte ranges (206), so re-rendering a
+chat or scrubbing through a voice note doesn't re-download whole files.
 """
-from flask import Blueprint, Response, jsonify
+from datetime import timezone
+
+from flask import Blueprint, Response, jsonify, request
 from flask_jwt_extended import verify_jwt_in_request
 from flask_jwt_extended.exceptions import JWTExtendedException
 from jwt.exceptions import PyJWTError
+from werkzeug.http import http_date
 
 from app.models import MediaAsset
 from app.utils.auth import get_current_clinic
@@ -43,16 +51,59 @@ def get_media(asset_id):
     inline_ok = mimetype.split('/', 1)[0].lower() in ('image', 'audio')
     disposition = 'inline' if inline_ok else 'attachment'
 
+    # An asset's content never changes, so its hash is a strong validator
+    # and the browser may keep it for as long as it likes.
+    etag = asset.sha256
+    last_modified = asset.created_at.replace(microsecond=0, tzinfo=timezone.utc)
+    headers = {
+        'ETag': f'"{etag}"',
+        'Last-Modified': http_date(last_modified),
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': 'private, max-age=31536000, immutable',
+        'Content-Disposition': f'{disposition}; filename="{filename}"',
+        # Don't let the browser MIME-sniff a served blob into executable
+        # HTML, and sandbox it so any HTML/JS in the payload can't run in
+        # our origin (stored-XSS defence for patient/staff-supplied media).
+        'X-Content-Type-Options': 'nosniff',
+        'Content-Security-Policy': "default-src 'none'; sandbox",
+    }
+
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers=headers)
+
+    size = asset.size
+    byte_range = request.range
+    # If-Range: only honour the range while the client's copy is current -
+    # a strong ETag equal to ours, or exactly our Last-Modified date.
+    # Anything else (including a weak ETag) gets the full 200.
+    if byte_range is not None and request.headers.get('If-Range'):
+        if_range = request.if_range
+        if if_range.date is not None:
+            current = if_range.date == last_modified
+        else:
+            current = if_range.etag == etag and not request.headers['If-Range'].lstrip().startswith('W/')
+        if not current:
+            byte_range = None
+    if byte_range is not None and byte_range.units == 'bytes' and len(byte_range.ranges) == 1:
+        bounds = byte_range.range_for_length(size)
+        if bounds is None:
+            return Response(status=416, headers={**headers, 'Content-Range': f'bytes */{size}'})
+        start, stop = bounds
+        return Response(
+            asset.iter_content(start, stop - 1),
+            status=206,
+            mimetype=mimetype,
+            headers={
+                **headers,
+                'Content-Range': f'bytes {start}-{stop - 1}/{size}',
+                'Content-Length': str(stop - start),
+            },
+        )
+
+    # Multi-range requests (rare; browsers never send them for media) get
+    # the whole body, which RFC 9110 allows.
     return Response(
-        asset.data,
+        asset.iter_content(),
         mimetype=mimetype,
-        headers={
-            'Cache-Control': 'private, max-age=86400',
-            'Content-Disposition': f'{disposition}; filename="{filename}"',
-            # Don't let the browser MIME-sniff a served blob into executable
-            # HTML, and sandbox it so any HTML/JS in the payload can't run in
-            # our origin (stored-XSS defence for patient/staff-supplied media).
-            'X-Content-Type-Options': 'nosniff',
-            'Content-Security-Policy': "default-src 'none'; sandbox",
-        }
+        headers={**headers, 'Content-Length': str(size)},
     )
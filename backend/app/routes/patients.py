@@ -4,7 +4,7 @@ from sqlalchemy import or_
 
 from app.utils.datetime_utils import utcnow
 from app import db
-from app.models import Patient, PipelineStage, Conversation
+from app.models import Patient, PipelineStage, Conversation, ConversationMessage, MediaAsset, AudioTranscript
 from app.services.patient_service import PatientService
 from app.utils.auth import clinic_required
 from app.utils.pagination import get_pagination_params
@@ -280,8 +280,9 @@ def erase_patient_data(patient_id, current_clinic):
     LGPD right to erasure - irreversibly anonymize a patient's personal data.
 
     Requires an explicit confirmation flag since this cannot be undone. Scrubs
-    the patient's identifying fields and any personal text stored in their
-    WhatsApp conversation transcripts.
+    the patient's identifying fields, any personal text stored in their
+    WhatsApp conversation transcripts and the cached transcriptions of their
+    voice notes.
     """
     data = request.get_json(silent=True) or {}
     if not data.get('confirm'):
@@ -303,17 +304,40 @@ def erase_patient_data(patient_id, current_clinic):
     patient.anonymize()
 
     for conversation in conversations:
-        scrubbed_messages = []
-        for message in (conversation.messages or []):
-            scrubbed = dict(message)
-            scrubbed['content'] = '[dados removidos a pedido do titular - LGPD]'
-            for media_key in ('media_url', 'media_base64', 'caption', 'filename'):
-                if media_key in scrubbed:
-                    scrubbed[media_key] = None
-            scrubbed_messages.append(scrubbed)
-        conversation.messages = scrubbed_messages
         conversation.phone_number = patient.phone
 
+    if conversations:
+        # Cached voice-note transcriptions are keyed by the audio's hash, so
+        # find them through the media the messages point at - before the
+        # links are scrubbed below
+        media_urls = db.session.query(ConversationMessage.media_url).filter(
+            ConversationMessage.conversation_id.in_([c.id for c in conversations]),
+            ConversationMessage.media_url.startswith('/api/media/'),
+        ).all()
+        asset_ids = [url.rsplit('/', 1)[-1] for (url,) in media_urls]
+        if asset_ids:
+            hashes = db.session.query(MediaAsset.sha256).filter(
+                MediaAsset.clinic_id == current_clinic.id,
+                MediaAsset.id.in_(asset_ids),
+            )
+            AudioTranscript.query.filter(
+                AudioTranscript.clinic_id == current_clinic.id,
+                AudioTranscript.sha256.in_(hashes.scalar_subquery()),
+            ).delete(synchronize_session=False)
+
+        redacted = '[dados removidos a pedido do titular - LGPD]'
+        ConversationMessage.query.filter(
+            ConversationMessage.conversation_id.in_([c.id for c in conversations])
+        ).update({
+            'content': redacted,
+            'media_url': None,
+            'caption': None,
+        }, synchronize_session='fetch')
+        # The inbox preview is a copy of the last message's content
+        for conversation in conversations:
+            if conversation.last_message_preview:
+                conversation.last_message_preview = redacted
+
     db.session.commit()
 
     return jsonify({'message': 'Dados do paciente removidos com sucesso'})
@@ -1,22 +1,21 @@
-import base64
-import binascii
 import logging
 
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, current_app, request, jsonify
 from flask_limiter.util import get_remote_address
 
 from app import db
 from app.models import (
-    Clinic, Conversation, ConversationStatus, Patient,
-    MediaAsset, MAX_MEDIA_BYTES,
+    Conversation, ConversationStatus, Patient,
 )
-from app.services.claude_service import ClaudeService
+from app.models.conversation import MessageStatus
 from app.services.evolution_service import EvolutionService
 from app.services.conversation_service import ConversationService
 from app.services.email_service import EmailService
+from app.services.media_pipeline import schedule_media_ingest
 from app.services.message_processor import enqueue_reply
 from app.services.outreach_service import is_opt_out_message
 from app.services.realtime_service import publish_event
+from app.services import instance_cache, outbound_queue, webhook_dedup, webhook_queue
 from app.utils.datetime_utils import utcnow
 from app.utils.validators import normalize_phone
 from app.utils.webhook_auth import webhook_auth_required
@@ -38,10 +37,7 @@ ACK_STATUS_MAP = {
 
 
 def _find_clinic_by_instance(instance_name: str):
-    return Clinic.query.filter_by(
-        evolution_instance_name=instance_name,
-        active=True
-    ).first()
+    return instance_cache.get_active_clinic(instance_name)
 
 
 def _webhook_rate_limit_key():
@@ -72,13 +68,30 @@ def evolution_webhook():
     Inbound patient messages are STORED synchronously (so they are never
     lost and duplicates are detectable) and answered asynchronously by the
     message_processor pipeline, which debounces bursts and retries delivery.
+
+    With WEBHOOK_ASYNC_INGEST on, even the storing is deferred: the payload
+    is appended to the durable webhook queue and acknowledged with 202, and
+    `flask webhook-worker` runs the same handling (see webhook_queue).
     """
-    try:
-        payload = request.get_json()
+    payload = request.get_json(silent=True)
+    if not payload:
+        return jsonify({'error': 'No payload'}), 400
+
+    if current_app.config.get('WEBHOOK_ASYNC_INGEST'):
+        entry_id = webhook_queue.enqueue(payload)
+        if entry_id is not None:
+            return jsonify({'status': 'queued'}), 202
 
-        if not payload:
-            return jsonify({'error': 'No payload'}), 400
+    return process_evolution_payload(payload)
 
+
+def process_evolution_payload(payload: dict):
+    """
+    Handle one Evolution API webhook payload and return the JSON response.
+    Shared by the webhook route (inline mode) and the webhook queue worker,
+    which only needs an app context.
+    """
+    try:
         event = payload.get('event')
         instance_name = payload.get('instance')
 
@@ -95,198 +108,205 @@ def evolution_webhook():
             return jsonify({'status': 'ignored', 'reason': 'Not a handled event'})
 
         data = payload.get('data', {})
+        evolution_message_id = (data.get('key') or {}).get('id')
 
-        # Extract message info
-        key = data.get('key', {})
-        remote_jid = key.get('remoteJid', '')
-        from_me = key.get('fromMe', False)
-        evolution_message_id = key.get('id')
+        # Idempotency: Evolution retries webhook deliveries (e.g. on slow
+        # responses) and, depending on instance config, also echoes messages
+        # sent through its own API back as fromMe upserts. Redis answers
+        # repeats of handled messages before any database work; without it,
+        # or while another delivery holds the claim, the stored message id
+        # is checked once the clinic is known.
+        claimed = webhook_dedup.claim(instance_name, evolution_message_id)
+        if claimed is False:
+            return jsonify({'status': 'duplicate', 'reason': 'Message already processed'})
 
-        # Ignore group messages
-        if '@g.us' in remote_jid:
-            return jsonify({'status': 'ignored', 'reason': 'Group message'})
+        try:
+            response = _handle_message_upsert(
+                instance_name, data, check_stored_duplicate=claimed is None
+            )
+        except Exception:
+            if claimed:
+                webhook_dedup.release(instance_name, evolution_message_id)
+            raise
+
+        # 'done' only once the message was stored or deliberately handled
+        # (a 2xx). Anything else - e.g. a 404 for an instance not linked to
+        # a clinic yet - stored nothing, so a redelivery must run again.
+        status_code = response[1] if isinstance(response, tuple) else response.status_code
+        if 200 <= status_code < 300:
+            webhook_dedup.complete(instance_name, evolution_message_id)
+        elif claimed:
+            # Only our own claim - never another delivery's 'processing' key
+            webhook_dedup.release(instance_name, evolution_message_id)
+        return response
 
-        # Extract phone number
-        phone = remote_jid.split('@')[0]
+    except Exception as e:
+        logger.exception('Error processing webhook: %s', str(e))
+        return jsonify({'error': 'Internal server error'}), 500
 
-        # Get message content
-        message_obj = data.get('message', {})
-        message_text = extract_text(message_obj)
-        media = None if message_text else extract_media(message_obj)
 
-        if not message_text and not media:
-            return jsonify({'status': 'ignored', 'reason': 'No text or media content'})
+def _handle_message_upsert(instance_name: str, data: dict, check_stored_duplicate: bool = True):
+    """Handle a messages.upsert event: store the message and route it."""
+    # Extract message info
+    key = data.get('key', {})
+    remote_jid = key.get('remoteJid', '')
+    from_me = key.get('fromMe', False)
+    evolution_message_id = key.get('id')
 
-        clinic = _find_clinic_by_instance(instance_name)
+    # Ignore group messages
+    if '@g.us' in remote_jid:
+        return jsonify({'status': 'ignored', 'reason': 'Group message'})
 
-        if not clinic:
-            logger.warning('No clinic found for instance: %s', instance_name)
-            return jsonify({'error': 'Clinic not found'}), 404
+    # Extract phone number
+    phone = remote_jid.split('@')[0]
 
-        conversation_service = ConversationService(clinic)
-        conversation = conversation_service.get_or_create_conversation(phone)
+    # Get message content
+    message_obj = data.get('message', {})
+    message_text = extract_text(message_obj)
+    media = None if message_text else extract_media(message_obj)
 
-        # Idempotency: Evolution retries webhook deliveries (e.g. on slow
-        # responses) and, depending on instance config, also echoes messages
-        # sent through its own API back as fromMe upserts. A message id we
-        # already stored means this delivery is a duplicate.
-        if evolution_message_id and conversation.find_message(evolution_message_id):
-            return jsonify({'status': 'duplicate', 'reason': 'Message already processed'})
+    if not message_text and not media:
+        return jsonify({'status': 'ignored', 'reason': 'No text or media content'})
 
-        # Sent from the clinic's own WhatsApp number (fromMe)
-        if from_me:
-            # The echo of a bot reply can arrive before the send result had
-            # its id attached - recognize it by content instead of treating
-            # it as a human takeover.
-            if message_text and conversation.attach_evolution_id_by_content(
-                evolution_message_id, message_text
-            ):
-                db.session.commit()
-                return jsonify({'status': 'processed', 'reason': 'Own message echo'})
-
-            # Genuinely sent from the linked phone (e.g. a staff member
-            # replying manually). Keep it in the conversation so it shows up
-            # in the dashboard and the AI has full context, but hand off to a
-            # human since someone is already handling this chat outside the
-            # bot.
-            if media:
-                media_type, media_url, mimetype, caption = media
-                content = caption or MEDIA_PLACEHOLDER_TEXT.get(media_type, 'Midia enviada')
-            else:
-                media_type, media_url, mimetype, caption = 'text', None, None, None
-                content = message_text
-
-            if conversation.status != ConversationStatus.TRANSFERRED_TO_HUMAN:
-                conversation_service.transfer_to_human(
-                    conversation,
-                    'Mensagem enviada diretamente pelo WhatsApp (fora da plataforma)'
-                )
+    clinic = _find_clinic_by_instance(instance_name)
 
-            conversation_service.add_message(
-                conversation,
-                'assistant',
-                content,
-                evolution_id=evolution_message_id,
-                message_type=media_type,
-                media_url=media_url,
-                media_mimetype=mimetype,
-                caption=caption,
-                sent_via='whatsapp_app'
-            )
-            return jsonify({'status': 'processed', 'reason': 'Message from self stored'})
+    if not clinic:
+        logger.warning('No clinic found for instance: %s', instance_name)
+        return jsonify({'error': 'Clinic not found'}), 404
+
+    conversation_service = ConversationService(clinic)
 
+    # No Redis claim was possible: a message id we already stored means
+    # this delivery is a duplicate (indexed lookup, before creating
+    # anything).
+    if (
+        check_stored_duplicate
+        and evolution_message_id
+        and conversation_service.find_message_by_evolution_id(evolution_message_id)
+    ):
+        return jsonify({'status': 'duplicate', 'reason': 'Message already processed'})
+
+    conversation = conversation_service.get_or_create_conversation(phone)
+
+    # Sent from the clinic's own WhatsApp number (fromMe)
+    if from_me:
+        # The echo of a bot reply can arrive before the send result had
+        # its id attached - recognize it by content instead of treating
+        # it as a human takeover.
+        if message_text and conversation.attach_evolution_id_by_content(
+            evolution_message_id, message_text
+        ):
+            db.session.commit()
+            return jsonify({'status': 'processed', 'reason': 'Own message echo'})
+
+        # Genuinely sent from the linked phone (e.g. a staff member
+        # replying manually). Keep it in the conversation so it shows up
+        # in the dashboard and the AI has full context, but hand off to a
+        # human since someone is already handling this chat outside the
+        # bot.
         if media:
-            return _handle_inbound_media(
-                clinic, conversation_service, conversation,
-                media, evolution_message_id, phone
+            media_type, media_url, mimetype, caption = media
+            content = caption or MEDIA_PLACEHOLDER_TEXT.get(media_type, 'Midia enviada')
+        else:
+            media_type, media_url, mimetype, caption = 'text', None, None, None
+            content = message_text
+
+        if conversation.status != ConversationStatus.TRANSFERRED_TO_HUMAN:
+            conversation_service.transfer_to_human(
+                conversation,
+                'Mensagem enviada diretamente pelo WhatsApp (fora da plataforma)'
             )
 
-        logger.info('Received message from %s: %s', phone, message_text[:50])
-
-        # Store the patient's message immediately: it must reach the
-        # dashboard (and the dedup check above) regardless of what happens
-        # to the AI reply.
         conversation_service.add_message(
-            conversation, 'user', message_text, evolution_id=evolution_message_id
+            conversation,
+            'assistant',
+            content,
+            evolution_id=evolution_message_id,
+            message_type=media_type,
+            media_url=media_url,
+            media_mimetype=mimetype,
+            caption=caption,
+            sent_via='whatsapp_app'
         )
+        return jsonify({'status': 'processed', 'reason': 'Message from self stored'})
 
-        # Opt-out handling. If the patient asks to stop proactive contact
-        # ("SAIR"), honour it immediately - independently of the agent being
-        # enabled - and confirm. Reactive replies keep working; only
-        # agent-initiated (proactive) messages are suppressed.
-        if is_opt_out_message(message_text):
-            patient = conversation.patient or Patient.query.filter_by(
-                clinic_id=clinic.id, phone=phone
-            ).first()
-            if patient and not patient.whatsapp_opt_out:
-                patient.opt_out_whatsapp()
-                db.session.commit()
-            opt_out_reply = (
-                'Pronto! Você não receberá mais mensagens automáticas nossas. '
-                'Se precisar de algo, é só chamar por aqui. 😊'
-            )
-            conversation_service.add_message(conversation, 'assistant', opt_out_reply)
-            EvolutionService(clinic).send_message(phone, opt_out_reply)
-            return jsonify({'status': 'processed', 'reason': 'Opt-out recorded'})
-
-        # Agent switched off: this is "manual mode", never a black hole - the
-        # message stays stored and visible in the dashboard, we just don't
-        # generate a reply.
-        if not clinic.agent_enabled:
-            logger.info('Agent disabled for clinic %s, message stored for manual handling', clinic.name)
-            return jsonify({'status': 'stored', 'reason': 'Agent disabled - stored for manual handling'})
-
-        # Conversation paused (human support): same, store-only.
-        if conversation.status == ConversationStatus.TRANSFERRED_TO_HUMAN:
-            logger.info('Conversation %s is paused (human support), message stored', conversation.id)
-            return jsonify({'status': 'stored', 'reason': 'Conversation paused'})
-
-        # Hand off to the background pipeline (debounced burst aggregation,
-        # send retries, failure marking).
-        mode = enqueue_reply(clinic, conversation, phone)
-        return jsonify({'status': 'processed', 'mode': mode})
+    if media:
+        return _handle_inbound_media(
+            clinic, conversation_service, conversation,
+            media, evolution_message_id, phone
+        )
 
-    except Exception as e:
-        logger.exception('Error processing webhook: %s', str(e))
-        return jsonify({'error': 'Internal server error'}), 500
+    logger.info('Received message from %s: %s', phone, message_text[:50])
+
+    # Store the patient's message immediately: it must reach the
+    # dashboard (and the dedup check above) regardless of what happens
+    # to the AI reply.
+    conversation_service.add_message(
+        conversation, 'user', message_text, evolution_id=evolution_message_id
+    )
+
+    # Opt-out handling. If the patient asks to stop proactive contact
+    # ("SAIR"), honour it immediately - independently of the agent being
+    # enabled - and confirm. Reactive replies keep working; only
+    # agent-initiated (proactive) messages are suppressed.
+    if is_opt_out_message(message_text):
+        patient = conversation.patient or Patient.query.filter_by(
+            clinic_id=clinic.id, phone=phone
+        ).first()
+        if patient and not patient.whatsapp_opt_out:
+            patient.opt_out_whatsapp()
+            db.session.commit()
+        opt_out_reply = (
+            'Pronto! Você não receberá mais mensagens automáticas nossas. '
+            'Se precisar de algo, é só chamar por aqui. 😊'
+        )
+        sent = conversation_service.add_message(conversation, 'assistant', opt_out_reply)
+        outbound_queue.send(
+            EvolutionService(clinic), phone, opt_out_reply,
+            conversation=conversation, message_id=sent.get('id'),
+        )
+        return jsonify({'status': 'processed', 'reason': 'Opt-out recorded'})
+
+    # Agent switched off: this is "manual mode", never a black hole - the
+    # message stays stored and visible in the dashboard, we just don't
+    # generate a reply.
+    if not clinic.agent_enabled:
+        logger.info('Agent disabled for clinic %s, message stored for manual handling', clinic.name)
+        return jsonify({'status': 'stored', 'reason': 'Agent disabled - stored for manual handling'})
+
+    # Conversation paused (human support): same, store-only.
+    if conversation.status == ConversationStatus.TRANSFERRED_TO_HUMAN:
+        logger.info('Conversation %s is paused (human support), message stored', conversation.id)
+        return jsonify({'status': 'stored', 'reason': 'Conversation paused'})
+
+    # Hand off to the background pipeline (debounced burst aggregation,
+    # send retries, failure marking).
+    mode = enqueue_reply(clinic, conversation, phone)
+    return jsonify({'status': 'processed', 'mode': mode})
 
 
 def _handle_inbound_media(clinic, conversation_service, conversation, media, evolution_message_id, phone):
     """
-    Store an inbound media message. Media bytes are copied into our own
-    storage when possible (WhatsApp CDN URLs are E2E-encrypted and expire).
-    Voice notes are transcribed so the bot can keep handling the
-    conversation; other media (or failed transcriptions) hand off to a human.
+    Store an inbound media message right away, with a placeholder, and hand
+    the download (our own copy - WhatsApp CDN URLs are E2E-encrypted and
+    expire) and voice-note transcription to the background media stage,
+    which patches the message when they land. Voice notes keep the bot in
+    the loop - their reply is enqueued once transcribed; other media hand
+    off to a human.
     """
     media_type, media_url, mimetype, caption = media
     logger.info('Received %s message from %s', media_type, phone)
 
-    # Try to persist our own copy of the media
-    asset_b64 = None
-    fetched = EvolutionService(clinic).get_media_base64(evolution_message_id)
-    if fetched:
-        try:
-            raw = base64.b64decode(fetched['base64'], validate=True)
-            if 0 < len(raw) <= MAX_MEDIA_BYTES:
-                asset = MediaAsset(
-                    clinic_id=clinic.id,
-                    mimetype=fetched.get('mimetype') or mimetype or 'application/octet-stream',
-                    data=raw,
-                )
-                db.session.add(asset)
-                db.session.commit()
-                media_url = asset.public_path
-                mimetype = asset.mimetype
-                asset_b64 = fetched['base64']
-        except (binascii.Error, ValueError) as e:
-            logger.warning('Discarding undecodable media payload: %s', e)
-
-    # Voice notes: transcribe and keep the bot in the loop
-    if (
+    transcribe = (
         media_type == 'audio'
-        and asset_b64
+        and bool(evolution_message_id)
         and clinic.agent_enabled
         and conversation.status == ConversationStatus.ACTIVE
-    ):
-        transcript = ClaudeService(clinic).transcribe_audio(asset_b64, mimetype)
-        if transcript:
-            conversation_service.add_message(
-                conversation,
-                'user',
-                transcript,
-                evolution_id=evolution_message_id,
-                message_type='audio',
-                media_url=media_url,
-                media_mimetype=mimetype,
-                caption=transcript
-            )
-            mode = enqueue_reply(clinic, conversation, phone)
-            return jsonify({'status': 'processed', 'mode': mode, 'transcribed': True})
+    )
 
-    # Everything else (images, documents, failed transcription): store and
-    # hand off to a human. Transfer first so the new_message event carries
-    # the already-updated status.
-    if conversation.status != ConversationStatus.TRANSFERRED_TO_HUMAN:
+    # Transfer first so the new_message event carries the already-updated
+    # status. Voice notes are only handed off if transcription fails.
+    if not transcribe and conversation.status != ConversationStatus.TRANSFERRED_TO_HUMAN:
         conversation_service.transfer_to_human(
             conversation,
             f'Paciente enviou {media_type} - requer atendimento humano'
@@ -295,7 +315,7 @@ def _handle_inbound_media(clinic, conversation_service, conversation, media, evo
     # Content is never left empty: an empty string here would later be
     # sent to the LLM as an empty text block and get rejected.
     content = caption or MEDIA_PLACEHOLDER_TEXT.get(media_type, 'Midia enviada')
-    conversation_service.add_message(
+    message = conversation_service.add_message(
         conversation,
         'user',
         content,
@@ -306,27 +326,40 @@ def _handle_inbound_media(clinic, conversation_service, conversation, media, evo
         caption=caption or None
     )
 
-    return jsonify({'status': 'processed', 'reason': 'Media message routed to human'})
+    if not evolution_message_id:
+        return jsonify({'status': 'processed', 'reason': 'Media message routed to human'})
+
+    mode = schedule_media_ingest(
+        clinic, conversation, message['id'], evolution_message_id,
+        media_type, mimetype, phone, transcribe=transcribe
+    )
+    if transcribe:
+        return jsonify({'status': 'processed', 'reason': 'Voice note queued for transcription', 'media': mode})
+    return jsonify({'status': 'processed', 'reason': 'Media message routed to human', 'media': mode})
 
 
 def _handle_status_update(instance_name: str, data):
-    """Handle a messages.update event carrying WhatsApp delivery/read ACKs."""
+    """
+    Handle a messages.update event carrying WhatsApp delivery/read ACKs.
+    Evolution often batches several entries into one payload; they are
+    applied together (see ConversationService.apply_status_acks).
+    """
     if data is None:
         return jsonify({'status': 'ignored', 'reason': 'No data'})
 
     entries = data if isinstance(data, list) else [data]
 
-    clinic = _find_clinic_by_instance(instance_name)
-    if not clinic:
+    # Unknown/inactive instances are answered from the instance cache
+    # without touching the database
+    instance = instance_cache.lookup_instance(instance_name)
+    if not instance or not instance['active']:
         return jsonify({'status': 'ignored', 'reason': 'Clinic not found'})
 
-    conversation_service = ConversationService(clinic)
-    updated_count = 0
-
+    # evolution_id -> most advanced status seen in this payload
+    acks = {}
     for entry in entries:
         key = entry.get('key', {})
         evolution_message_id = key.get('id')
-        remote_jid = key.get('remoteJid', '')
         raw_status = entry.get('update', {}).get('status') or entry.get('status')
 
         if not evolution_message_id or not raw_status:
@@ -336,25 +369,28 @@ def _handle_status_update(instance_name: str, data):
         if not our_status:
             continue
 
-        phone = remote_jid.split('@')[0] if remote_jid else None
-        conversation = (
-            conversation_service.find_conversation_with_message(phone, evolution_message_id)
-            if phone else None
-        )
+        if MessageStatus.is_upgrade(acks.get(evolution_message_id), our_status):
+            acks[evolution_message_id] = our_status
+
+    if not acks:
+        return jsonify({'status': 'processed', 'updated': 0})
 
-        if conversation:
-            result = conversation_service.update_message_status(conversation, evolution_message_id, our_status)
-            if result:
-                updated_count += 1
+    clinic = instance_cache.load_clinic(instance)
+    if not clinic:
+        return jsonify({'status': 'ignored', 'reason': 'Clinic not found'})
+    updated_count = ConversationService(clinic).apply_status_acks(acks)
 
     return jsonify({'status': 'processed', 'updated': updated_count})
 
 
 def _handle_presence_update(instance_name: str, data: dict):
     """Handle a presence.update event (typing/recording indicator)."""
-    clinic = _find_clinic_by_instance(instance_name)
-    if not clinic:
+    # The clinic row itself is never needed here: the cached id is enough,
+    # and unknown/inactive instances cost no database work at all
+    instance = instance_cache.lookup_instance(instance_name)
+    if not instance or not instance['active']:
         return jsonify({'status': 'ignored', 'reason': 'Clinic not found'})
+    clinic_id = instance['id']
 
     remote_jid = data.get('id', '')
     if '@g.us' in remote_jid:
@@ -370,14 +406,14 @@ def _handle_presence_update(instance_name: str, data: dict):
 
     normalized = normalize_phone(phone)
     conversation = Conversation.query.filter_by(
-        clinic_id=clinic.id,
+        clinic_id=clinic_id,
         phone_number=normalized
     ).order_by(Conversation.last_message_at.desc()).first()
 
     if not conversation:
         return jsonify({'status': 'ignored', 'reason': 'No conversation for this contact'})
 
-    publish_event(str(clinic.id), 'typing', {
+    publish_event(clinic_id, 'typing', {
         'conversation_id': str(conversation.id),
         'is_typing': state in ('composing', 'recording'),
         'state': state
@@ -397,7 +433,8 @@ def _handle_connection_update(instance_name: str, data: dict):
         return jsonify({'status': 'ignored', 'reason': 'No state in payload'})
     state = str(state).lower()
 
-    clinic = Clinic.query.filter_by(evolution_instance_name=instance_name).first()
+    instance = instance_cache.lookup_instance(instance_name)
+    clinic = instance_cache.load_clinic(instance)
     if not clinic:
         return jsonify({'status': 'ignored', 'reason': 'Clinic not found'})
 
@@ -429,6 +466,20 @@ def _handle_connection_update(instance_name: str, data: dict):
     return jsonify({'status': 'processed', 'state': state})
 
 
+def handle_queued_payload(payload: dict) -> bool:
+    """
+    Webhook queue handler: process a dequeued payload. Returns False for
+    failures worth retrying (server-side errors); client-type outcomes like
+    an unknown instance are final and get acknowledged.
+    """
+    try:
+        response = process_evolution_payload(payload)
+        status_code = response[1] if isinstance(response, tuple) else response.status_code
+        return status_code < 500
+    finally:
+        db.session.remove()
+
+
 @bp.route('/evolution/status', methods=['POST'])
 @limiter.limit("600 per minute")
 @limiter.limit("100 per minute", key_func=_webhook_rate_limit_key)
@@ -8,6 +8,7 @@ reminders/outreach with WEB_CONCURRENCY > 1.
 """
 import logging
 import atexit
+import time
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.interval import IntervalTrigger
 
@@ -18,6 +19,12 @@ logger = logging.getLogger(__name__)
 
 scheduler = BackgroundScheduler()
 
+# Wall-clock budgets of the outreach jobs; must stay below their lock TTLs
+# (1500s / 1800s) so runs never overlap. Patients not reached by then are
+# picked up by the next run.
+RECOVERY_JOB_SECONDS = 1200
+RECALL_JOB_SECONDS = 1500
+
 
 def send_pending_reminders_job():
     """
@@ -53,10 +60,25 @@ def retry_failed_reminders_job():
         logger.exception('Error in retry job: %s', str(e))
 
 
-def _run_for_clinics(job_name, method_name, filter_fn):
+def recover_stalled_media_job():
+    """Resubmit media download/transcription jobs lost on a restart (services/media_pipeline.py)."""
+    from app.services.media_pipeline import recover_stalled_media
+
+    try:
+        recovered = recover_stalled_media()
+        if recovered:
+            logger.info('Media recovery job resubmitted %d stalled placeholder(s)', recovered)
+    except Exception as e:
+        logger.exception('Error in media recovery job: %s', str(e))
+
+
+def _run_for_clinics(job_name, method_name, filter_fn, deadline=None):
     """
     Run an AutomationService method for every clinic that matches filter_fn.
     Isolated per-clinic so one clinic's failure never aborts the batch.
+
+    With `deadline` (a time.monotonic() value), outreach batches stop there
+    and the clinics not reached yet are left for the next run.
     """
     from app.models import Clinic
     from app.services.automation_service import AutomationService
@@ -66,8 +88,11 @@ def _run_for_clinics(job_name, method_name, filter_fn):
     for clinic in clinics:
         if not filter_fn(clinic):
             continue
+        if deadline is not None and time.monotonic() >= deadline:
+            logger.info('%s out of time, remaining clinics left for the next run', job_name)
+            break
         try:
-            service = AutomationService(clinic)
+            service = AutomationService(clinic, deadline=deadline)
             result = getattr(service, method_name)()
             for k, v in (result or {}).items():
                 totals[k] = totals.get(k, 0) + v
@@ -80,15 +105,17 @@ def _run_for_clinics(job_name, method_name, filter_fn):
 def recovery_job():
     """No-show / cancellation recovery + waitlist offers (needs master switch)."""
     def _recover():
-        _run_for_clinics('recovery', 'run_recovery', lambda c: c.proactive_outreach_enabled)
-        _run_for_clinics('waitlist', 'fill_freed_slots', lambda c: c.proactive_outreach_enabled)
+        deadline = time.monotonic() + RECOVERY_JOB_SECONDS
+        _run_for_clinics('recovery', 'run_recovery', lambda c: c.proactive_outreach_enabled, deadline)
+        _run_for_clinics('waitlist', 'fill_freed_slots', lambda c: c.proactive_outreach_enabled, deadline)
     _recover()
 
 
 def recall_job():
     """Reactivation of long-inactive patients (needs master switch + recall flag)."""
     _run_for_clinics('recall', 'run_recall',
-                     lambda c: c.proactive_outreach_enabled and c.recall_enabled)
+                     lambda c: c.proactive_outreach_enabled and c.recall_enabled,
+                     time.monotonic() + RECALL_JOB_SECONDS)
 
 
 def funnel_job():
@@ -229,6 +256,15 @@ def init_scheduler(app):
         replace_existing=True
     )
 
+    # Retry inbound media jobs lost when a process restarted mid-queue.
+    scheduler.add_job(
+        func=with_app_context(recover_stalled_media_job, 'recover_stalled_media', lock_ttl=540),
+        trigger=IntervalTrigger(minutes=10),
+        id='recover_stalled_media',
+        name='Recover stalled inbound media ingestion',
+        replace_existing=True
+    )
+
     # --- Autonomous / proactive AI jobs -----------------------------------
     # No-show/cancellation recovery + waitlist offers every 30 minutes.
     scheduler.add_job(
@@ -90,3 +90,4 @@ class AgentConfigSchema(BaseSchema):
     agent_temperature = fields.Float(validate=validate.Range(min=0.0, max=1.0))
     agent_system_prompt = fields.Str(validate=validate.Length(max=10000))
     agent_context = fields.Str(validate=validate.Length(max=5000))
+    agent_history_token_budget = fields.Int(allow_none=True, validate=validate.Range(min=500, max=32000))
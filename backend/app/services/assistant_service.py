@@ -15,6 +15,7 @@ prompt is built with the accumulated memories injected as context.
 """
 import json
 import logging
+import uuid
 from datetime import datetime, timedelta
 
 from flask import current_app
@@ -26,8 +27,10 @@ from app.models import (
     Patient, Appointment, AppointmentStatus, Professional, PipelineStage,
     Conversation, AgentAction, AssistantMemory, AiUsageService,
 )
+from app.services.search_service import ConversationSearchService
 from app.utils.cache import cache
 from app.utils.ai_usage import record_ai_usage, USAGE_INCLUDE_COST
+from app.utils.llm_client import get_openai_client
 
 logger = logging.getLogger(__name__)
 
@@ -88,9 +91,8 @@ class AssistantService:
         api_key = clinic.openrouter_api_key or current_app.config.get('OPENROUTER_API_KEY')
         if not api_key:
             raise ValueError('OpenRouter API key not configured')
-        self.client = openai.OpenAI(
-            api_key=api_key,
-            base_url=current_app.config.get('OPENROUTER_BASE_URL', 'https://openrouter.ai/api/v1'),
+        self.client = get_openai_client(
+            api_key, current_app.config.get('OPENROUTER_BASE_URL', 'https://openrouter.ai/api/v1')
         )
 
     @staticmethod
@@ -191,13 +193,14 @@ class AssistantService:
             },
             {
                 "name": "get_conversation_transcript",
-                "description": "Retorna as últimas mensagens da conversa de WhatsApp de um paciente específico, para entender o histórico de atendimento.",
+                "description": "Retorna as últimas mensagens da conversa de WhatsApp de um paciente específico, para entender o histórico de atendimento. Com 'query', busca pelo assunto (ex: 'clareamento') em todas as conversas (ou só nas do paciente informado) e retorna os trechos encontrados junto com a transcrição da conversa mais relevante.",
                 "input_schema": {
                     "type": "object",
                     "properties": {
-                        "patient_name": {"type": "string", "description": "Nome do paciente dono da conversa"}
+                        "patient_name": {"type": "string", "description": "Nome do paciente dono da conversa (opcional se 'query' for informado)"},
+                        "query": {"type": "string", "description": "Assunto ou palavras a procurar nas mensagens (opcional)"}
                     },
-                    "required": ["patient_name"]
+                    "required": []
                 }
             },
             {
@@ -468,13 +471,13 @@ class AssistantService:
 
         results = []
         for c in conversations:
-            last_message = c.messages[-1] if c.messages else None
+            last_message = c.last_message()
             results.append({
                 'patient_name': c.patient.name if c.patient else None,
                 'phone_number': c.phone_number,
                 'status': c.status,
                 'urgent': c.urgent,
-                'message_count': len(c.messages or []),
+                'message_count': c.message_count,
                 'last_message_snippet': (last_message.get('content') or '')[:140] if last_message else None,
                 'last_message_at': c.last_message_at.isoformat() if c.last_message_at else None,
             })
@@ -482,27 +485,68 @@ class AssistantService:
 
     def _tool_get_conversation_transcript(self, tool_input: dict) -> str:
         name = (tool_input.get('patient_name') or '').strip()
-        if not name:
-            return "Informe o nome do paciente."
+        search = (tool_input.get('query') or '').strip()
+        if not name and not search:
+            return "Informe o nome do paciente ou o assunto a procurar."
 
-        patient = Patient.query.filter_by(clinic_id=self.clinic.id).filter(
-            Patient.name.ilike(f"%{name}%")
-        ).first()
-        if not patient:
-            return "Paciente não encontrado."
+        patient = None
+        if name:
+            patient = Patient.query.filter_by(clinic_id=self.clinic.id).filter(
+                Patient.name.ilike(f"%{name}%")
+            ).first()
+            if not patient:
+                return "Paciente não encontrado."
+
+        if search:
+            return self._search_conversation_transcript(search, patient)
 
         conversation = Conversation.query.filter_by(
             clinic_id=self.clinic.id, patient_id=patient.id
         ).order_by(Conversation.last_message_at.desc()).first()
-        if not conversation or not conversation.messages:
+        messages = conversation.recent_messages(30) if conversation else []
+        if not messages:
             return "Este paciente não tem conversas registradas."
 
         transcript = [
             {'role': m.get('role'), 'content': m.get('content'), 'timestamp': m.get('timestamp')}
-            for m in conversation.messages[-30:]
+            for m in messages
         ]
         return self._to_json(transcript)
 
+    def _search_conversation_transcript(self, search: str, patient=None) -> str:
+        """Ranked message matches for `search` plus the transcript of the best conversation."""
+        hits = ConversationSearchService(self.clinic).search_messages(
+            search, limit=5, patient_id=patient.id if patient else None
+        )
+        if not hits:
+            return f"Nenhuma conversa encontrada sobre '{search}'."
+
+        conversations = {
+            str(c.id): c for c in Conversation.query.filter(
+                Conversation.clinic_id == self.clinic.id,
+                Conversation.id.in_([uuid.UUID(h['conversation_id']) for h in hits]),
+            )
+        }
+        matches = []
+        for hit in hits:
+            conversation = conversations.get(hit['conversation_id'])
+            if not conversation:
+                continue
+            matches.append({
+                'patient_name': conversation.patient.name if conversation.patient else None,
+                'phone_number': conversation.phone_number,
+                'role': hit['role'],
+                'timestamp': hit['timestamp'],
+                'snippet': hit['snippet'],
+            })
+
+        best = conversations.get(hits[0]['conversation_id'])
+        transcript = [
+            {'role': m.get('role'), 'content': m.get('content'), 'timestamp': m.get('timestamp')}
+            for m in (best.recent_messages(30) if best else [])
+        ]
+        return self._to_json({'matches': matches, 'transcript': transcript})
+
     def _tool_list_agent_actions(self, tool_input: dict) -> str:
         limit = min(int(tool_input.get('limit') or 20), 50)
         query = AgentAction.query.filter_by(clinic_id=self.clinic.id)
@@ -17,6 +17,7 @@ audit log always apply. All of this is gated by clinic.proactive_outreach_enable
 """
 import logging
 from datetime import datetime, timedelta
+from typing import Optional
 
 from sqlalchemy import func
 
@@ -137,8 +138,10 @@ def collect_metrics(clinic, days: int = 30) -> dict:
 
 
 class AutomationService:
-    def __init__(self, clinic):
+    def __init__(self, clinic, deadline: Optional[float] = None):
         self.clinic = clinic
+        # time.monotonic() by which batch outreach must be done (scheduler jobs)
+        self.deadline = deadline
         self.outreach = OutreachService(clinic)
 
     # -- 1. No-show & cancellation recovery -------------------------------
@@ -157,11 +160,14 @@ class AutomationService:
             Appointment.scheduled_datetime < now,
         ).limit(RECOVERY_BATCH).all()
 
+        requests = []
         for appt in noshows:
-            if self._recover_one(appt, AgentActionType.NOSHOW_RECOVERY,
-                                  'o paciente faltou à consulta e queremos reengajá-lo com carinho, '
-                                  'sem cobrança, oferecendo remarcar em um novo horário'):
-                results['noshow'] += 1
+            request = self._recovery_request(
+                appt, AgentActionType.NOSHOW_RECOVERY,
+                'o paciente faltou à consulta e queremos reengajá-lo com carinho, '
+                'sem cobrança, oferecendo remarcar em um novo horário')
+            if request:
+                requests.append(('noshow', request))
 
         # Cancellations in the last 2 days
         cancellations = Appointment.query.filter(
@@ -171,18 +177,36 @@ class AutomationService:
         ).limit(RECOVERY_BATCH).all()
 
         for appt in cancellations:
-            if self._recover_one(appt, AgentActionType.CANCELLATION_RECOVERY,
-                                  'a consulta do paciente foi cancelada e queremos oferecer um novo '
-                                  'horário para reagendar, de forma leve e prestativa'):
-                results['cancellation'] += 1
+            request = self._recovery_request(
+                appt, AgentActionType.CANCELLATION_RECOVERY,
+                'a consulta do paciente foi cancelada e queremos oferecer um novo '
+                'horário para reagendar, de forma leve e prestativa')
+            if request:
+                requests.append(('cancellation', request))
+
+        # Composed one by one, sent as one paced batch. A patient with two
+        # no-shows in the window gets one message (the dedupe check above only
+        # sees messages already sent).
+        unique, seen = [], set()
+        for kind, request in requests:
+            key = (request['patient'].id, request['action_type'])
+            if key not in seen:
+                seen.add(key)
+                unique.append((kind, request))
+        requests = unique
+        actions = self.outreach.send_proactive_batch([request for _, request in requests], deadline=self.deadline)
+        for (kind, _), action in zip(requests, actions):
+            if action and action.status == AgentActionStatus.SENT:
+                results[kind] += 1
 
         return results
 
-    def _recover_one(self, appt: Appointment, action_type: str, objective: str) -> bool:
+    def _recovery_request(self, appt: Appointment, action_type: str, objective: str) -> Optional[dict]:
+        """send_proactive arguments for one recovery message, or None if it shouldn't go out."""
         try:
             patient = appt.patient
             if not patient:
-                return False
+                return None
             # Already rebooked? Skip.
             has_future = Appointment.query.filter(
                 Appointment.clinic_id == self.clinic.id,
@@ -191,20 +215,19 @@ class AutomationService:
                 Appointment.status.in_([AppointmentStatus.PENDING, AppointmentStatus.CONFIRMED]),
             ).first()
             if has_future:
-                return False
+                return None
             if AgentAction.has_recent_action(patient.id, action_type, RECOVERY_DEDUPE):
-                return False
-            action = self.outreach.send_proactive(
-                patient=patient,
-                objective=objective,
-                action_type=action_type,
-                extra_context=f"Serviço da consulta: {appt.service_name}.",
-                appointment_id=appt.id,
-            )
-            return bool(action and action.status == AgentActionStatus.SENT)
+                return None
+            return {
+                'patient': patient,
+                'objective': objective,
+                'action_type': action_type,
+                'extra_context': f"Serviço da consulta: {appt.service_name}.",
+                'appointment_id': appt.id,
+            }
         except Exception:
             logger.exception('Recovery failed for appointment %s', appt.id)
-            return False
+            return None
 
     # -- 2. Waitlist: fill freed-up slots ---------------------------------
 
@@ -297,25 +320,30 @@ class AutomationService:
             .all()
         )
 
+        requests = []
         for patient in candidates:
-            if results['recalled'] >= RECALL_BATCH:
+            if len(requests) >= RECALL_BATCH:
                 break
             try:
                 if AgentAction.has_recent_action(patient.id, AgentActionType.RECALL, RECALL_DEDUPE):
                     continue
-                action = self.outreach.send_proactive(
-                    patient=patient,
-                    objective=(
-                        'faz um bom tempo que o paciente não vem à clínica e queremos convidá-lo, '
-                        'de forma acolhedora, para agendar um retorno / avaliação de rotina'
-                    ),
-                    action_type=AgentActionType.RECALL,
-                    add_opt_out_footer=True,
-                )
-                if action and action.status == AgentActionStatus.SENT:
-                    results['recalled'] += 1
             except Exception:
                 logger.exception('Recall failed for patient %s', patient.id)
+                continue
+            requests.append({
+                'patient': patient,
+                'objective': (
+                    'faz um bom tempo que o paciente não vem à clínica e queremos convidá-lo, '
+                    'de forma acolhedora, para agendar um retorno / avaliação de rotina'
+                ),
+                'action_type': AgentActionType.RECALL,
+                'add_opt_out_footer': True,
+            })
+
+        # Composed one by one, sent as one paced batch
+        for action in self.outreach.send_proactive_batch(requests, deadline=self.deadline):
+            if action and action.status == AgentActionStatus.SENT:
+                results['recalled'] += 1
 
         return results
 
@@ -401,8 +429,11 @@ class AutomationService:
             if not digest:
                 return results
 
+            from app.services import outbound_queue
             from app.services.evolution_service import EvolutionService
-            send_result = EvolutionService(self.clinic).send_message(self.clinic.phone, digest)
+            send_result = outbound_queue.send(
+                EvolutionService(self.clinic), self.clinic.phone, digest, lane=outbound_queue.Lane.OUTREACH
+            )
             status = AgentActionStatus.SENT
             if isinstance(send_result, dict) and 'error' in send_result:
                 status = AgentActionStatus.FAILED
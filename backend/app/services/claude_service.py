@@ -1,20 +1,28 @@
+import base64
+import copy
+import hashlib
 import logging
 import json
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from typing import Optional
 
 from flask import current_app
 import openai
+from sqlalchemy.exc import IntegrityError
 
 from app.utils.datetime_utils import local_now
 from app import db
-from app.models import Conversation, Patient, ConversationStatus, Professional, PipelineStage, AppointmentStatus, Appointment, AiUsageService
+from app.models import Clinic, Conversation, Patient, ConversationStatus, Professional, PipelineStage, AppointmentStatus, Appointment, AiUsageService, AudioTranscript
 from app.services.appointment_service import AppointmentService
 from app.services.conversation_service import ConversationService
 from app.services.evolution_service import EvolutionService
+from app.services import outbound_queue, prompt_bundle, summary_pipeline
 from app.utils.business_hours import parse_time
-from app.utils.cache import cache
-from app.utils.ai_usage import record_ai_usage, USAGE_INCLUDE_COST
+from app.utils.ai_usage import record_ai_usage, log_tool_memo_stats, USAGE_INCLUDE_COST
+from app.utils.llm_client import get_openai_client
+from app.utils.token_estimate import estimate_message_tokens
 
 logger = logging.getLogger(__name__)
 
@@ -25,12 +33,47 @@ WEEKDAY_NAMES = ['segunda-feira', 'terça-feira', 'quarta-feira', 'quinta-feira'
 # loop (and burn tokens) indefinitely.
 MAX_TOOL_ROUNDS = 6
 
-
-@cache.memoize(timeout=60)
-def _cached_active_professionals_text(clinic_id: str) -> str:
-    """Module-level (not a method) so the cache key is keyed purely by
-    clinic_id, not by the ClaudeService instance - a new instance is created
-    per request, so keying on `self` would defeat the cache entirely."""
+# Tools that only read (or compute) - when the model asks for several of
+# these in one round they run concurrently, each on its own session. Every
+# other tool writes or sends something and runs inline, in the order given.
+READ_ONLY_TOOLS = frozenset({
+    'check_availability',
+    'list_appointments',
+    'list_professionals',
+    'get_current_datetime',
+    'send_booking_link',
+})
+
+# Read-only tools whose result only depends on their input and on the
+# clinic's appointments/config, so a repeat within one turn can be answered
+# from ToolResultMemo. get_current_datetime is left out on purpose.
+MEMOIZABLE_TOOLS = frozenset({
+    'check_availability',
+    'list_appointments',
+    'list_professionals',
+    'send_booking_link',
+})
+
+# Tools that change appointments - running one drops the turn's memo.
+APPOINTMENT_MUTATING_TOOLS = frozenset({
+    'create_appointment',
+    'reschedule_appointment',
+    'confirm_appointment',
+    'cancel_appointment',
+})
+
+# Rolling summary catch-up: messages not yet covered by the stored summary
+# are folded in oldest first, a bounded chunk per light-model call (at most
+# this many messages, and about this many estimated tokens of transcript).
+SUMMARY_CHUNK_MESSAGES = 60
+SUMMARY_CHUNK_TOKENS = 6000
+
+# Shared across all reply workers, so it also bounds the extra DB
+# connections parallel tool calls can take.
+_tool_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='agent-tool')
+
+
+def _active_professionals_text(clinic_id: str) -> str:
     professionals = Professional.query.filter_by(clinic_id=clinic_id, active=True).all()
     if not professionals:
         return "Nenhum profissional específico cadastrado (qualquer horário disponível serve)"
@@ -40,14 +83,65 @@ def _cached_active_professionals_text(clinic_id: str) -> str:
     ])
 
 
-@cache.memoize(timeout=60)
-def _cached_pipeline_stages_text(clinic_id: str) -> str:
+def _pipeline_stages_text(clinic_id: str) -> str:
     stages = PipelineStage.query.filter_by(clinic_id=clinic_id).order_by(PipelineStage.order).all()
     if not stages:
         return "Nenhum estágio configurado"
     return ", ".join([s.name for s in stages])
 
 
+class ToolResultMemo:
+    """
+    Turn-scoped results of MEMOIZABLE_TOOLS, keyed by (tool, normalized
+    input). One instance lives for a single process_message call and is
+    cleared whenever an appointment-changing tool runs in that turn.
+    """
+
+    def __init__(self):
+        self._results = {}
+        self.calls = 0
+        self.hits = 0
+
+    @staticmethod
+    def key(tool_name: str, tool_input: dict) -> Optional[tuple]:
+        if tool_name not in MEMOIZABLE_TOOLS:
+            return None
+        normalized = {
+            k: v.strip().lower() if isinstance(v, str) else v
+            for k, v in (tool_input or {}).items()
+            if v not in (None, '')
+        }
+        return tool_name, json.dumps(normalized, sort_keys=True, default=str)
+
+    def get(self, key: Optional[tuple]) -> tuple:
+        """(hit, result); counts the call either way."""
+        self.calls += 1
+        if key is not None and key in self._results:
+            self.hits += 1
+            return True, self._results[key]
+        return False, None
+
+    def put(self, key: tuple, result: str) -> None:
+        # Don't pin a failure for the rest of the turn - let the model retry
+        if not result.startswith('Erro ao'):
+            self._results[key] = result
+
+    def invalidate(self) -> None:
+        self._results.clear()
+
+
+def _run_read_only_tool(app, service, clinic_id: str, cid: str, tool_name: str, tool_input: dict) -> str:
+    """Pool side of ClaudeService._run_tool_calls: one read-only tool on its own app context and session."""
+    with app.app_context():
+        try:
+            clinic = db.session.get(Clinic, clinic_id)
+            conversation = db.session.get(Conversation, cid)
+            return service._bound_to(clinic)._execute_tool(tool_name, tool_input, conversation)
+        except Exception as e:
+            logger.exception('Parallel tool %s failed for clinic %s', tool_name, clinic_id)
+            return f"Erro ao executar {tool_name}: {str(e)}"
+
+
 # Static instructions block - identical for every message of every
 # conversation for a given clinic (until the clinic edits its config), so
 # it's sent as a separate, cache_control-marked content block in
@@ -142,13 +236,17 @@ class ClaudeService:
         api_key = clinic.openrouter_api_key or current_app.config.get('OPENROUTER_API_KEY')
         if not api_key:
             raise ValueError('OpenRouter API key not configured')
-        self.client = openai.OpenAI(
-            api_key=api_key,
-            base_url=current_app.config.get('OPENROUTER_BASE_URL', 'https://openrouter.ai/api/v1'),
+        self.client = get_openai_client(
+            api_key, current_app.config.get('OPENROUTER_BASE_URL', 'https://openrouter.ai/api/v1')
         )
         self.appointment_service = AppointmentService(clinic)
         self.conversation_service = ConversationService(clinic)
 
+    @property
+    def _history_token_budget(self) -> int:
+        """Estimated-token budget for the verbatim history sent each turn."""
+        return self.clinic.agent_history_token_budget or current_app.config.get('AGENT_HISTORY_TOKEN_BUDGET', 6000)
+
     @property
     def _effective_system_prompt(self) -> Optional[str]:
         if 'system_prompt' in self._overrides:
@@ -447,12 +545,41 @@ class ClaudeService:
         return ", ".join(parts) if parts else "Segunda a Sexta: 08:00 - 18:00"
 
     def _format_professionals(self) -> str:
-        """Format the clinic's active professionals for the prompt (60s cache - see module-level helper)."""
-        return _cached_active_professionals_text(str(self.clinic.id))
+        """The clinic's active professionals as formatted in its current prompt bundle."""
+        return self._prompt_bundle()['prompt_vars']['professionals']
 
     def _format_pipeline_stages(self) -> str:
-        """Format the clinic's CRM pipeline stages for the prompt (60s cache - see module-level helper)."""
-        return _cached_pipeline_stages_text(str(self.clinic.id))
+        """The clinic's CRM pipeline stages as formatted in its current prompt bundle."""
+        return self._prompt_bundle()['prompt_vars']['pipeline_stages']
+
+    def _compile_prompt_bundle(self) -> dict:
+        """
+        Build everything in the agent's prompt that only depends on clinic
+        config (see services/prompt_bundle.py). The bundle is keyed by
+        config_version, so it must reflect the rows as they are now.
+        """
+        services = self._format_services()
+        prompt_vars = {
+            'clinic_name': self.clinic.name,
+            'services': services,
+            'professionals': _active_professionals_text(str(self.clinic.id)),
+            'pipeline_stages': _pipeline_stages_text(str(self.clinic.id)),
+            'business_hours': self._format_business_hours(),
+        }
+        tools = self._to_openai_tools(self._get_tools())
+        if tools:
+            # Cache the (large, otherwise-identical-every-call) tool schema block too.
+            tools[-1] = {**tools[-1], "cache_control": {"type": "ephemeral"}}
+        return {
+            'prompt_vars': prompt_vars,
+            'static_block': SYSTEM_PROMPT_STATIC_TEMPLATE.format(**prompt_vars),
+            'guardrail': SCOPE_GUARDRAIL_TEMPLATE.format(services=services),
+            'tools': tools,
+        }
+
+    def _prompt_bundle(self) -> dict:
+        """The clinic's compiled prompt bundle at its current config version (read-only)."""
+        return prompt_bundle.get_bundle(self.clinic, self._compile_prompt_bundle)
 
     def _find_service(self, service_name: Optional[str]) -> Optional[dict]:
         """Find a service config dict by name (case-insensitive)."""
@@ -508,11 +635,91 @@ class ClaudeService:
             return "Ferramenta não reconhecida."
 
         handler_name, action_phrase = handler_entry
+        start = time.perf_counter()
         try:
             return getattr(self, handler_name)(tool_input, conversation)
         except Exception as e:
             logger.error('Error executing tool %s: %s', tool_name, str(e))
             return f"Erro ao {action_phrase}: {str(e)}"
+        finally:
+            logger.info(
+                'Tool %s took %.1fms (clinic %s)',
+                tool_name, (time.perf_counter() - start) * 1000, self.clinic.id
+            )
+
+    def _run_tool_calls(self, calls: list, conversation: Conversation,
+                        memo: Optional['ToolResultMemo'] = None) -> list:
+        """
+        Execute one round's [(tool_name, tool_input), ...] and return their
+        results in the same order. Runs of consecutive read-only tools go to
+        the shared pool together (AGENT_PARALLEL_TOOLS); anything else runs
+        inline on this session, so reads after it see its writes. With
+        `memo`, repeated idempotent calls this turn reuse the earlier result.
+        """
+        results = [None] * len(calls)
+        parallel = current_app.config.get('AGENT_PARALLEL_TOOLS', True)
+        memo = memo if memo is not None else ToolResultMemo()
+        batch = []
+
+        def flush():
+            pending = {}    # memo key -> indexes waiting on that call
+            to_run = []
+            for index, tool_name, tool_input in batch:
+                key = memo.key(tool_name, tool_input)
+                hit, cached = memo.get(key)
+                if hit:
+                    results[index] = cached
+                elif key is not None and key in pending:
+                    memo.hits += 1
+                    pending[key].append(index)
+                else:
+                    if key is not None:
+                        pending[key] = [index]
+                    to_run.append((index, key, tool_name, tool_input))
+
+            if parallel and len(to_run) > 1:
+                app = current_app._get_current_object()
+                futures = [
+                    (index, key, _tool_executor.submit(
+                        _run_read_only_tool, app, self, str(self.clinic.id),
+                        str(conversation.id), tool_name, tool_input
+                    ))
+                    for index, key, tool_name, tool_input in to_run
+                ]
+                ran = [(index, key, future.result()) for index, key, future in futures]
+            else:
+                ran = [
+                    (index, key, self._execute_tool(tool_name, tool_input, conversation))
+                    for index, key, tool_name, tool_input in to_run
+                ]
+
+            for index, key, result in ran:
+                results[index] = result
+                if key is not None:
+                    memo.put(key, result)
+                    for waiting in pending[key]:
+                        results[waiting] = result
+            batch.clear()
+
+        for index, (tool_name, tool_input) in enumerate(calls):
+            if tool_name in READ_ONLY_TOOLS:
+                batch.append((index, tool_name, tool_input))
+                continue
+            flush()
+            memo.calls += 1
+            results[index] = self._execute_tool(tool_name, tool_input, conversation)
+            if tool_name in APPOINTMENT_MUTATING_TOOLS:
+                memo.invalidate()
+        flush()
+        return results
+
+    def _bound_to(self, clinic) -> 'ClaudeService':
+        """A copy of this service (same client and overrides) using `clinic` as loaded in the current session."""
+        service = copy.copy(self)
+        service.clinic = clinic
+        service.appointment_service = AppointmentService(clinic)
+        service.conversation_service = ConversationService(clinic)
+        return service
 
     def _tool_check_availability(self, tool_input: dict, conversation: Conversation) -> str:
         date = datetime.strptime(tool_input['date'], '%Y-%m-%d').date()
@@ -743,7 +950,9 @@ class ClaudeService:
             f"🏥 Serviço: {appointment.service_name}\n\n"
             f"Até lá! 😊"
         )
-        result = EvolutionService(self.clinic).send_message(patient.phone, message)
+        result = outbound_queue.send(
+            EvolutionService(self.clinic), patient.phone, message, lane=outbound_queue.Lane.REMINDER
+        )
         if 'error' in result:
             return f"Não foi possível reenviar o lembrete: {result['error']}"
         return "Lembrete reenviado com sucesso."
@@ -760,7 +969,7 @@ class ClaudeService:
             f"Instruções para *{service.get('name')}*:\n\n"
             f"{service['instructions']}"
         )
-        result = EvolutionService(self.clinic).send_message(conversation.phone_number, message)
+        result = outbound_queue.send(EvolutionService(self.clinic), conversation.phone_number, message)
         if 'error' in result:
             return f"Não foi possível enviar as instruções: {result['error']}"
         return "Instruções enviadas com sucesso."
@@ -793,20 +1002,17 @@ class ClaudeService:
                 triage_parts.append(symptoms)
             reason = f"[TRIAGEM] {' - '.join(triage_parts)} | {reason}"
 
-        # Generate an AI summary so the human agent doesn't have to read
-        # the whole thread (best-effort; never blocks the transfer).
-        summary = None
-        try:
-            summary = self.summarize_conversation_for_handoff(conversation)
-        except Exception:
-            logger.exception('Failed to generate handoff summary')
-
         transfer = self.conversation_service.transfer_to_human(
             conversation, reason, urgent=urgent
         )
-        if summary and transfer is not None:
-            transfer.summary = summary
-            db.session.commit()
+        # AI summary so the human agent doesn't have to read the whole
+        # thread - generated in the background and attached to the transfer
+        # when ready (best-effort; never blocks the transfer).
+        if transfer is not None:
+            try:
+                summary_pipeline.schedule_handoff_summary(self, conversation, transfer)
+            except Exception:
+                logger.exception('Failed to schedule handoff summary')
         return "Conversa transferida para atendimento humano."
 
     def _tool_send_booking_link(self, tool_input: dict, conversation: Conversation) -> str:
@@ -979,75 +1185,107 @@ class ClaudeService:
         user = f"Métricas da semana (JSON):\n{json.dumps(metrics, ensure_ascii=False, default=str)}\n\nEscreva o resumo."
         return self._complete(system, user, max_tokens=500, temperature=0.5, task='generate_report_digest')
 
-    # How many stored messages go verbatim to the model; older ones are
-    # folded into the rolling summary below.
-    HISTORY_WINDOW = 30
-
-    def _maybe_update_rolling_summary(self, conversation: Conversation) -> None:
+    def refresh_rolling_summary(self, conversation: Conversation, cut: int) -> None:
         """
-        Keep a persistent summary of everything older than HISTORY_WINDOW in
-        conversation.context, so the bot doesn't forget what was agreed 30+
-        messages ago. Best-effort: any failure just means the summary lags.
+        Keep a persistent summary of every message before position `cut`
+        (where the last turn's token-budgeted history window started) in
+        conversation.context, so the bot doesn't forget what was agreed
+        before the window. Every message from the stored summary_upto up to
+        `cut` is folded in, oldest first, in bounded chunks; progress is
+        saved after each chunk. Runs off the reply path
+        (services/summary_pipeline.py). Best-effort: any failure just means
+        the summary lags.
         """
         try:
-            messages = conversation.messages or []
-            cut = len(messages) - self.HISTORY_WINDOW
             context = conversation.context or {}
-            if cut <= 0 or context.get('summary_upto', 0) >= cut:
-                return
-
-            older = [
-                m for m in messages[:cut]
-                if m.get('content') and m.get('role') in ('user', 'assistant')
-            ]
-            if not older:
-                return
-
-            transcript = "\n".join(
-                f"{'Paciente' if m['role'] == 'user' else 'Assistente'}: {m['content']}"
-                for m in older[-80:]
-            )
-            previous = context.get('summary')
-            if previous:
-                transcript = f"Resumo anterior:\n{previous}\n\nMensagens seguintes:\n{transcript}"
-
-            system = (
-                "Você mantém a memória de longo prazo de uma conversa de WhatsApp "
-                "entre um paciente e a assistente de uma clínica. Resuma em até 8 "
-                "linhas, em português do Brasil, apenas fatos úteis para continuar o "
-                "atendimento: nome e dados do paciente, o que ele quer, o que já foi "
-                "combinado ou agendado, preferências e pendências. Não invente nada."
-            )
-            summary = self._complete(
-                system, transcript, max_tokens=350, temperature=0.2,
-                model=current_app.config.get('OPENROUTER_MODEL_LIGHT'),
-                task='rolling_summary'
-            )
-            if summary:
+            upto = context.get('summary_upto', 0)
+            summary = context.get('summary')
+            while upto < cut:
+                chunk, consumed = self._next_summary_chunk(conversation, upto, cut)
+                if chunk:
+                    summary = self._summarize_chunk(summary, chunk)
+                    if not summary:
+                        return
+                upto += consumed
                 self.conversation_service.update_context(conversation, {
-                    'summary': summary.strip(),
-                    'summary_upto': cut,
+                    'summary': summary,
+                    'summary_upto': upto,
                 })
         except Exception as e:
             logger.warning('Rolling summary update failed (non-fatal): %s', e)
 
-    def transcribe_audio(self, base64_data: str, mimetype: str = None) -> Optional[str]:
+    @staticmethod
+    def _next_summary_chunk(conversation: Conversation, start: int, cut: int) -> tuple:
+        """
+        (messages to summarize, positions consumed) for the chunk starting at
+        `start`: at most SUMMARY_CHUNK_MESSAGES positions and about
+        SUMMARY_CHUNK_TOKENS of text - always at least one message.
+        """
+        chunk = []
+        tokens = 0
+        consumed = 0
+        for m in conversation.message_slice(start, min(SUMMARY_CHUNK_MESSAGES, cut - start)):
+            if m.get('content') and m.get('role') in ('user', 'assistant'):
+                cost = estimate_message_tokens(m)
+                if chunk and tokens + cost > SUMMARY_CHUNK_TOKENS:
+                    break
+                chunk.append(m)
+                tokens += cost
+            consumed += 1
+        # An empty slice means the messages are gone: nothing left to cover
+        return chunk, consumed or cut - start
+
+    def _summarize_chunk(self, previous: Optional[str], messages: list) -> Optional[str]:
+        transcript = "\n".join(
+            f"{'Paciente' if m['role'] == 'user' else 'Assistente'}: {m['content']}"
+            for m in messages
+        )
+        if previous:
+            transcript = f"Resumo anterior:\n{previous}\n\nMensagens seguintes:\n{transcript}"
+
+        system = (
+            "Você mantém a memória de longo prazo de uma conversa de WhatsApp "
+            "entre um paciente e a assistente de uma clínica. Resuma em até 8 "
+            "linhas, em português do Brasil, apenas fatos úteis para continuar o "
+            "atendimento: nome e dados do paciente, o que ele quer, o que já foi "
+            "combinado ou agendado, preferências e pendências. Não invente nada."
+        )
+        summary = self._complete(
+            system, transcript, max_tokens=350, temperature=0.2,
+            model=current_app.config.get('OPENROUTER_MODEL_LIGHT'),
+            task='rolling_summary'
+        )
+        return summary.strip() if summary else None
+
+    def transcribe_audio(self, base64_data: str, mimetype: str = None, content_sha256: str = None) -> Optional[str]:
         """
         Transcribe a patient voice note so the bot can keep handling the
         conversation instead of handing every audio off to a human.
 
         Uses an audio-capable multimodal model through OpenRouter
-        (AUDIO_TRANSCRIPTION_MODEL). Returns the transcript, or None on any
+        (AUDIO_TRANSCRIPTION_MODEL). Identical audio (retried webhooks,
+        forwarded voice notes) is answered from the AudioTranscript cache,
+        keyed by the SHA-256 of the decoded bytes - pass `content_sha256`
+        when it is already known. Returns the transcript, or None on any
         failure - callers fall back to the human-handoff path.
         """
         if not base64_data:
             return None
         try:
+            model = current_app.config.get('AUDIO_TRANSCRIPTION_MODEL')
+            if content_sha256 is None:
+                content_sha256 = hashlib.sha256(base64.b64decode(base64_data)).hexdigest()
+            cached = AudioTranscript.query.filter_by(
+                clinic_id=self.clinic.id, sha256=content_sha256, model=model
+            ).first()
+            if cached:
+                record_ai_usage(self.clinic.id, AiUsageService.WHATSAPP, 'transcribe_audio', model, None, cache_hit=True)
+                return cached.transcript
+
             audio_format = 'ogg'
             if mimetype and '/' in mimetype:
                 audio_format = mimetype.split('/')[-1].split(';')[0].strip() or 'ogg'
 
-            model = current_app.config.get('AUDIO_TRANSCRIPTION_MODEL')
             response = self.client.chat.completions.create(
                 model=model,
                 max_tokens=800,
@@ -1072,11 +1310,23 @@ class ClaudeService:
             )
             record_ai_usage(self.clinic.id, AiUsageService.WHATSAPP, 'transcribe_audio', model, response)
             text = (self._first_choice(response).message.content or '').strip()
+            if text:
+                self._store_transcript(content_sha256, model, text)
             return text or None
         except Exception as e:
             logger.warning('Audio transcription failed (falling back to human handoff): %s', e)
             return None
 
+    def _store_transcript(self, content_sha256: str, model: str, text: str) -> None:
+        try:
+            db.session.add(AudioTranscript(
+                clinic_id=self.clinic.id, sha256=content_sha256, model=model, transcript=text
+            ))
+            db.session.commit()
+        except IntegrityError:
+            # A concurrent delivery of the same audio stored it first
+            db.session.rollback()
+
     def process_message(
         self,
         conversation: Conversation,
@@ -1110,10 +1360,6 @@ class ClaudeService:
                 raise ValueError('new_message is required when store_user_message=True')
             self.conversation_service.add_message(conversation, 'user', new_message)
 
-        # Keep long conversations coherent: fold everything older than the
-        # history window into a rolling summary stored on the conversation.
-        self._maybe_update_rolling_summary(conversation)
-
         # Build system prompt
         context_info = self.conversation_service.get_context_summary(conversation)
         
@@ -1139,6 +1385,8 @@ class ClaudeService:
             
         context_block = f"CONTEXTO DO PACIENTE:\n{context_info}" if context_info else ""
 
+        bundle = self._prompt_bundle()
+
         # Determine strictness of system prompt
         custom_system_prompt = self._effective_system_prompt
         if custom_system_prompt:
@@ -1151,12 +1399,8 @@ class ClaudeService:
                 # Check what keys are in the custom prompt
                 system_prompt = custom_system_prompt.format(
                     current_datetime=current_datetime_str,
-                    clinic_name=self.clinic.name,
-                    services=self._format_services(),
-                    professionals=self._format_professionals(),
-                    pipeline_stages=self._format_pipeline_stages(),
-                    business_hours=self._format_business_hours(),
-                    context_info=context_block
+                    context_info=context_block,
+                    **bundle['prompt_vars']
                 )
             except KeyError:
                 # If custom prompt doesn't have matching keys, just use it as is (or append context manually)
@@ -1170,17 +1414,11 @@ class ClaudeService:
             # changes - billed at the cheap cached-read rate after the first
             # hit) and a dynamic suffix (today's date/time + this patient's
             # context, which change on every single message and so are never
-            # cached).
-            static_block = SYSTEM_PROMPT_STATIC_TEMPLATE.format(
-                clinic_name=self.clinic.name,
-                services=self._format_services(),
-                professionals=self._format_professionals(),
-                pipeline_stages=self._format_pipeline_stages(),
-                business_hours=self._format_business_hours(),
-            )
+            # cached). The static block comes precompiled from the bundle, so
+            # it's byte-identical between turns.
             dynamic_suffix = f"{current_datetime_str}\n\n{context_block}"
             system_prompt = [
-                {"type": "text", "text": static_block, "cache_control": {"type": "ephemeral"}},
+                {"type": "text", "text": bundle['static_block'], "cache_control": {"type": "ephemeral"}},
                 {"type": "text", "text": dynamic_suffix},
             ]
 
@@ -1188,7 +1426,7 @@ class ClaudeService:
         # customized agent_system_prompt - prevents the agent from answering
         # about procedures the clinic doesn't actually offer using its own
         # general training knowledge instead of the clinic's real service list.
-        guardrail_text = SCOPE_GUARDRAIL_TEMPLATE.format(services=self._format_services())
+        guardrail_text = bundle['guardrail']
         if isinstance(system_prompt, list):
             # Default-template path: system_prompt is [static cached block,
             # dynamic uncached block] - append to the last (uncached) block
@@ -1197,16 +1435,19 @@ class ClaudeService:
         else:
             system_prompt += guardrail_text
 
-        # Get message history
-        history = self.conversation_service.get_message_history_for_claude(conversation)
-        api_messages = [{"role": "system", "content": system_prompt}] + history
+        # Recent messages that fit the clinic's history token budget; older
+        # ones are covered by the rolling summary in context_info.
+        window = self.conversation_service.get_history_window(
+            conversation,
+            self._history_token_budget,
+            max_messages=current_app.config.get('AGENT_HISTORY_MAX_MESSAGES', 100)
+        )
+        history_stats = {'messages': len(window['messages']), 'tokens': window['tokens']}
+        api_messages = [{"role": "system", "content": system_prompt}] + window['messages']
 
         model = current_app.config.get('OPENROUTER_MODEL', 'anthropic/claude-sonnet-4.5')
         temperature = self._effective_temperature
-        tools = self._to_openai_tools(self._get_tools())
-        if tools:
-            # Cache the (large, otherwise-identical-every-call) tool schema block too.
-            tools[-1] = {**tools[-1], "cache_control": {"type": "ephemeral"}}
+        tools = bundle['tools']
 
         try:
             # Call OpenRouter
@@ -1218,10 +1459,13 @@ class ClaudeService:
                 messages=api_messages,
                 extra_body={"usage": USAGE_INCLUDE_COST},
             )
-            record_ai_usage(self.clinic.id, AiUsageService.WHATSAPP, 'process_message', model, response)
+            record_ai_usage(
+                self.clinic.id, AiUsageService.WHATSAPP, 'process_message', model, response, history=history_stats
+            )
 
             choice = self._first_choice(response)
             rounds = 0
+            tool_memo = ToolResultMemo()
             while choice.finish_reason == "tool_calls":
                 rounds += 1
                 if rounds > MAX_TOOL_ROUNDS:
@@ -1248,9 +1492,12 @@ class ClaudeService:
                     "tool_calls": [tc.model_dump() for tc in tool_calls],
                 })
 
-                for tool_call in tool_calls:
-                    tool_input = json.loads(tool_call.function.arguments or "{}")
-                    result = self._execute_tool(tool_call.function.name, tool_input, conversation)
+                results = self._run_tool_calls(
+                    [(tc.function.name, json.loads(tc.function.arguments or "{}")) for tc in tool_calls],
+                    conversation,
+                    tool_memo
+                )
+                for tool_call, result in zip(tool_calls, results):
                     api_messages.append({
                         "role": "tool",
                         "tool_call_id": tool_call.id,
@@ -1265,14 +1512,27 @@ class ClaudeService:
                     messages=api_messages,
                     extra_body={"usage": USAGE_INCLUDE_COST},
                 )
-                record_ai_usage(self.clinic.id, AiUsageService.WHATSAPP, 'process_message', model, response)
+                record_ai_usage(
+                    self.clinic.id, AiUsageService.WHATSAPP, 'process_message', model, response, history=history_stats
+                )
                 choice = self._first_choice(response)
 
             final_response = choice.message.content or ""
+            log_tool_memo_stats(
+                self.clinic.id, AiUsageService.WHATSAPP, 'process_message', tool_memo.calls, tool_memo.hits
+            )
 
             # Add assistant response to history
             self.conversation_service.add_message(conversation, 'assistant', final_response)
 
+            # Keep long conversations coherent: while the conversation is idle
+            # waiting for the patient, fold everything older than the history
+            # window into the rolling summary the next turn's context uses.
+            try:
+                summary_pipeline.schedule_rolling_summary(self, conversation, window['start'])
+            except Exception:
+                logger.exception('Failed to schedule rolling summary')
+
             return final_response
 
         except openai.APIError as e:
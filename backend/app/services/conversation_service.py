@@ -2,9 +2,12 @@ import logging
 from typing import Optional
 
 from app import db
-from app.models import Conversation, Patient, BotTransfer, ConversationStatus
+from app.models import Conversation, ConversationMessage, Patient, BotTransfer, ConversationStatus
+from app.models.conversation import MessageStatus
+from app.utils.token_estimate import estimate_message_tokens
 from app.utils.validators import normalize_phone
 from app.services.realtime_service import publish_event
+from app.services import webhook_dedup
 
 logger = logging.getLogger(__name__)
 
@@ -56,7 +59,6 @@ class ConversationService:
             clinic_id=self.clinic.id,
             patient_id=patient.id if patient else None,
             phone_number=phone,
-            messages=[],
             context={}
         )
 
@@ -102,6 +104,7 @@ class ConversationService:
             sent_via=sent_via
         )
         db.session.commit()
+        self._mark_evolution_id_seen(evolution_id)
 
         if not conversation.phone_number.startswith(TEST_PHONE_PREFIX):
             publish_event(str(self.clinic.id), 'new_message', {
@@ -112,19 +115,75 @@ class ConversationService:
 
         return message
 
-    def find_conversation_with_message(self, phone_number: str, evolution_id: str) -> Optional[Conversation]:
-        """Find the conversation (active or not) for this phone that contains a message with this evolution_id."""
-        phone = normalize_phone(phone_number)
-        conversations = Conversation.query.filter_by(
+    def _mark_evolution_id_seen(self, evolution_id: Optional[str]) -> None:
+        """
+        Record a stored message's WhatsApp id in the webhook dedup set, so a
+        later upsert carrying it (Evolution's echo of a message we sent, or a
+        retry) is answered as a duplicate without a database lookup.
+        """
+        if evolution_id:
+            webhook_dedup.complete(self.clinic.evolution_instance_name, evolution_id)
+
+    def find_message_by_evolution_id(self, evolution_id: str) -> Optional[ConversationMessage]:
+        """
+        Resolve a WhatsApp message id to its stored message row, across all of
+        this clinic's conversations, through the (clinic_id, evolution_id)
+        index - no conversation is loaded.
+        """
+        if not evolution_id:
+            return None
+        return ConversationMessage.query.filter_by(
             clinic_id=self.clinic.id,
-            phone_number=phone
-        ).order_by(Conversation.last_message_at.desc()).all()
+            evolution_id=evolution_id
+        ).first()
 
-        for conversation in conversations:
-            if conversation.find_message(evolution_id):
-                return conversation
+    def apply_status_acks(self, acks: dict) -> int:
+        """
+        Apply a batch of delivery/read ACKs ({evolution_id: status}), as
+        delivered in one messages.update webhook.
+
+        All matching message rows are locked in a single statement (in id
+        order, so concurrent batches can't deadlock), every transition is
+        applied, the batch commits once and one coalesced `message_status`
+        event goes out per conversation. Downgrades (e.g. 'delivered'
+        arriving after 'read') and repeats are skipped without a write.
+
+        Returns the number of messages whose status actually changed.
+        """
+        if not acks:
+            return 0
+
+        evolution_ids = list(acks)
+        rows = []
+        for i in range(0, len(evolution_ids), 500):
+            rows.extend(
+                ConversationMessage.query.filter(
+                    ConversationMessage.clinic_id == self.clinic.id,
+                    ConversationMessage.evolution_id.in_(evolution_ids[i:i + 500]),
+                ).order_by(ConversationMessage.id).with_for_update().all()
+            )
 
-        return None
+        changed = {}
+        for row in rows:
+            new_status = acks[row.evolution_id]
+            if not MessageStatus.is_upgrade(row.status, new_status):
+                continue
+            row.status = new_status
+            changed.setdefault(str(row.conversation_id), []).append({
+                'message_id': row.message_id,
+                'status': new_status,
+            })
+
+        # Commit even when nothing changed, to release the row locks.
+        db.session.commit()
+
+        for conversation_id, updates in changed.items():
+            publish_event(str(self.clinic.id), 'message_status', {
+                'conversation_id': conversation_id,
+                'updates': updates,
+            })
+
+        return sum(len(updates) for updates in changed.values())
 
     def update_message_status(
         self,
@@ -147,6 +206,28 @@ class ConversationService:
 
         return updated
 
+    def patch_message(
+        self,
+        conversation: Conversation,
+        message_id: str,
+        **fields
+    ) -> Optional[dict]:
+        """Update a stored message's content/media and broadcast the new version."""
+        updated = conversation.patch_message(message_id, **fields)
+        if not updated:
+            return None
+
+        db.session.commit()
+
+        if not conversation.phone_number.startswith(TEST_PHONE_PREFIX):
+            publish_event(str(self.clinic.id), 'message_updated', {
+                'conversation_id': str(conversation.id),
+                'conversation_status': conversation.status,
+                'message': updated
+            })
+
+        return updated
+
     def attach_evolution_id_to_last_reply(
         self,
         conversation: Conversation,
@@ -156,6 +237,20 @@ class ConversationService:
         updated = conversation.set_evolution_id_for_last_message(evolution_id, role='assistant')
         if updated:
             db.session.commit()
+            self._mark_evolution_id_seen(evolution_id)
+        return updated
+
+    def attach_evolution_id(
+        self,
+        conversation: Conversation,
+        message_id: str,
+        evolution_id: str
+    ) -> Optional[dict]:
+        """Attach the real WhatsApp message id to a message once its send went through."""
+        updated = conversation.set_evolution_id(message_id, evolution_id)
+        if updated:
+            db.session.commit()
+            self._mark_evolution_id_seen(evolution_id)
         return updated
 
     def attach_evolution_id_to_last_inbound(
@@ -167,6 +262,7 @@ class ConversationService:
         updated = conversation.set_evolution_id_for_last_message(evolution_id, role='user')
         if updated:
             db.session.commit()
+            self._mark_evolution_id_seen(evolution_id)
         return updated
 
     def update_context(
@@ -181,9 +277,9 @@ class ConversationService:
             conversation: The conversation to update
             context_updates: Dict of context values to update
         """
-        current_context = conversation.context or {}
-        current_context.update(context_updates)
-        conversation.context = current_context
+        # A new dict: the plain JSONB column doesn't track in-place changes,
+        # so updating the loaded dict would never be written
+        conversation.context = {**(conversation.context or {}), **context_updates}
         db.session.commit()
 
     def link_patient(
@@ -264,10 +360,7 @@ class ConversationService:
         Returns:
             List of message dicts for Claude API
         """
-        messages = conversation.messages or []
-
-        # Take last N messages
-        recent_messages = messages[-max_messages:]
+        recent_messages = conversation.recent_messages(max_messages)
 
         # Format for Claude API. Skip empty-content entries (e.g. a media
         # message stored without a caption in older data) - Claude's API
@@ -283,6 +376,45 @@ class ConversationService:
 
         return formatted
 
+    def get_history_window(
+        self,
+        conversation: Conversation,
+        token_budget: int,
+        max_messages: int = 100
+    ) -> dict:
+        """
+        The most recent messages that fit in `token_budget` (local estimate,
+        see utils/token_estimate.py), formatted for the model. The newest
+        message is always included, however long. Everything before the
+        window is left to the rolling summary.
+
+        Returns {'messages': [...], 'start': chronological position of the
+        oldest message in the window, 'tokens': estimated tokens}.
+        """
+        recent_messages = conversation.recent_messages(max_messages)
+
+        packed = []
+        tokens = 0
+        taken = 0
+        for msg in reversed(recent_messages):
+            if not msg.get('content'):
+                taken += 1
+                continue
+            entry = {'role': msg['role'], 'content': msg['content']}
+            cost = estimate_message_tokens(entry)
+            if packed and tokens + cost > token_budget:
+                break
+            packed.append(entry)
+            tokens += cost
+            taken += 1
+
+        packed.reverse()
+        return {
+            'messages': packed,
+            'start': max((conversation.message_count or 0) - taken, 0),
+            'tokens': tokens,
+        }
+
     def get_context_summary(self, conversation: Conversation) -> str:
         """
         Get a summary of the conversation context for Claude.
@@ -1,10 +1,12 @@
 import logging
 from typing import Optional
+import httpx
 import requests
 import uuid
 
 from flask import current_app
 
+from app.utils.http_pool import DEFAULT_POOL_SIZE, get_session
 from app.utils.validators import normalize_phone
 from app.utils.whatsapp_message import normalize_raw_message
 
@@ -16,6 +18,18 @@ logger = logging.getLogger(__name__)
 HISTORY_PAGE_SIZE = 100
 HISTORY_MAX_PAGES = 40
 
+# (connect, read) timeouts per kind of call. Connecting to the gateway is
+# quick or not happening; reads vary with what Evolution has to do.
+_TIMEOUTS = {
+    'admin': (5, 30),
+    'send': (5, 30),
+    'presence': (3, 5),
+    'media_download': (5, 30),
+    'media_send': (5, 60),
+    'status': (3, 10),
+    'history': (5, 30),
+}
+
 
 class EvolutionService:
     """Service for interacting with Evolution API (WhatsApp)."""
@@ -38,6 +52,13 @@ class EvolutionService:
             
         self.instance_name = self.clinic.evolution_instance_name
 
+    @property
+    def _http(self) -> requests.Session:
+        """Keep-alive session shared by every EvolutionService in this process."""
+        return get_session(
+            self.api_url, pool_size=current_app.config.get('EVOLUTION_HTTP_POOL_SIZE', DEFAULT_POOL_SIZE)
+        )
+
     def _get_headers(self) -> dict:
         """Get headers for API requests."""
         return {
@@ -45,6 +66,20 @@ class EvolutionService:
             'Content-Type': 'application/json'
         }
 
+    @staticmethod
+    def _request_error(e: requests.exceptions.RequestException) -> dict:
+        """
+        Error result for a failed request. `status_code` is None when no
+        response came back (connection error, timeout); `retry_after` is set
+        when Evolution asked us to slow down.
+        """
+        response = e.response
+        error = {'error': str(e), 'status_code': response.status_code if response is not None else None}
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after and retry_after.isdigit():
+            error['retry_after'] = int(retry_after)
+        return error
+
     def create_instance(self) -> dict:
         """
         Create a new WhatsApp instance for this clinic.
@@ -63,11 +98,11 @@ class EvolutionService:
         }
 
         try:
-            response = requests.post(
+            response = self._http.post(
                 url,
                 json=payload,
                 headers=self._get_headers(),
-                timeout=30
+                timeout=_TIMEOUTS['admin']
             )
             
             # If 403, instance might already exist, which is fine
@@ -111,21 +146,8 @@ class EvolutionService:
             logger.error('Failed to auto-configure webhook: %s', str(e))
 
 
-    def send_message(self, phone: str, message: str) -> dict:
-        """
-        Send a text message via WhatsApp.
-
-        Args:
-            phone: Phone number in format 5511999999999
-            message: Text message to send
-
-        Returns:
-            API response dict
-        """
-        if not self.api_url or not self.api_key:
-            logger.error('Evolution API not configured globally')
-            return {'error': 'Evolution API not configured'}
-
+    def _text_request(self, phone: str, message: str) -> tuple:
+        """URL and payload of a sendText call."""
         url = f'{self.api_url}/message/sendText/{self.instance_name}'
 
         # Evolution API v2 payload structure
@@ -138,7 +160,7 @@ class EvolutionService:
                 "linkPreview": False
             }
         }
-        
+
         # Some versions use this structure:
         # payload = {
         #    "number": phone,
@@ -146,15 +168,33 @@ class EvolutionService:
         #        "text": message
         #    }
         # }
-        
+
         # Let's try the simple flat structure first but add options which might be required by some setups
+        return url, payload
+
+    def send_message(self, phone: str, message: str) -> dict:
+        """
+        Send a text message via WhatsApp.
+
+        Args:
+            phone: Phone number in format 5511999999999
+            message: Text message to send
+
+        Returns:
+            API response dict
+        """
+        if not self.api_url or not self.api_key:
+            logger.error('Evolution API not configured globally')
+            return {'error': 'Evolution API not configured'}
+
+        url, payload = self._text_request(phone, message)
 
         try:
-            response = requests.post(
+            response = self._http.post(
                 url,
                 json=payload,
                 headers=self._get_headers(),
-                timeout=30
+                timeout=_TIMEOUTS['send']
             )
             
             # Log response body for debugging 400 errors
@@ -166,7 +206,57 @@ class EvolutionService:
             return response.json()
         except requests.exceptions.RequestException as e:
             logger.error('Failed to send message via Evolution API: %s', str(e))
-            return {'error': str(e)}
+            return self._request_error(e)
+
+    async def send_message_async(self, client: httpx.AsyncClient, phone: str, message: str) -> dict:
+        """
+        send_message() on an asyncio HTTP client, for bulk sends (see
+        send_messages_bulk). Same result shape, including status_code /
+        retry_after on errors.
+        """
+        if not self.api_url or not self.api_key:
+            logger.error('Evolution API not configured globally')
+            return {'error': 'Evolution API not configured'}
+
+        url, payload = self._text_request(phone, message)
+        connect, read = _TIMEOUTS['send']
+        try:
+            response = await client.post(
+                url,
+                json=payload,
+                headers=self._get_headers(),
+                timeout=httpx.Timeout(read, connect=connect)
+            )
+            if response.status_code == 400:
+                logger.error('Evolution API 400 Error: %s', response.text)
+            response.raise_for_status()
+            logger.info('Message sent to %s via Evolution API', phone)
+            return response.json()
+        except httpx.HTTPStatusError as e:
+            logger.error('Failed to send message via Evolution API: %s', str(e))
+            error = {'error': str(e), 'status_code': e.response.status_code}
+            retry_after = e.response.headers.get('Retry-After')
+            if retry_after and retry_after.isdigit():
+                error['retry_after'] = int(retry_after)
+            return error
+        except (httpx.HTTPError, ValueError) as e:
+            logger.error('Failed to send message via Evolution API: %s', str(e))
+            return {'error': str(e), 'status_code': None}
+
+    def send_messages_bulk(self, messages: list, lane: str = None, concurrency: int = None) -> list:
+        """
+        Send many texts ([(phone, message), ...]) from this instance
+        concurrently - bounded by `concurrency` (EVOLUTION_BULK_CONCURRENCY)
+        and paced by the outbound queue. Returns one result per message, in
+        order.
+        """
+        from app.services import outbound_queue
+
+        return outbound_queue.send_bulk(
+            [(self, phone, message) for phone, message in messages],
+            lane=lane or outbound_queue.Lane.REMINDER,
+            concurrency=concurrency,
+        )
 
     def send_presence(self, phone: str, presence: str = 'composing', delay_ms: int = 10000) -> None:
         """
@@ -177,11 +267,11 @@ class EvolutionService:
         if not self.api_url or not self.api_key:
             return
         try:
-            requests.post(
+            self._http.post(
                 f'{self.api_url}/chat/sendPresence/{self.instance_name}',
                 json={'number': phone, 'presence': presence, 'delay': delay_ms},
                 headers=self._get_headers(),
-                timeout=5
+                timeout=_TIMEOUTS['presence']
             )
         except requests.exceptions.RequestException as e:
             logger.debug('sendPresence failed (non-fatal): %s', e)
@@ -203,7 +293,7 @@ class EvolutionService:
             'convertToMp4': False,
         }
         try:
-            response = requests.post(url, json=payload, headers=self._get_headers(), timeout=30)
+            response = self._http.post(url, json=payload, headers=self._get_headers(), timeout=_TIMEOUTS['media_download'])
             response.raise_for_status()
             data = response.json() or {}
             b64 = data.get('base64') or data.get('media')
@@ -262,11 +352,11 @@ class EvolutionService:
             }
 
         try:
-            response = requests.post(
+            response = self._http.post(
                 url,
                 json=payload,
                 headers=self._get_headers(),
-                timeout=60
+                timeout=_TIMEOUTS['media_send']
             )
 
             if response.status_code == 400:
@@ -292,10 +382,10 @@ class EvolutionService:
         url = f'{self.api_url}/instance/connectionState/{self.instance_name}'
 
         try:
-            response = requests.get(
+            response = self._http.get(
                 url,
                 headers=self._get_headers(),
-                timeout=10
+                timeout=_TIMEOUTS['status']
             )
             
             # If 404, instance doesn't exist
@@ -364,11 +454,11 @@ class EvolutionService:
         payload = {'webhook': webhook_config}
 
         try:
-            response = requests.post(
+            response = self._http.post(
                 url,
                 json=payload,
                 headers=self._get_headers(),
-                timeout=30
+                timeout=_TIMEOUTS['admin']
             )
             response.raise_for_status()
             logger.info('Webhook configured for instance %s', self.instance_name)
@@ -406,10 +496,10 @@ class EvolutionService:
         url = f'{self.api_url}/instance/connect/{self.instance_name}'
 
         try:
-            response = requests.get(
+            response = self._http.get(
                 url,
                 headers=self._get_headers(),
-                timeout=30
+                timeout=_TIMEOUTS['admin']
             )
             response.raise_for_status()
             data = response.json()
@@ -477,11 +567,11 @@ class EvolutionService:
             }
 
             try:
-                response = requests.post(
+                response = self._http.post(
                     url,
                     json=payload,
                     headers=self._get_headers(),
-                    timeout=30
+                    timeout=_TIMEOUTS['history']
                 )
                 response.raise_for_status()
             except requests.exceptions.RequestException as e:
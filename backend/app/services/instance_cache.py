@@ -0,0 +1,194 @@
+"""
+Two-tier cache of Evolution instance name -> clinic id + hot flags.
+
+Every webhook event (messages, ACKs, typing presence, connection updates)
+starts by resolving its `instance` to a clinic; presence alone can be dozens
+of events per minute per open chat. Entries live in a small in-process dict
+(LOCAL_TTL, per worker) in front of Redis (REDIS_TTL, shared), and unknown
+instances are cached too (negatively), so floods from a deleted or
+unconfigured instance never reach Postgres.
+
+Invalidation is explicit and automatic: mapper events on Clinic drop the
+entry for the old and new instance names whenever a field the entry is
+derived from (or the connection state) changes - once at flush and again
+after commit, so a concurrent reader can't re-cache the pre-commit row. The
+local tier of *other* processes only catches up after LOCAL_TTL, which is
+kept short for that reason.
+"""
+import json
+import logging
+import threading
+import time
+import uuid
+
+from sqlalchemy import event, inspect as sa_inspect
+from sqlalchemy.orm import Session
+
+from app import db
+from app.models import Clinic
+from app.services.realtime_service import _get_redis_client
+
+logger = logging.getLogger(__name__)
+
+LOCAL_TTL = 10          # seconds; bounds cross-process staleness after a change
+REDIS_TTL = 300
+_LOCAL_MAX_ENTRIES = 5000
+_REDIS_KEY = 'sdental:instance:{name}'
+
+# Clinic fields an entry is built from (plus connection state, whose change
+# must also be visible to the next webhook immediately)
+_WATCHED_FIELDS = ('evolution_instance_name', 'agent_enabled', 'active', 'whatsapp_connection_state')
+
+_local_lock = threading.Lock()
+_local: dict[str, tuple[float, dict]] = {}
+
+# Cached value for instances with no clinic
+_UNKNOWN = {'id': None}
+
+
+def _entry_for(clinic) -> dict:
+    return {
+        'id': str(clinic.id),
+        'agent_enabled': bool(clinic.agent_enabled),
+        'active': bool(clinic.active),
+    }
+
+
+def lookup_instance(instance_name: str):
+    """
+    Resolve an instance name to {'id', 'agent_enabled', 'active'}, or None
+    when no clinic uses it. Inactive clinics are returned (flagged) - callers
+    decide whether inactive matters for the event at hand.
+    """
+    if not instance_name:
+        return None
+
+    now = time.monotonic()
+    with _local_lock:
+        cached = _local.get(instance_name)
+    if cached and cached[0] > now:
+        entry = cached[1]
+        return entry if entry.get('id') else None
+
+    entry = _redis_get(instance_name)
+    if entry is None:
+        # Should an (old, deactivated) clinic still carry the same name, the
+        # active one wins
+        clinic = Clinic.query.filter_by(
+            evolution_instance_name=instance_name
+        ).order_by(Clinic.active.desc()).first()
+        entry = _entry_for(clinic) if clinic else dict(_UNKNOWN)
+        _redis_set(instance_name, entry)
+
+    with _local_lock:
+        if len(_local) >= _LOCAL_MAX_ENTRIES:
+            _local.clear()
+        _local[instance_name] = (now + LOCAL_TTL, entry)
+    return entry if entry.get('id') else None
+
+
+def load_clinic(entry: dict):
+    """The Clinic row for a cache entry (primary-key load), or None."""
+    if not entry:
+        return None
+    return db.session.get(Clinic, uuid.UUID(entry['id']))
+
+
+def get_active_clinic(instance_name: str):
+    """The active Clinic for an instance, or None."""
+    entry = lookup_instance(instance_name)
+    if not entry or not entry['active']:
+        return None
+    return load_clinic(entry)
+
+
+def invalidate_instance(*instance_names) -> None:
+    names = [n for n in instance_names if n]
+    if not names:
+        return
+    with _local_lock:
+        for name in names:
+            _local.pop(name, None)
+    try:
+        client = _get_redis_client()
+    except RuntimeError:
+        # Outside an app context before the client was ever resolved
+        client = None
+    if client is not None:
+        try:
+            client.delete(*[_REDIS_KEY.format(name=n) for n in names])
+        except Exception as e:
+            logger.warning('instance cache: redis invalidation failed (%s)', e)
+
+
+def _redis_get(instance_name: str):
+    client = _get_redis_client()
+    if client is None:
+        return None
+    try:
+        raw = client.get(_REDIS_KEY.format(name=instance_name))
+        return json.loads(raw) if raw else None
+    except Exception:
+        return None
+
+
+def _redis_set(instance_name: str, entry: dict) -> None:
+    client = _get_redis_client()
+    if client is None:
+        return
+    try:
+        client.set(_REDIS_KEY.format(name=instance_name), json.dumps(entry), ex=REDIS_TTL)
+    except Exception:
+        pass
+
+
+# ---------------------------------------------------------------------------
+# Invalidation hooks
+# ---------------------------------------------------------------------------
+
+def _changed_instance_names(target, all_fields: bool = False) -> set:
+    state = sa_inspect(target)
+    names = {target.evolution_instance_name}
+    if all_fields:
+        return names
+    history = state.attrs.evolution_instance_name.history
+    names.update(history.deleted or ())
+    if not any(state.attrs[f].history.has_changes() for f in _WATCHED_FIELDS):
+        return set()
+    return names
+
+
+def _remember(target, names: set) -> None:
+    names.discard(None)
+    if not names:
+        return
+    invalidate_instance(*names)
+    session = Session.object_session(target)
+    if session is not None:
+        session.info.setdefault('instance_cache_invalidate', set()).update(names)
+
+
+@event.listens_for(Clinic, 'after_insert')
+@event.listens_for(Clinic, 'after_delete')
+def _clinic_created_or_deleted(mapper, connection, target):
+    _remember(target, _changed_instance_names(target, all_fields=True))
+
+
+@event.listens_for(Clinic, 'after_update')
+def _clinic_updated(mapper, connection, target):
+    _remember(target, _changed_instance_names(target))
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_after_commit(session):
+    names = session.info.pop('instance_cache_invalidate', None)
+    if names:
+        invalidate_instance(*names)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _invalidate_after_rollback(session):
+    # This session may have cached its own uncommitted values in between
+    names = session.info.pop('instance_cache_invalidate', None)
+    if names:
+        invalidate_instance(*names)
@@ -0,0 +1,248 @@
+"""
+Background stage for inbound WhatsApp media: download, storage and voice-note
+transcription.
+
+Fetching media through Evolution (getBase64FromMediaMessage, up to a 30s
+timeout), decoding up to MAX_MEDIA_BYTES and transcribing a voice note used
+to happen inside the webhook request - one slow audio held a Gunicorn thread
+for up to a minute. The webhook now stores the message right away with a
+placeholder (caption or "Audio enviado", WhatsApp CDN URL) and schedules
+`ingest_media` here. When the asset (and transcript) is ready the stored
+message is patched and re-broadcast as a `message_updated` event; for
+transcribed voice notes the AI reply is enqueued only then, so the bot
+answers the transcript rather than the placeholder.
+
+MEDIA_INGEST_ASYNC=false runs the stage inline in the caller's thread (the
+test suite does this, like MESSAGE_AGGREGATION_SECONDS=0 for replies).
+
+The pool is process-local, so a restart or redeploy drops whatever it had
+queued. `recover_stalled_media` (a scheduler job) re-submits the stage for
+recent placeholders that were never patched - otherwise their media would
+never be stored and a voice note that needed a handoff would never get one.
+"""
+import base64
+import binascii
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from flask import current_app
+
+from app import db
+from app.models import (
+    Clinic, Conversation, ConversationMessage, ConversationStatus, MediaAsset, MAX_MEDIA_BYTES
+)
+from app.models.conversation import MessageStatus, MessageType
+from app.services.claude_service import ClaudeService
+from app.services.conversation_service import ConversationService
+from app.services.evolution_service import EvolutionService
+from app.services.message_processor import enqueue_reply
+from app.utils.datetime_utils import utcnow
+
+logger = logging.getLogger(__name__)
+
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='media-worker')
+
+# A placeholder still unpatched this long after it arrived lost its job
+# (well past the media download + transcription timeouts, and any backlog).
+RECOVERY_GRACE = timedelta(minutes=10)
+# Older placeholders are left alone: WhatsApp media URLs expire, and a
+# download that keeps failing shouldn't be retried forever.
+RECOVERY_HORIZON = timedelta(hours=1)
+RECOVERY_BATCH = 20
+
+# Message ids whose recovery is queued or running in this process, so a
+# sweep doesn't resubmit what the previous one hasn't finished yet.
+_recovering: set = set()
+_recovering_lock = threading.Lock()
+
+
+def schedule_media_ingest(
+    clinic,
+    conversation,
+    message_id: str,
+    evolution_id: str,
+    media_type: str,
+    mimetype: str,
+    phone: str,
+    transcribe: bool = False
+) -> str:
+    """
+    Fetch, store (and optionally transcribe) the media of an already stored
+    placeholder message. Returns 'inline' or 'scheduled'.
+    """
+    app = current_app._get_current_object()
+    args = (
+        app, str(clinic.id), str(conversation.id), message_id,
+        evolution_id, media_type, mimetype, phone, transcribe,
+    )
+    if not current_app.config.get('MEDIA_INGEST_ASYNC', True):
+        ingest_media(*args)
+        return 'inline'
+    _executor.submit(ingest_media, *args)
+    return 'scheduled'
+
+
+def ingest_media(
+    app,
+    clinic_id: str,
+    cid: str,
+    message_id: str,
+    evolution_id: str,
+    media_type: str,
+    mimetype: str,
+    phone: str,
+    transcribe: bool
+) -> None:
+    with app.app_context():
+        try:
+            _ingest(clinic_id, cid, message_id, evolution_id, media_type, mimetype, phone, transcribe)
+        except Exception:
+            logger.exception('media ingest failed for message %s (conversation %s)', message_id, cid)
+            db.session.rollback()
+            if transcribe:
+                # Nobody is going to answer this voice note automatically
+                _hand_off(clinic_id, cid, media_type)
+
+
+def _ingest(clinic_id, cid, message_id, evolution_id, media_type, mimetype, phone, transcribe) -> None:
+    clinic = db.session.get(Clinic, clinic_id)
+    conversation = db.session.get(Conversation, cid)
+    if not clinic or not conversation:
+        return
+    conversation_service = ConversationService(clinic)
+
+    # Persist our own copy (WhatsApp CDN URLs are E2E-encrypted and expire)
+    asset, asset_b64 = _store_asset(clinic, evolution_id, mimetype)
+    patch = {}
+    if asset is not None:
+        patch = {'media_url': asset.public_path, 'media_mimetype': asset.mimetype}
+        mimetype = asset.mimetype
+
+    transcript = None
+    if transcribe and asset_b64:
+        # State may have changed while the audio was downloading
+        db.session.refresh(clinic)
+        db.session.refresh(conversation)
+        if clinic.agent_enabled and conversation.status == ConversationStatus.ACTIVE:
+            transcript = ClaudeService(clinic).transcribe_audio(
+                asset_b64, mimetype, content_sha256=asset.sha256
+            )
+    if transcript:
+        patch.update(content=transcript, caption=transcript)
+    elif transcribe:
+        # Before the patch, so the message_updated event carries the new status
+        _hand_off(clinic_id, cid, media_type)
+
+    if patch:
+        conversation_service.patch_message(conversation, message_id, **patch)
+
+    if transcript:
+        enqueue_reply(clinic, conversation, phone)
+
+
+def _store_asset(clinic, evolution_id: str, mimetype: str):
+    """Download the media via Evolution into a MediaAsset. Returns (asset, base64) or (None, None)."""
+    fetched = EvolutionService(clinic).get_media_base64(evolution_id)
+    if not fetched:
+        return None, None
+    try:
+        raw = base64.b64decode(fetched['base64'], validate=True)
+    except (binascii.Error, ValueError) as e:
+        logger.warning('Discarding undecodable media payload: %s', e)
+        return None, None
+    if not 0 < len(raw) <= MAX_MEDIA_BYTES:
+        return None, None
+
+    asset = MediaAsset(
+        clinic_id=clinic.id,
+        mimetype=fetched.get('mimetype') or mimetype or 'application/octet-stream',
+        data=raw,
+    )
+    db.session.add(asset)
+    db.session.commit()
+    return asset, fetched['base64']
+
+
+def _hand_off(clinic_id: str, cid: str, media_type: str) -> None:
+    """A voice note we couldn't transcribe goes to a human, as other media do."""
+    clinic = db.session.get(Clinic, clinic_id)
+    conversation = db.session.get(Conversation, cid)
+    if not clinic or not conversation:
+        return
+    if conversation.status != ConversationStatus.TRANSFERRED_TO_HUMAN:
+        ConversationService(clinic).transfer_to_human(
+            conversation,
+            f'Paciente enviou {media_type} - requer atendimento humano'
+        )
+
+
+def recover_stalled_media() -> int:
+    """
+    Re-submit the media stage for inbound placeholders whose job never
+    finished (lost on a restart/redeploy). A placeholder is an inbound media
+    message with a WhatsApp id, still in the 'sent' status the webhook
+    stores it with (history-synced media is stored delivered/read), whose
+    media_url doesn't point at a stored asset yet.
+
+    The retries go to the ingest pool like any other media (inline when
+    MEDIA_INGEST_ASYNC is off), so the scheduler job itself only queries -
+    downloads and transcriptions can't outlast its lock. Returns how many
+    were submitted.
+    """
+    now = utcnow()
+    rows = ConversationMessage.query.filter(
+        ConversationMessage.role == 'user',
+        ConversationMessage.status == MessageStatus.SENT,
+        ConversationMessage.evolution_id.isnot(None),
+        ConversationMessage.message_type.in_([MessageType.IMAGE, MessageType.AUDIO, MessageType.DOCUMENT]),
+        ConversationMessage.timestamp.between(now - RECOVERY_HORIZON, now - RECOVERY_GRACE),
+        db.or_(
+            ConversationMessage.media_url.is_(None),
+            ~ConversationMessage.media_url.startswith('/api/media/'),
+        ),
+    ).order_by(ConversationMessage.timestamp).limit(RECOVERY_BATCH).all()
+
+    app = current_app._get_current_object()
+    inline = not current_app.config.get('MEDIA_INGEST_ASYNC', True)
+    submitted = 0
+    for row in rows:
+        with _recovering_lock:
+            if row.message_id in _recovering:
+                continue
+            _recovering.add(row.message_id)
+        clinic = db.session.get(Clinic, row.clinic_id)
+        conversation = db.session.get(Conversation, row.conversation_id)
+        if not clinic or not conversation:
+            _done_recovering(row.message_id)
+            continue
+        transcribe = (
+            row.message_type == MessageType.AUDIO
+            and clinic.agent_enabled
+            and conversation.status == ConversationStatus.ACTIVE
+        )
+        logger.info('Recovering stalled media ingest for message %s (conversation %s)',
+                    row.message_id, conversation.id)
+        args = (
+            row.message_id, app, str(clinic.id), str(conversation.id), row.message_id, row.evolution_id,
+            row.message_type, row.media_mimetype, conversation.phone_number, transcribe,
+        )
+        if inline:
+            _recover(*args)
+        else:
+            _executor.submit(_recover, *args)
+        submitted += 1
+    return submitted
+
+
+def _recover(message_id: str, *ingest_args) -> None:
+    try:
+        ingest_media(*ingest_args)
+    finally:
+        _done_recovering(message_id)
+
+
+def _done_recovering(message_id: str) -> None:
+    with _recovering_lock:
+        _recovering.discard(message_id)
@@ -7,16 +7,37 @@ window (MESSAGE_AGGREGATION_SECONDS) debounces rapid-fire messages so a burst
 like "oi" / "queria marcar" / "pra amanhã" gets ONE combined reply instead of
 three concurrent ones.
 
-Coordination is Redis-first (deadline + lock keys, correct across Gunicorn
-workers). Without Redis it falls back to per-process state - with more than
-one worker a burst may split between processes, which degrades to at most one
-reply per worker (still strictly better than today's one reply per message).
+The debounce is a delayed queue, not a sleeping thread per conversation:
+every conversation awaiting a reply is a member of a sorted set scored by
+the time its reply is due. A new message only moves the score (ZADD), up to
+a cap counted from the first message of the burst. A single dispatcher
+(one per deployment, elected with a lease) blocks on a wake-up list until
+the earliest score comes due or an enqueue pokes it, pops the due
+conversations and hands each one to a reply worker - replies fire within
+milliseconds of the deadline, and nothing polls while idle.
+
+Coordination is Redis-first (correct across Gunicorn workers). Without Redis
+the same scheduler runs on an in-process heap - with more than one worker a
+burst may split between processes, which degrades to at most one reply per
+worker (still strictly better than one reply per message).
+
+Reply workers are this process's reply pool or, with CHAT_WORKER_QUEUE on,
+`flask chat-worker` processes fed through a Redis queue
+(services/reply_queue.py), which survives web restarts and keeps LLM latency
+off the HTTP workers. Either way jobs are scheduled fairly across clinics,
+with per-clinic and global caps on concurrent LLM calls. A per-conversation
+lease keeps one reply in flight per conversation; messages that arrive
+during a reply are answered right after.
 
 A window of 0 processes inline (synchronously, in the caller's thread): used
 by the test suite and available as an escape hatch via
 MESSAGE_AGGREGATION_SECONDS=0.
 """
+import heapq
+import json
 import logging
+import os
+import socket
 import threading
 import time
 import uuid as uuid_lib
@@ -29,25 +50,57 @@ from app.models import Clinic, Conversation, ConversationStatus
 from app.services.claude_service import ClaudeService
 from app.services.conversation_service import ConversationService
 from app.services.evolution_service import EvolutionService
+from app.services import outbound_queue, reply_queue
 from app.services.realtime_service import _get_redis_client
 
 logger = logging.getLogger(__name__)
 
-_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='chat-worker')
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='chat-presence')
 
 # In-process fallback state (used when Redis is unavailable)
 _local_lock = threading.Lock()
-_local_deadlines: dict[str, float] = {}
 _local_running: set[str] = set()
 
-_DEADLINE_KEY = 'sdental:chat:deadline:{cid}'
+_DUE_KEY = 'sdental:chat:due'              # ZSET conversation id -> unix time its reply is due
+_BURST_KEY = 'sdental:chat:burst'          # HASH conversation id -> when its burst began
+_META_KEY = 'sdental:chat:meta'            # HASH conversation id -> {"clinic_id", "phone"}
+_WAKE_KEY = 'sdental:chat:wake'            # LIST the dispatcher blocks on
+_DISPATCHER_KEY = 'sdental:chat:dispatcher'
 _LOCK_KEY = 'sdental:chat:lock:{cid}'
-_DEADLINE_TTL = 300          # seconds a pending-reply signal survives without a worker
 _LOCK_TTL = 300              # worker lease; expires if the process dies mid-reply
 _MAX_WAIT_EXTENSION = 30.0   # cap on how long a burst can keep extending the window
+_DISPATCHER_TTL = 15         # dispatcher leadership lease
+_MAX_IDLE_WAIT = 5.0         # longest the dispatcher blocks before renewing its lease
+_STANDBY_INTERVAL = 2.0      # how often a non-leader checks whether the lease is free
+_BUSY_RETRY = 5.0            # fallback re-check for a due conversation whose reply is running
+_POP_BATCH = 50
+
+# KEYS: due, burst, meta, wake  ARGV: cid, now, window, cap, meta json
+# Returns 1 when this message starts a new burst.
+_SCHEDULE_SCRIPT = """
+local now = tonumber(ARGV[2])
+local first = tonumber(redis.call('HGET', KEYS[2], ARGV[1]))
+local new_burst = 0
+if not first then
+  first = now
+  new_burst = 1
+  redis.call('HSET', KEYS[2], ARGV[1], ARGV[2])
+end
+redis.call('HSET', KEYS[3], ARGV[1], ARGV[5])
+redis.call('ZADD', KEYS[1], math.min(now + tonumber(ARGV[3]), first + tonumber(ARGV[4])), ARGV[1])
+redis.call('LPUSH', KEYS[4], '1')
+redis.call('LTRIM', KEYS[4], 0, 0)
+return new_burst
+"""
 
-# Outbound send retry schedule (seconds between attempts)
-_SEND_BACKOFF = (2, 4)
+# KEYS: due  ARGV: now, limit. Atomically removes and returns due members.
+_POP_SCRIPT = """
+local ids = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+if #ids > 0 then
+  redis.call('ZREM', KEYS[1], unpack(ids))
+end
+return ids
+"""
 
 
 def _redis():
@@ -55,57 +108,250 @@ def _redis():
 
 
 # ---------------------------------------------------------------------------
-# Debounce bookkeeping (Redis-first, in-process fallback)
+# Reply timers (Redis sorted set, in-process heap fallback)
 # ---------------------------------------------------------------------------
 
-def _set_deadline(cid: str, deadline: float) -> None:
-    client = _redis()
-    if client is not None:
-        try:
-            client.set(_DEADLINE_KEY.format(cid=cid), repr(deadline), ex=_DEADLINE_TTL)
-            return
-        except Exception as e:
-            logger.warning('chat debounce: redis set failed, using local state (%s)', e)
-    with _local_lock:
-        _local_deadlines[cid] = deadline
+class _RedisTimers:
+    def __init__(self, client):
+        self.client = client
+        self.owner = f'{socket.gethostname()}:{os.getpid()}'
+        self._schedule = client.register_script(_SCHEDULE_SCRIPT)
+        self._pop = client.register_script(_POP_SCRIPT)
+
+    def schedule(self, cid: str, meta: dict, window: float) -> bool:
+        """Set (or push back) the conversation's reply deadline. True for a new burst."""
+        return bool(self._schedule(
+            keys=[_DUE_KEY, _BURST_KEY, _META_KEY, _WAKE_KEY],
+            args=[cid, repr(time.time()), window, _MAX_WAIT_EXTENSION, json.dumps(meta)],
+        ))
+
+    def pop_due(self) -> list:
+        ids = self._pop(keys=[_DUE_KEY], args=[repr(time.time()), _POP_BATCH])
+        return [i.decode() if isinstance(i, bytes) else i for i in ids]
+
+    def take_meta(self, cid: str) -> dict:
+        """Job details for a conversation being dispatched; also ends its burst."""
+        pipe = self.client.pipeline()
+        pipe.hget(_META_KEY, cid)
+        pipe.hdel(_META_KEY, cid)
+        pipe.hdel(_BURST_KEY, cid)
+        raw = pipe.execute()[0]
+        return json.loads(raw) if raw else {}
+
+    def defer(self, cid: str, delay: float) -> None:
+        self.client.zadd(_DUE_KEY, {cid: time.time() + delay})
+
+    def fire_now_if_pending(self, cid: str) -> None:
+        """After a reply: answer messages that arrived meanwhile without waiting for the busy retry."""
+        if self.client.zadd(_DUE_KEY, {cid: time.time()}, xx=True, lt=True, ch=True):
+            self.client.lpush(_WAKE_KEY, '1')
+            self.client.ltrim(_WAKE_KEY, 0, 0)
+
+    def wait(self) -> None:
+        """Block until the earliest deadline, a wake-up poke or _MAX_IDLE_WAIT."""
+        timeout = _MAX_IDLE_WAIT
+        earliest = self.client.zrange(_DUE_KEY, 0, 0, withscores=True)
+        if earliest:
+            timeout = min(max(earliest[0][1] - time.time(), 0.0), _MAX_IDLE_WAIT)
+        if timeout > 0.001:
+            # Sub-second BLPOP timeouts need Redis >= 6
+            self.client.blpop([_WAKE_KEY], timeout=timeout)
+
+    def hold_leadership(self) -> bool:
+        if self.client.set(_DISPATCHER_KEY, self.owner, nx=True, ex=_DISPATCHER_TTL):
+            return True
+        current = self.client.get(_DISPATCHER_KEY)
+        if isinstance(current, bytes):
+            current = current.decode()
+        if current == self.owner:
+            self.client.expire(_DISPATCHER_KEY, _DISPATCHER_TTL)
+            return True
+        return False
+
+
+class _LocalTimers:
+    """Same contract as _RedisTimers on a heap, for a single process."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._due: dict[str, float] = {}
+        self._burst: dict[str, float] = {}
+        self._meta: dict[str, dict] = {}
+        self._heap: list = []
+
+    def _set(self, cid: str, due: float) -> None:
+        self._due[cid] = due
+        heapq.heappush(self._heap, (due, cid))
+        self._cond.notify_all()
+
+    def _earliest(self):
+        # Heap entries are invalidated lazily when a deadline moves
+        while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    def schedule(self, cid: str, meta: dict, window: float) -> bool:
+        with self._cond:
+            now = time.time()
+            first = self._burst.get(cid)
+            new_burst = first is None
+            if new_burst:
+                first = self._burst[cid] = now
+            self._meta[cid] = meta
+            self._set(cid, min(now + window, first + _MAX_WAIT_EXTENSION))
+            return new_burst
+
+    def pop_due(self) -> list:
+        with self._cond:
+            now = time.time()
+            due = []
+            while (earliest := self._earliest()) is not None and earliest <= now:
+                _, cid = heapq.heappop(self._heap)
+                del self._due[cid]
+                due.append(cid)
+            return due
+
+    def take_meta(self, cid: str) -> dict:
+        with self._cond:
+            self._burst.pop(cid, None)
+            return self._meta.pop(cid, {})
+
+    def defer(self, cid: str, delay: float) -> None:
+        with self._cond:
+            self._set(cid, time.time() + delay)
+
+    def fire_now_if_pending(self, cid: str) -> None:
+        with self._cond:
+            now = time.time()
+            if self._due.get(cid, now) > now:
+                self._set(cid, now)
+
+    def wait(self) -> None:
+        with self._cond:
+            earliest = self._earliest()
+            timeout = _MAX_IDLE_WAIT if earliest is None else min(earliest - time.time(), _MAX_IDLE_WAIT)
+            if timeout > 0.001:
+                self._cond.wait(timeout)
+
+    def hold_leadership(self) -> bool:
+        return True
 
 
-def _get_deadline(cid: str):
-    client = _redis()
-    if client is not None:
-        try:
-            raw = client.get(_DEADLINE_KEY.format(cid=cid))
-            return float(raw) if raw else None
-        except Exception:
-            pass
-    with _local_lock:
-        return _local_deadlines.get(cid)
+_local_timers = _LocalTimers()
+_redis_timers = None
+_dispatchers: dict = {}
+_dispatchers_lock = threading.Lock()
 
 
-def _clear_deadline(cid: str) -> None:
+def _timers():
+    global _redis_timers
     client = _redis()
-    if client is not None:
-        try:
-            client.delete(_DEADLINE_KEY.format(cid=cid))
+    if client is None:
+        return _local_timers
+    if _redis_timers is None or _redis_timers.client is not client:
+        _redis_timers = _RedisTimers(client)
+    return _redis_timers
+
+
+def _ensure_dispatcher(app, timers) -> None:
+    """Start this process's dispatcher thread for `timers` (once)."""
+    key = (id(app), type(timers).__name__)
+    with _dispatchers_lock:
+        thread = _dispatchers.get(key)
+        if thread is not None and thread.is_alive():
             return
-        except Exception:
-            pass
-    with _local_lock:
-        _local_deadlines.pop(cid, None)
+        thread = threading.Thread(
+            target=_dispatch_loop, args=(app, timers), name='chat-dispatcher', daemon=True
+        )
+        _dispatchers[key] = thread
+        thread.start()
+
+
+def start_dispatcher(app) -> None:
+    """Run the reply dispatcher in this process (`flask chat-worker` calls this at startup)."""
+    with app.app_context():
+        _ensure_dispatcher(app, _timers())
+
 
+def _dispatch_loop(app, timers) -> None:
+    with app.app_context():
+        while True:
+            try:
+                if not timers.hold_leadership():
+                    time.sleep(_STANDBY_INTERVAL)
+                    continue
+                for cid in timers.pop_due():
+                    _fire(app, timers, cid)
+                timers.wait()
+            except Exception:
+                logger.exception('chat dispatcher failed, retrying')
+                time.sleep(1)
+
+
+def _fire(app, timers, cid: str) -> None:
+    """A conversation's quiet window is over: hand its reply to a worker."""
+    token = _try_acquire_worker(cid)
+    if not token:
+        # A reply for it is still running; it re-fires this when done
+        timers.defer(cid, _BUSY_RETRY)
+        return
+
+    meta = timers.take_meta(cid)
+    job = {
+        'conversation_id': cid,
+        'clinic_id': meta.get('clinic_id'),
+        'phone': meta.get('phone'),
+        'lease': token,
+    }
+    if app.config.get('CHAT_WORKER_QUEUE') and reply_queue.enqueue(job):
+        return
+    reply_queue.local_pool(app, run_reply_job).submit(job)
+
+
+# ---------------------------------------------------------------------------
+# Per-conversation worker lease (Redis-first, in-process fallback)
+# ---------------------------------------------------------------------------
 
-def _try_acquire_worker(cid: str) -> bool:
-    """Elect exactly one worker per conversation (NX lock with a lease)."""
+def _try_acquire_worker(cid: str):
+    """
+    Elect exactly one worker per conversation (NX lock with a lease).
+    Returns the lease token, or None when another worker already holds it.
+    """
+    token = uuid_lib.uuid4().hex
     client = _redis()
     if client is not None:
         try:
-            return bool(client.set(_LOCK_KEY.format(cid=cid), uuid_lib.uuid4().hex, nx=True, ex=_LOCK_TTL))
+            if client.set(_LOCK_KEY.format(cid=cid), token, nx=True, ex=_LOCK_TTL):
+                return token
+            return None
         except Exception as e:
             logger.warning('chat debounce: redis lock failed, using local state (%s)', e)
     with _local_lock:
         if cid in _local_running:
-            return False
+            return None
         _local_running.add(cid)
+        return token
+
+
+def _resume_worker_lease(cid: str, token: str) -> bool:
+    """
+    For a queued job: confirm the lease taken at dispatch time is still ours
+    (or re-take it if it expired meanwhile, e.g. the job was reclaimed from
+    a crashed chat-worker). False means another worker owns the conversation.
+    """
+    client = _redis()
+    if client is None:
+        return True
+    key = _LOCK_KEY.format(cid=cid)
+    try:
+        current = client.get(key)
+        if isinstance(current, bytes):
+            current = current.decode()
+        if current == token:
+            client.expire(key, _LOCK_TTL)
+            return True
+        return bool(current is None and client.set(key, token, nx=True, ex=_LOCK_TTL))
+    except Exception:
         return True
 
 
@@ -130,8 +376,9 @@ def enqueue_reply(clinic, conversation, phone: str) -> str:
     reply. The message itself must already be stored - the worker rebuilds
     context from the conversation history.
 
-    Returns 'inline' (processed synchronously), 'scheduled' (worker elected)
-    or 'debounced' (an existing worker will pick the new message up).
+    Returns 'inline' (processed synchronously), 'scheduled' (a new burst:
+    reply due after the quiet window) or 'debounced' (the pending reply's
+    window was extended to include this message).
     """
     window = float(current_app.config.get('MESSAGE_AGGREGATION_SECONDS', 8) or 0)
     cid = str(conversation.id)
@@ -140,21 +387,56 @@ def enqueue_reply(clinic, conversation, phone: str) -> str:
         _process_conversation_reply(current_app._get_current_object(), str(clinic.id), cid, phone)
         return 'inline'
 
-    _set_deadline(cid, time.time() + window)
-
-    if not _try_acquire_worker(cid):
-        return 'debounced'
-
     app = current_app._get_current_object()
     clinic_id = str(clinic.id)
+    meta = {'clinic_id': clinic_id, 'phone': phone}
+
+    timers = _timers()
+    try:
+        new_burst = timers.schedule(cid, meta, window)
+    except Exception as e:
+        logger.warning('chat debounce: redis schedule failed, using local state (%s)', e)
+        timers = _local_timers
+        new_burst = timers.schedule(cid, meta, window)
+    _ensure_dispatcher(app, timers)
+
+    if not new_burst:
+        return 'debounced'
 
     # Show "typing..." to the patient right away - the reply is `window`+LLM
     # seconds out, and silence is when patients start double-texting.
     _executor.submit(_send_presence_safe, app, clinic_id, phone, int((window + 15) * 1000))
-    _executor.submit(_worker_loop, app, clinic_id, cid, phone)
     return 'scheduled'
 
 
+def run_reply_job(job: dict) -> None:
+    """
+    Generate and send one dispatched reply (inside an app context) - in a
+    thread of this process or in `flask chat-worker`.
+    """
+    cid = job['conversation_id']
+    if not _resume_worker_lease(cid, job.get('lease')):
+        logger.info('Reply job for conversation %s superseded by another worker', cid)
+        return
+    try:
+        clinic_id, phone = job.get('clinic_id'), job.get('phone')
+        if not clinic_id or not phone:
+            conversation = db.session.get(Conversation, cid)
+            if conversation is None:
+                return
+            clinic_id = clinic_id or str(conversation.clinic_id)
+            phone = phone or conversation.phone_number
+        _process_conversation_reply(current_app._get_current_object(), clinic_id, cid, phone)
+    except Exception:
+        logger.exception('chat worker crashed for conversation %s', cid)
+    finally:
+        _release_worker(cid)
+        try:
+            _timers().fire_now_if_pending(cid)
+        except Exception:
+            pass
+
+
 def _send_presence_safe(app, clinic_id: str, phone: str, delay_ms: int) -> None:
     with app.app_context():
         try:
@@ -165,37 +447,6 @@ def _send_presence_safe(app, clinic_id: str, phone: str, delay_ms: int) -> None:
             logger.debug('presence task failed (non-fatal): %s', e)
 
 
-def _worker_loop(app, clinic_id: str, cid: str, phone: str) -> None:
-    """
-    Wait out the quiet window (which later messages may keep extending, up to
-    a cap), then generate and send one reply. Loops in case new messages
-    arrived while the LLM was already answering.
-    """
-    with app.app_context():
-        try:
-            started = time.time()
-            while True:
-                deadline = _get_deadline(cid)
-                if deadline is None:
-                    return
-                now = time.time()
-                effective = min(deadline, started + _MAX_WAIT_EXTENSION)
-                if now < effective:
-                    time.sleep(min(effective - now, 1.0))
-                    continue
-
-                _clear_deadline(cid)
-                _process_conversation_reply(app, clinic_id, cid, phone)
-                started = time.time()
-                # Re-check: a message that arrived mid-reply set a new deadline.
-                if _get_deadline(cid) is None:
-                    return
-        except Exception:
-            logger.exception('chat worker crashed for conversation %s', cid)
-        finally:
-            _release_worker(cid)
-
-
 def _process_conversation_reply(app, clinic_id: str, cid: str, phone: str) -> None:
     """Generate the AI reply for the conversation's current state and send it."""
     with app.app_context():
@@ -218,7 +469,7 @@ def _process_conversation_reply(app, clinic_id: str, cid: str, phone: str) -> No
             # commonly ClaudeService's constructor raising ValueError for a
             # missing/invalid OPENROUTER_API_KEY. Without this, the patient
             # gets silence: the exception would otherwise only surface as a
-            # log line in _worker_loop's catch-all, with no message sent and
+            # log line in run_reply_job's catch-all, with no message sent and
             # no visible failure anywhere in the dashboard.
             logger.exception(
                 'Failed to generate AI reply for conversation %s (clinic %s) - '
@@ -234,32 +485,17 @@ def _process_conversation_reply(app, clinic_id: str, cid: str, phone: str) -> No
 
         # On LLM API errors process_message returns an apology WITHOUT storing
         # it - store it here so the dashboard reflects what the patient gets.
-        messages = conversation.messages or []
-        if not messages or messages[-1].get('role') != 'assistant':
-            conversation_service.add_message(conversation, 'assistant', reply_text)
-            messages = conversation.messages or []
-        reply_msg = messages[-1]
-
-        result = _send_with_retry(EvolutionService(clinic), phone, reply_text)
-
-        if isinstance(result, dict) and not result.get('error'):
-            reply_evolution_id = (result.get('key') or {}).get('id')
-            if reply_evolution_id:
-                conversation_service.attach_evolution_id_to_last_reply(conversation, reply_evolution_id)
-        else:
-            error = (result or {}).get('error', 'unknown')
+        reply_msg = conversation.last_message()
+        if not reply_msg or reply_msg.get('role') != 'assistant':
+            reply_msg = conversation_service.add_message(conversation, 'assistant', reply_text)
+
+        # Paced and retried by the outbound queue, which also records the
+        # outcome (WhatsApp id / failed) on the stored reply
+        result = outbound_queue.send(
+            EvolutionService(clinic), phone, reply_text, lane=outbound_queue.Lane.REPLY,
+            conversation=conversation, message_id=reply_msg.get('id'),
+        )
+        if isinstance(result, dict) and result.get('error'):
             logger.error(
-                'Failed to deliver AI reply for conversation %s after retries: %s', cid, error
+                'Failed to deliver AI reply for conversation %s after retries: %s', cid, result['error']
             )
-            conversation_service.update_message_status(conversation, reply_msg.get('id'), 'failed')
-
-
-def _send_with_retry(evolution, phone: str, text: str) -> dict:
-    """Send a WhatsApp text with bounded retries; returns the last result."""
-    result = evolution.send_message(phone, text)
-    for backoff in _SEND_BACKOFF:
-        if isinstance(result, dict) and not result.get('error'):
-            return result
-        time.sleep(backoff)
-        result = evolution.send_message(phone, text)
-    return result
@@ -0,0 +1,299 @@
+"""
+Outbound WhatsApp send queue: per-instance pacing, priority lanes and
+jittered retries.
+
+AI replies, reminders, proactive outreach, tool-triggered sends and the
+opt-out confirmation all end up calling EvolutionService.send_message. Sent
+unpaced, a reminder run or an outreach campaign goes out as a burst from one
+WhatsApp number - the pattern that gets numbers banned - and trips
+Evolution's rate limits, which the callers then retried with blind sleeps.
+Every outbound text now goes through `send()`:
+
+- each Evolution instance has a token bucket (EVOLUTION_SEND_RATE messages
+  per second, bursts of up to EVOLUTION_SEND_BURST), shared by all
+  processes through Redis (in-process fallback);
+- lanes: interactive replies take any token, reminders leave one token in
+  the bucket and outreach two, so a campaign draining the bucket can never
+  delay a patient's reply by more than a token;
+- a 429/5xx or transport failure is retried with full-jitter exponential
+  backoff (honouring Retry-After), up to EVOLUTION_SEND_MAX_ATTEMPTS; a 429
+  also drains the instance's bucket so every sender backs off together;
+- when the send belongs to a stored message, the outcome is written back
+  to it (WhatsApp id on success, 'failed' status otherwise).
+
+Batches (reminder runs, recall/recovery outreach) use `send_bulk()`, which
+fans out on an asyncio HTTP client with bounded concurrency per instance
+instead of waiting out one send's round-trip after another.
+"""
+import asyncio
+import logging
+import random
+import threading
+import time
+
+import httpx
+from flask import current_app
+
+from app import db
+from app.models import Clinic
+from app.services.conversation_service import ConversationService
+from app.services.realtime_service import _get_redis_client
+
+logger = logging.getLogger(__name__)
+
+
+class Lane:
+    REPLY = 'reply'
+    REMINDER = 'reminder'
+    OUTREACH = 'outreach'
+
+    # Tokens a lane must leave in the bucket for the lanes above it
+    RESERVE = {REPLY: 0, REMINDER: 1, OUTREACH: 2}
+
+
+_BUCKET_KEY = 'sdental:send:bucket:{instance}'
+_MAX_QUEUE_WAIT = 120.0      # longest a send waits for a token before giving up
+_BACKOFF_BASE = 1.0
+_BACKOFF_CAP = 20.0
+
+# KEYS: bucket  ARGV: now, rate, burst, reserve
+# Takes a token if at least 1 + reserve are available; returns the seconds to
+# wait before trying again ('0' when the token was taken).
+_TAKE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local burst = tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local need = 1 + tonumber(ARGV[4])
+local wait = 0
+if tokens >= need then
+  tokens = tokens - 1
+else
+  wait = (need - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], 3600)
+return tostring(wait)
+"""
+
+_local_lock = threading.Lock()
+_local_buckets: dict = {}     # instance -> (tokens, ts)
+_scripts = {}
+
+
+def _settings() -> tuple:
+    config = current_app.config
+    rate = max(float(config.get('EVOLUTION_SEND_RATE', 1.0)), 0.01)
+    burst = max(float(config.get('EVOLUTION_SEND_BURST', 5)), 1 + max(Lane.RESERVE.values()))
+    return rate, burst
+
+
+def _try_take(instance: str, lane: str) -> float:
+    """Take a token for `instance`; returns 0, or how long to wait before retrying."""
+    rate, burst = _settings()
+    reserve = Lane.RESERVE.get(lane, 0)
+    now = time.time()
+
+    client = _get_redis_client()
+    if client is not None:
+        try:
+            script = _scripts.get(id(client))
+            if script is None:
+                script = _scripts[id(client)] = client.register_script(_TAKE_SCRIPT)
+            return float(script(
+                keys=[_BUCKET_KEY.format(instance=instance)],
+                args=[now, rate, burst, reserve],
+            ))
+        except Exception as e:
+            logger.debug('send bucket unavailable in Redis, pacing in-process: %s', e)
+
+    with _local_lock:
+        tokens, ts = _local_buckets.get(instance, (burst, now))
+        tokens = min(burst, tokens + max(0.0, now - ts) * rate)
+        wait = 0.0
+        if tokens >= 1 + reserve:
+            tokens -= 1
+        else:
+            wait = (1 + reserve - tokens) / rate
+        _local_buckets[instance] = (tokens, now)
+        return wait
+
+
+def _drain(instance: str, seconds: float) -> None:
+    """Empty the instance's bucket for `seconds` (after a 429)."""
+    rate, _ = _settings()
+    state = {'tokens': -rate * seconds, 'ts': time.time()}
+    client = _get_redis_client()
+    if client is not None:
+        try:
+            key = _BUCKET_KEY.format(instance=instance)
+            client.hset(key, mapping=state)
+            client.expire(key, 3600)
+            return
+        except Exception:
+            pass
+    with _local_lock:
+        _local_buckets[instance] = (state['tokens'], state['ts'])
+
+
+def _acquire(instance: str, lane: str) -> bool:
+    deadline = time.monotonic() + _MAX_QUEUE_WAIT
+    while True:
+        wait = _try_take(instance, lane)
+        if wait <= 0:
+            return True
+        if time.monotonic() + wait > deadline:
+            return False
+        # Jitter so waiters don't all retry on the same refill
+        time.sleep(wait + random.uniform(0, 0.1))
+
+
+def _retryable(result: dict) -> bool:
+    """
+    429/5xx answers and transport failures (status_code None) are worth
+    another try; other errors (4xx, Evolution not configured) are not.
+    """
+    if 'status_code' not in result:
+        return False
+    code = result['status_code']
+    return code is None or code == 429 or code >= 500
+
+
+def _failed(result) -> bool:
+    return not isinstance(result, dict) or bool(result.get('error'))
+
+
+def _before_retry(instance: str, phone: str, result: dict, attempt: int) -> float:
+    """Seconds to wait before retrying a failed send (draining the bucket on 429)."""
+    retry_after = result.get('retry_after')
+    if result.get('status_code') == 429:
+        _drain(instance, retry_after or _BACKOFF_BASE * 2 ** attempt)
+    delay = retry_after or random.uniform(0, min(_BACKOFF_CAP, _BACKOFF_BASE * 2 ** (attempt + 1)))
+    logger.info(
+        'Send to %s via %s failed (%s), retry %s in %.1fs',
+        phone, instance, result.get('status_code') or result.get('error'), attempt + 1, delay,
+    )
+    return delay
+
+
+def _max_attempts() -> int:
+    return max(1, int(current_app.config.get('EVOLUTION_SEND_MAX_ATTEMPTS', 3)))
+
+
+def send(evolution, phone: str, text: str, lane: str = Lane.REPLY,
+         conversation=None, message_id: str = None) -> dict:
+    """
+    Send a WhatsApp text through the instance's queue. Blocks until a token
+    is available and the send succeeded or ran out of attempts; returns the
+    last send_message() result.
+
+    With `conversation` and `message_id`, the outcome is recorded on that
+    stored message.
+    """
+    instance = str(evolution.instance_name)
+    max_attempts = _max_attempts()
+
+    result = None
+    for attempt in range(max_attempts):
+        if not _acquire(instance, lane):
+            logger.warning('Send queue for %s full (%s lane), giving up on %s', instance, lane, phone)
+            result = {'error': 'send queue timeout'}
+            break
+        result = evolution.send_message(phone, text)
+        if not _failed(result) or not _retryable(result) or attempt == max_attempts - 1:
+            break
+        time.sleep(_before_retry(instance, phone, result, attempt))
+
+    if conversation is not None and message_id:
+        record_result(conversation, message_id, result)
+    return result
+
+
+def send_bulk(items: list, lane: str = Lane.REMINDER, concurrency: int = None,
+              time_budget: float = None) -> list:
+    """
+    Send a batch of texts ([(evolution, phone, text), ...], any mix of
+    instances) concurrently on one asyncio HTTP client: up to `concurrency`
+    (EVOLUTION_BULK_CONCURRENCY) sends in flight per instance, each paced by
+    its instance's bucket and retried like send(). Returns one result per
+    item, in order.
+
+    With `time_budget` (seconds), items that haven't been sent by then -
+    not started, or waiting on a retry - are given up; their result is
+    {'error': ..., 'deferred': True} so the caller can leave them for its
+    next run.
+    """
+    if not items:
+        return []
+    concurrency = max(1, concurrency or int(current_app.config.get('EVOLUTION_BULK_CONCURRENCY', 4)))
+    deadline = time.monotonic() + time_budget if time_budget else None
+    app = current_app._get_current_object()
+    return asyncio.run(_send_bulk(app, items, lane, concurrency, deadline))
+
+
+async def _send_bulk(app, items: list, lane: str, concurrency: int, deadline) -> list:
+    results = [None] * len(items)
+    semaphores = {}
+    limits = httpx.Limits(max_connections=concurrency * 4, max_keepalive_connections=concurrency * 4)
+
+    async with httpx.AsyncClient(limits=limits) as client:
+        async def run(index, evolution, phone, text):
+            instance = str(evolution.instance_name)
+            semaphore = semaphores.setdefault(instance, asyncio.Semaphore(concurrency))
+            async with semaphore:
+                with app.app_context():
+                    try:
+                        results[index] = await _send_async(client, evolution, instance, phone, text, lane, deadline)
+                    except Exception as e:
+                        logger.exception('Bulk send to %s via %s failed', phone, instance)
+                        results[index] = {'error': str(e)}
+
+        await asyncio.gather(*(run(i, *item) for i, item in enumerate(items)))
+    return results
+
+
+async def _send_async(client, evolution, instance: str, phone: str, text: str, lane: str, deadline) -> dict:
+    max_attempts = _max_attempts()
+    result = None
+    for attempt in range(max_attempts):
+        # The budget covers retries too: a send that can't finish in time
+        # is deferred (after a failed attempt, still unsent) rather than
+        # keeping the batch - and its job lock - past the deadline.
+        while True:
+            if _past(deadline):
+                return _deferred(result)
+            wait = _try_take(instance, lane)
+            if wait <= 0:
+                break
+            await asyncio.sleep(wait + random.uniform(0, 0.1))
+        result = await evolution.send_message_async(client, phone, text)
+        if not _failed(result) or not _retryable(result) or attempt == max_attempts - 1:
+            break
+        delay = _before_retry(instance, phone, result, attempt)
+        if _past(deadline, delay):
+            return _deferred(result)
+        await asyncio.sleep(delay)
+    return result
+
+
+def _past(deadline, delay: float = 0.0) -> bool:
+    return deadline is not None and time.monotonic() + delay >= deadline
+
+
+def _deferred(result) -> dict:
+    """Result of a bulk send left for the caller's next run (not sent)."""
+    return {**(result or {}), 'error': 'batch time budget exhausted', 'deferred': True}
+
+
+def record_result(conversation, message_id: str, result) -> None:
+    """Write a send's outcome (WhatsApp id, or 'failed') to the stored message it delivered."""
+    service = ConversationService(db.session.get(Clinic, conversation.clinic_id))
+    if _failed(result):
+        service.update_message_status(conversation, message_id, 'failed')
+        return
+    evolution_id = (result.get('key') or {}).get('id')
+    if evolution_id:
+        service.attach_evolution_id(conversation, message_id, evolution_id)
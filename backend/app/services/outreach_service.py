@@ -19,6 +19,7 @@ so the AI never takes an irreversible action without a human (the patient)
 in the loop.
 """
 import logging
+import time
 from datetime import timedelta
 from typing import Optional
 
@@ -35,6 +36,7 @@ from app.models import (
 from app.services.claude_service import ClaudeService
 from app.services.conversation_service import ConversationService
 from app.services.evolution_service import EvolutionService
+from app.services import outbound_queue
 
 logger = logging.getLogger(__name__)
 
@@ -120,16 +122,90 @@ class OutreachService:
         Returns the AgentAction record (status sent/skipped/failed), or None if
         the whole feature is disabled for the clinic.
         """
+        draft, outcome = self._compose(
+            patient, objective, action_type, extra_context=extra_context,
+            appointment_id=appointment_id, add_opt_out_footer=add_opt_out_footer,
+            ignore_quiet_hours=ignore_quiet_hours,
+        )
+        if draft is None:
+            return outcome
+
+        # Send via WhatsApp (lowest-priority lane: never delays a patient reply)
+        result = outbound_queue.send(
+            EvolutionService(self.clinic), patient.phone, draft['message'], lane=outbound_queue.Lane.OUTREACH,
+            conversation=draft['conversation'], message_id=draft['message_id'],
+        )
+        return self._record_delivery(draft, result)
+
+    def send_proactive_batch(self, requests: list, deadline: Optional[float] = None) -> list:
+        """
+        send_proactive() for many patients at once: each request is a dict of
+        send_proactive's keyword arguments. Messages are composed one by one,
+        then sent as one concurrent, paced batch. Returns one
+        Optional[AgentAction] per request, in order.
+
+        With `deadline` (a time.monotonic() value), requests not composed or
+        sent by then get no AgentAction (None), so the dedupe checks let the
+        next run pick those patients up again.
+        """
+        outcomes = [None] * len(requests)
+        drafts = []
+        for index, request in enumerate(requests):
+            if deadline is not None and time.monotonic() >= deadline:
+                logger.info('Proactive batch out of time, %d request(s) left for the next run',
+                            len(requests) - index)
+                break
+            try:
+                draft, outcome = self._compose(**request)
+            except Exception:
+                logger.exception('Failed to compose proactive message for patient %s',
+                                 getattr(request.get('patient'), 'id', None))
+                continue
+            if draft is None:
+                outcomes[index] = outcome
+            else:
+                drafts.append((index, draft))
+
+        evolution = EvolutionService(self.clinic)
+        results = outbound_queue.send_bulk(
+            [(evolution, draft['patient'].phone, draft['message']) for _, draft in drafts],
+            lane=outbound_queue.Lane.OUTREACH,
+            time_budget=max(deadline - time.monotonic(), 1.0) if deadline is not None else None,
+        )
+        for (index, draft), result in zip(drafts, results):
+            outbound_queue.record_result(draft['conversation'], draft['message_id'], result)
+            if isinstance(result, dict) and result.get('deferred'):
+                # The stored draft is marked failed; no audit row, so it's retried
+                continue
+            outcomes[index] = self._record_delivery(draft, result)
+        return outcomes
+
+    def _compose(
+        self,
+        patient: Patient,
+        objective: str,
+        action_type: str,
+        extra_context: Optional[str] = None,
+        appointment_id=None,
+        add_opt_out_footer: bool = False,
+        ignore_quiet_hours: bool = False,
+    ) -> tuple:
+        """
+        Guardrails + message generation. Returns (draft, None) with the
+        message stored on the patient's conversation and ready to send, or
+        (None, outcome) when nothing should be sent - outcome being the
+        skipped/failed AgentAction, or None.
+        """
         allowed, reason = self.can_contact(patient, ignore_quiet_hours=ignore_quiet_hours)
         if not allowed:
             # Feature-off and transient blocks (quiet hours / rate limit) are not
             # worth an audit row; opt-out and human-handling are meaningful skips.
             if reason in ('opted_out', 'human_handling'):
-                return self._log(patient, action_type, AgentActionStatus.SKIPPED,
-                                 detail=f'Não enviado: {reason}', meta={'reason': reason},
-                                 appointment_id=appointment_id)
+                return None, self._log(patient, action_type, AgentActionStatus.SKIPPED,
+                                       detail=f'Não enviado: {reason}', meta={'reason': reason},
+                                       appointment_id=appointment_id)
             logger.info('Proactive %s skipped for patient %s: %s', action_type, patient.id, reason)
-            return None
+            return None, None
 
         first_name = patient.name.split()[0] if patient.name else None
         try:
@@ -140,12 +216,12 @@ class OutreachService:
             )
         except Exception as e:
             logger.exception('Failed to generate proactive message: %s', e)
-            return self._log(patient, action_type, AgentActionStatus.FAILED,
-                             detail=f'Falha ao gerar mensagem: {e}', appointment_id=appointment_id)
+            return None, self._log(patient, action_type, AgentActionStatus.FAILED,
+                                   detail=f'Falha ao gerar mensagem: {e}', appointment_id=appointment_id)
 
         if not message:
-            return self._log(patient, action_type, AgentActionStatus.FAILED,
-                             detail='Mensagem gerada vazia', appointment_id=appointment_id)
+            return None, self._log(patient, action_type, AgentActionStatus.FAILED,
+                                   detail='Mensagem gerada vazia', appointment_id=appointment_id)
 
         if add_opt_out_footer:
             message = message + OPT_OUT_FOOTER
@@ -154,21 +230,33 @@ class OutreachService:
         # clinic's live inbox so staff see the AI reaching out).
         conv_service = ConversationService(self.clinic)
         conversation = conv_service.get_or_create_conversation(patient.phone)
-        conv_service.add_message(conversation, 'assistant', message)
+        stored = conv_service.add_message(conversation, 'assistant', message)
+
+        return {
+            'patient': patient,
+            'message': message,
+            'objective': objective,
+            'action_type': action_type,
+            'appointment_id': appointment_id,
+            'conversation': conversation,
+            'message_id': stored.get('id'),
+        }, None
 
-        # Send via WhatsApp
-        result = EvolutionService(self.clinic).send_message(patient.phone, message)
-        if isinstance(result, dict) and 'error' in result:
+    def _record_delivery(self, draft: dict, result) -> AgentAction:
+        patient, action_type = draft['patient'], draft['action_type']
+        conversation_id = draft['conversation'].id
+        if not isinstance(result, dict) or 'error' in result:
+            error = result.get('error') if isinstance(result, dict) else 'unknown'
             return self._log(patient, action_type, AgentActionStatus.FAILED,
-                             detail=f"Falha no envio: {result['error']}",
-                             conversation_id=conversation.id, appointment_id=appointment_id)
+                             detail=f"Falha no envio: {error}",
+                             conversation_id=conversation_id, appointment_id=draft['appointment_id'])
 
         logger.info('Proactive %s sent to patient %s', action_type, patient.id)
         return self._log(
             patient, action_type, AgentActionStatus.SENT,
-            detail=message[:280], channel='whatsapp',
-            conversation_id=conversation.id, appointment_id=appointment_id,
-            meta={'objective': objective},
+            detail=draft['message'][:280], channel='whatsapp',
+            conversation_id=conversation_id, appointment_id=draft['appointment_id'],
+            meta={'objective': draft['objective']},
         )
 
     def clinic_agent(self) -> ClaudeService:
@@ -0,0 +1,83 @@
+"""
+Compiled per-clinic prompt bundle for the WhatsApp agent.
+
+Everything in the agent's request that only depends on the clinic's
+configuration - the static system-prompt block, the service scope
+guardrail, the formatted services/hours/professionals/stages and the
+OpenAI-shaped tool schemas - is compiled once per clinic config version
+instead of on every turn. Besides saving the formatting work and the
+professionals/pipeline queries, this keeps the cached prompt prefix
+byte-identical between turns, which is what provider-side prompt caching
+keys on.
+
+Bundles are keyed by (clinic id, Clinic.config_version). The version is
+bumped by model listeners whenever a prompt input changes, so a stale
+bundle is never served - it just stops being looked up. They are held in
+an in-process LRU and, when REDIS_URL is configured, in Redis so other
+workers reuse the compiled bundle.
+"""
+import copy
+import json
+import logging
+import threading
+from collections import OrderedDict
+from typing import Callable
+
+from app.services.realtime_service import _get_redis_client
+
+logger = logging.getLogger(__name__)
+
+_KEY = 'sdental:prompt:{clinic}:{version}'
+_TTL = 24 * 3600             # seconds a bundle is kept in Redis
+MAX_LOCAL_BUNDLES = 256      # clinics kept in the in-process LRU
+
+_lock = threading.Lock()
+_local: OrderedDict = OrderedDict()     # (clinic id, version) -> bundle
+
+
+def get_bundle(clinic, build: Callable[[], dict]) -> dict:
+    """
+    The compiled bundle for `clinic` at its current config version, built
+    with `build()` on a miss. Returns a deep copy: the cached bundle is
+    shared across threads and requests, and callers do adjust e.g. `tools`.
+    """
+    key = (str(clinic.id), clinic.config_version or 0)
+    with _lock:
+        bundle = _local.get(key)
+        if bundle is not None:
+            _local.move_to_end(key)
+            return copy.deepcopy(bundle)
+
+    redis_key = _KEY.format(clinic=key[0], version=key[1])
+    client = _get_redis_client()
+    bundle = None
+    if client is not None:
+        try:
+            raw = client.get(redis_key)
+            if raw:
+                bundle = json.loads(raw)
+        except Exception as e:
+            logger.warning('Prompt bundle lookup failed for clinic %s: %s', key[0], e)
+
+    if bundle is None:
+        bundle = build()
+        if client is not None:
+            try:
+                client.set(redis_key, json.dumps(bundle), ex=_TTL)
+            except Exception as e:
+                logger.warning('Prompt bundle store failed for clinic %s: %s', key[0], e)
+
+    with _lock:
+        # Older versions of this clinic's bundle can't be hit again
+        for stale in [k for k in _local if k[0] == key[0] and k != key]:
+            del _local[stale]
+        _local[key] = bundle
+        while len(_local) > MAX_LOCAL_BUNDLES:
+            _local.popitem(last=False)
+    return copy.deepcopy(bundle)
+
+
+def clear() -> None:
+    """Drop the in-process bundles (Redis entries expire on their own)."""
+    with _lock:
+        _local.clear()
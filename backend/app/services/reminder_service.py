@@ -2,6 +2,7 @@
 Service for managing appointment reminders.
 """
 import logging
+import time
 from datetime import timedelta
 from typing import List, Optional
 
@@ -16,6 +17,7 @@ from app.models import (
     Clinic
 )
 from app.services.evolution_service import EvolutionService
+from app.services import outbound_queue
 from app.services.email_service import EmailService
 
 logger = logging.getLogger(__name__)
@@ -51,6 +53,10 @@ Ficou com alguma dúvida ou precisa de algo? É só responder por aqui. 😊"""
 # How long after an appointment's scheduled end time to send the follow-up
 FOLLOW_UP_DELAY_AFTER_APPOINTMENT = timedelta(hours=2)
 
+# Wall-clock budget of one send_pending_reminders run; must stay below the
+# scheduler's lock TTL for the job (240s) so runs never overlap.
+REMINDER_BATCH_SECONDS = 180
+
 
 class ReminderService:
     """Service for scheduling and sending appointment reminders."""
@@ -181,6 +187,23 @@ class ReminderService:
         Returns:
             True if sent successfully, False otherwise
         """
+        prepared = self._prepare_reminder(reminder)
+        if prepared is None:
+            return False
+        evolution, phone, message = prepared
+        try:
+            result = outbound_queue.send(evolution, phone, message, lane=outbound_queue.Lane.REMINDER)
+        except Exception as e:
+            logger.exception('Error sending reminder %s: %s', reminder.id, str(e))
+            result = {'error': str(e)}
+        return self._record_reminder_result(reminder, result)
+
+    def _prepare_reminder(self, reminder: AppointmentReminder) -> Optional[tuple]:
+        """
+        Check a reminder is still due and build its message. Returns
+        (evolution, phone, message), or None when it was cancelled/failed
+        here instead.
+        """
         appointment = reminder.appointment
         patient = appointment.patient
         clinic = appointment.clinic
@@ -189,7 +212,7 @@ class ReminderService:
             logger.warning('No phone number for patient, skipping reminder %s', reminder.id)
             reminder.mark_failed('Patient has no phone number')
             db.session.commit()
-            return False
+            return None
 
         # Check if appointment is still valid for this reminder type
         if reminder.reminder_type == ReminderType.FOLLOW_UP:
@@ -201,63 +224,86 @@ class ReminderService:
             logger.info('Appointment %s is no longer active, cancelling reminder', appointment.id)
             reminder.cancel()
             db.session.commit()
-            return False
-
-        # Format message
-        message = self._format_reminder_message(reminder, appointment, patient, clinic)
+            return None
 
-        # Send via WhatsApp
         try:
-            evolution = EvolutionService(clinic)
-            result = evolution.send_message(patient.phone, message)
-
-            if 'error' in result:
-                logger.error('Failed to send reminder %s: %s', reminder.id, result['error'])
-                reminder.mark_failed(result['error'])
-                db.session.commit()
-                return False
+            message = self._format_reminder_message(reminder, appointment, patient, clinic)
+            return EvolutionService(clinic), patient.phone, message
+        except Exception as e:
+            logger.exception('Error preparing reminder %s: %s', reminder.id, str(e))
+            reminder.mark_failed(str(e))
+            db.session.commit()
+            return None
 
-            reminder.mark_sent()
+    def _record_reminder_result(self, reminder: AppointmentReminder, result: dict) -> bool:
+        """Mark the reminder sent/failed from its send result (plus the e-mail copy)."""
+        if not isinstance(result, dict) or 'error' in result:
+            error = result.get('error') if isinstance(result, dict) else 'unknown'
+            logger.error('Failed to send reminder %s: %s', reminder.id, error)
+            reminder.mark_failed(error)
             db.session.commit()
-            logger.info('Successfully sent reminder %s to %s', reminder.id, patient.phone)
+            return False
 
-            # Best-effort e-mail reminder alongside WhatsApp - doesn't affect reminder status.
-            # Follow-ups are WhatsApp-only (no e-mail template for those).
-            if reminder.reminder_type != ReminderType.FOLLOW_UP:
-                try:
-                    hours_before = 24 if reminder.reminder_type == ReminderType.REMINDER_24H else 1
-                    EmailService().send_appointment_reminder_email(patient, appointment, hours_before)
-                except Exception:
-                    logger.exception('Failed to send reminder e-mail for reminder %s', reminder.id)
+        reminder.mark_sent()
+        db.session.commit()
+        appointment = reminder.appointment
+        patient = appointment.patient
+        logger.info('Successfully sent reminder %s to %s', reminder.id, patient.phone)
 
-            return True
+        # Best-effort e-mail reminder alongside WhatsApp - doesn't affect reminder status.
+        # Follow-ups are WhatsApp-only (no e-mail template for those).
+        if reminder.reminder_type != ReminderType.FOLLOW_UP:
+            try:
+                hours_before = 24 if reminder.reminder_type == ReminderType.REMINDER_24H else 1
+                EmailService().send_appointment_reminder_email(patient, appointment, hours_before)
+            except Exception:
+                logger.exception('Failed to send reminder e-mail for reminder %s', reminder.id)
 
-        except Exception as e:
-            logger.exception('Error sending reminder %s: %s', reminder.id, str(e))
-            reminder.mark_failed(str(e))
-            db.session.commit()
-            return False
+        return True
 
     def send_pending_reminders(self) -> dict:
         """
         Send all pending reminders that are due.
 
+        Messages are built first, then sent as one concurrent batch (paced
+        per WhatsApp instance). The run stops after REMINDER_BATCH_SECONDS -
+        inside the scheduler's job lock - and anything not sent by then stays
+        pending for the next run.
+
         Returns:
-            Dict with counts of sent, failed, and skipped reminders
+            Dict with counts of sent, failed, skipped and deferred reminders
         """
         pending = self.get_pending_reminders()
-        results = {'sent': 0, 'failed': 0, 'skipped': 0}
+        results = {'sent': 0, 'failed': 0, 'skipped': 0, 'deferred': 0}
+        deadline = time.monotonic() + REMINDER_BATCH_SECONDS
 
         logger.info('Found %d pending reminders to send', len(pending))
 
+        batch = []
         for reminder in pending:
-            if self.send_reminder(reminder):
+            if time.monotonic() >= deadline:
+                results['deferred'] += 1
+                continue
+            prepared = self._prepare_reminder(reminder)
+            if prepared is not None:
+                batch.append((reminder, prepared))
+            elif reminder.status == ReminderStatus.CANCELLED:
+                results['skipped'] += 1
+            else:
+                results['failed'] += 1
+
+        sends = outbound_queue.send_bulk(
+            [prepared for _, prepared in batch],
+            lane=outbound_queue.Lane.REMINDER,
+            time_budget=max(deadline - time.monotonic(), 1.0),
+        )
+        for (reminder, _), result in zip(batch, sends):
+            if isinstance(result, dict) and result.get('deferred'):
+                results['deferred'] += 1
+            elif self._record_reminder_result(reminder, result):
                 results['sent'] += 1
             else:
-                if reminder.status == ReminderStatus.CANCELLED:
-                    results['skipped'] += 1
-                else:
-                    results['failed'] += 1
+                results['failed'] += 1
 
         logger.info('Reminder batch complete: %s', results)
         return results
@@ -0,0 +1,497 @@
+"""
+Fair-share job queue for AI reply generation.
+
+The dispatcher (services/message_processor.py) turns every conversation
+whose quiet window ended into a reply job. Jobs are queued per clinic and
+handed to reply workers by weighted fair queuing, so one clinic running a
+broadcast that triggers hundreds of replies can't starve everyone else's
+patients:
+
+- each clinic with queued jobs has a virtual time; a worker always takes
+  the next job of the eligible clinic with the lowest one, and taking a job
+  advances that clinic's virtual time by 1/weight (CHAT_CLINIC_WEIGHTS,
+  default 1). A clinic that goes idle re-enters at the current virtual
+  clock, so it can't bank credit while quiet;
+- a clinic is only eligible while it has fewer than
+  CHAT_MAX_CONCURRENT_PER_CLINIC replies in flight, and no job starts while
+  CHAT_MAX_CONCURRENT_TOTAL are running overall.
+
+With CHAT_WORKER_QUEUE on, the queue lives in Redis and is consumed by
+`flask chat-worker` processes (fleet-wide caps). Taking a job records it
+under a lease; jobs whose worker died are put back at the head of their
+clinic's queue once the lease expires (at-least-once - the per-conversation
+worker lease in message_processor prevents double replies). Otherwise
+`LocalReplyPool` applies the same policy to threads of the current process.
+
+Per-clinic queue time (enqueue -> start) is recorded for every job and
+reported by `clinic_queue_stats()`; `queue_stats()` summarizes the backlog.
+"""
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+
+from flask import current_app
+
+from app.services.realtime_service import _get_redis_client
+
+logger = logging.getLogger(__name__)
+
+_QUEUE_KEY = 'sdental:chat:q:'             # + clinic id: LIST of job json
+_FAIR_KEY = 'sdental:chat:fair'            # ZSET clinic id -> virtual time (clinics with queued jobs)
+_VCLOCK_KEY = 'sdental:chat:vclock'        # virtual time of the last job taken
+_WEIGHTS_KEY = 'sdental:chat:weights'      # HASH clinic id -> weight
+_RUNNING_KEY = 'sdental:chat:running'      # HASH clinic id -> in-flight jobs ('*' = total)
+_JOBS_KEY = 'sdental:chat:taken'           # HASH job id -> job json, while in flight
+_LEASES_KEY = 'sdental:chat:leases'        # ZSET job id -> lease expiry
+_READY_KEY = 'sdental:chat:ready'          # LIST idle workers block on
+_QTIME_KEY = 'sdental:chat:qtime:{clinic}:{hour}'
+
+_JOB_LEASE = 300             # seconds a taken job may run before it's requeued
+_READY_BLOCK = 1.0           # longest an idle worker blocks before re-checking
+_STATS_INTERVAL = 60         # seconds between queue stats log lines
+
+# KEYS: fair, vclock, weights, ready  ARGV: queue key, clinic, job json, weight
+_ENQUEUE_SCRIPT = """
+redis.call('RPUSH', ARGV[1], ARGV[3])
+redis.call('HSET', KEYS[3], ARGV[2], ARGV[4])
+if not redis.call('ZSCORE', KEYS[1], ARGV[2]) then
+  redis.call('ZADD', KEYS[1], tonumber(redis.call('GET', KEYS[2]) or '0'), ARGV[2])
+end
+redis.call('LPUSH', KEYS[4], '1')
+redis.call('LTRIM', KEYS[4], 0, 99)
+return 1
+"""
+
+# KEYS: fair, vclock, weights, running, taken, leases
+# ARGV: queue key prefix, per-clinic cap, global cap, lease expiry
+_TAKE_SCRIPT = """
+if tonumber(redis.call('HGET', KEYS[4], '*') or '0') >= tonumber(ARGV[3]) then
+  return false
+end
+local clinics = redis.call('ZRANGE', KEYS[1], 0, -1, 'WITHSCORES')
+for i = 1, #clinics, 2 do
+  local clinic = clinics[i]
+  local vt = tonumber(clinics[i + 1])
+  if tonumber(redis.call('HGET', KEYS[4], clinic) or '0') < tonumber(ARGV[2]) then
+    local qkey = ARGV[1] .. clinic
+    local raw = redis.call('LPOP', qkey)
+    if raw then
+      local weight = tonumber(redis.call('HGET', KEYS[3], clinic) or '1')
+      redis.call('SET', KEYS[2], vt)
+      if redis.call('LLEN', qkey) > 0 then
+        redis.call('ZADD', KEYS[1], vt + 1 / weight, clinic)
+      else
+        redis.call('ZREM', KEYS[1], clinic)
+      end
+      redis.call('HINCRBY', KEYS[4], clinic, 1)
+      redis.call('HINCRBY', KEYS[4], '*', 1)
+      local id = cjson.decode(raw)['id']
+      redis.call('HSET', KEYS[5], id, raw)
+      redis.call('ZADD', KEYS[6], ARGV[4], id)
+      return raw
+    end
+    redis.call('ZREM', KEYS[1], clinic)
+  end
+end
+return false
+"""
+
+# KEYS: running, taken, leases, ready  ARGV: job id, clinic
+_RELEASE_SCRIPT = """
+if redis.call('ZREM', KEYS[3], ARGV[1]) == 1 then
+  redis.call('HDEL', KEYS[2], ARGV[1])
+  if redis.call('HINCRBY', KEYS[1], ARGV[2], -1) <= 0 then
+    redis.call('HDEL', KEYS[1], ARGV[2])
+  end
+  redis.call('HINCRBY', KEYS[1], '*', -1)
+  redis.call('LPUSH', KEYS[4], '1')
+  redis.call('LTRIM', KEYS[4], 0, 99)
+end
+return 1
+"""
+
+# KEYS: running, taken, leases, fair, vclock, ready  ARGV: now, queue key prefix
+_RECLAIM_SCRIPT = """
+local ids = redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', ARGV[1], 'LIMIT', 0, 20)
+for _, id in ipairs(ids) do
+  local raw = redis.call('HGET', KEYS[2], id)
+  redis.call('ZREM', KEYS[3], id)
+  redis.call('HDEL', KEYS[2], id)
+  if raw then
+    local clinic = cjson.decode(raw)['clinic_id']
+    if redis.call('HINCRBY', KEYS[1], clinic, -1) <= 0 then
+      redis.call('HDEL', KEYS[1], clinic)
+    end
+    redis.call('HINCRBY', KEYS[1], '*', -1)
+    redis.call('LPUSH', ARGV[2] .. clinic, raw)
+    if not redis.call('ZSCORE', KEYS[4], clinic) then
+      redis.call('ZADD', KEYS[4], tonumber(redis.call('GET', KEYS[5]) or '0'), clinic)
+    end
+    redis.call('LPUSH', KEYS[6], '1')
+  end
+end
+return #ids
+"""
+
+
+def _limits(config) -> tuple:
+    """(per-clinic cap, global cap) from the app config."""
+    return (
+        max(1, int(config.get('CHAT_MAX_CONCURRENT_PER_CLINIC', 2))),
+        max(1, int(config.get('CHAT_MAX_CONCURRENT_TOTAL', 16))),
+    )
+
+
+def clinic_weight(config, clinic_id: str) -> float:
+    """Share of a clinic in the fair queue: CHAT_CLINIC_WEIGHTS="<clinic id>=<weight>,..." (default 1)."""
+    for item in (config.get('CHAT_CLINIC_WEIGHTS') or '').split(','):
+        key, _, value = item.partition('=')
+        if key.strip() == clinic_id:
+            try:
+                return max(float(value), 0.01)
+            except ValueError:
+                break
+    return 1.0
+
+
+def _new_job(job: dict) -> dict:
+    return {**job, 'id': uuid.uuid4().hex, 'enqueued_at': time.time()}
+
+
+def _record_wait(clinic_id: str, waited: float) -> None:
+    """Add one job's queue time to the clinic's stats for the current hour."""
+    logger.debug('reply job for clinic %s waited %.0fms in queue', clinic_id, waited * 1000)
+    client = _get_redis_client()
+    if client is None:
+        _local_waits.record(clinic_id, waited)
+        return
+    key = _QTIME_KEY.format(clinic=clinic_id, hour=int(time.time() // 3600))
+    ms = int(waited * 1000)
+    try:
+        pipe = client.pipeline()
+        pipe.hincrby(key, 'count', 1)
+        pipe.hincrby(key, 'total_ms', ms)
+        pipe.expire(key, 7200)
+        pipe.execute()
+        # HSET-if-greater: a lost race only under-reports the max briefly
+        if ms > int(client.hget(key, 'max_ms') or 0):
+            client.hset(key, 'max_ms', ms)
+    except Exception:
+        pass
+
+
+class _LocalWaits:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats: dict = {}
+
+    def record(self, clinic_id: str, waited: float) -> None:
+        hour = int(time.time() // 3600)
+        ms = int(waited * 1000)
+        with self._lock:
+            stats = self._stats.get(clinic_id)
+            if stats is None or stats['hour'] != hour:
+                stats = self._stats[clinic_id] = {'hour': hour, 'count': 0, 'total_ms': 0, 'max_ms': 0}
+            stats['count'] += 1
+            stats['total_ms'] += ms
+            stats['max_ms'] = max(stats['max_ms'], ms)
+
+    def get(self, clinic_id: str) -> dict:
+        with self._lock:
+            stats = self._stats.get(clinic_id)
+            if stats is None or stats['hour'] != int(time.time() // 3600):
+                return {'count': 0, 'total_ms': 0, 'max_ms': 0}
+            return dict(stats)
+
+
+_local_waits = _LocalWaits()
+
+
+# ---------------------------------------------------------------------------
+# Redis queue (CHAT_WORKER_QUEUE / `flask chat-worker`)
+# ---------------------------------------------------------------------------
+
+_scripts = {}
+
+
+def _script(client, name: str, source: str):
+    key = (id(client), name)
+    if key not in _scripts:
+        _scripts[key] = client.register_script(source)
+    return _scripts[key]
+
+
+def enqueue(job: dict):
+    """
+    Queue a reply job ({'clinic_id', 'conversation_id', ...}) for the
+    chat-workers. Returns the job id, or None when Redis is unavailable (the
+    caller falls back to in-process handling).
+    """
+    client = _get_redis_client()
+    if client is None:
+        return None
+    job = _new_job(job)
+    clinic_id = job['clinic_id']
+    try:
+        _script(client, 'enqueue', _ENQUEUE_SCRIPT)(
+            keys=[_FAIR_KEY, _VCLOCK_KEY, _WEIGHTS_KEY, _READY_KEY],
+            args=[_QUEUE_KEY + clinic_id, clinic_id, json.dumps(job),
+                  clinic_weight(current_app.config, clinic_id)],
+        )
+        return job['id']
+    except Exception as e:
+        logger.warning('reply queue: enqueue failed, replying in-process (%s)', e)
+        return None
+
+
+def _decode(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def queue_stats() -> dict:
+    """
+    {'depth': queued jobs, 'in_progress': running jobs, 'oldest_age_seconds':
+    age of the oldest queued job, 'clinics': clinics with queued jobs}, or
+    None without Redis.
+    """
+    client = _get_redis_client()
+    if client is None:
+        return None
+    try:
+        clinics = [_decode(c) for c in client.zrange(_FAIR_KEY, 0, -1)]
+        pipe = client.pipeline()
+        for clinic in clinics:
+            pipe.llen(_QUEUE_KEY + clinic)
+            pipe.lindex(_QUEUE_KEY + clinic, 0)
+        results = pipe.execute()
+        depth = sum(results[0::2])
+        heads = [json.loads(raw)['enqueued_at'] for raw in results[1::2] if raw]
+        return {
+            'depth': depth,
+            'in_progress': int(client.hget(_RUNNING_KEY, '*') or 0),
+            'oldest_age_seconds': round(time.time() - min(heads), 1) if heads else 0.0,
+            'clinics': len(clinics),
+        }
+    except Exception as e:
+        logger.warning('reply queue: stats unavailable (%s)', e)
+        return None
+
+
+def clinic_queue_stats(clinic_id: str) -> dict:
+    """
+    One clinic's reply backlog and queue time over the current hour:
+    {'queued', 'running', 'jobs', 'avg_wait_ms', 'max_wait_ms'}.
+    """
+    clinic_id = str(clinic_id)
+    client = _get_redis_client()
+    if client is None:
+        waits = _local_waits.get(clinic_id)
+        queued, running = _local_pool_counts(clinic_id)
+    else:
+        pipe = client.pipeline()
+        pipe.llen(_QUEUE_KEY + clinic_id)
+        pipe.hget(_RUNNING_KEY, clinic_id)
+        pipe.hgetall(_QTIME_KEY.format(clinic=clinic_id, hour=int(time.time() // 3600)))
+        queued, running, raw = pipe.execute()
+        waits = {_decode(k): int(v) for k, v in (raw or {}).items()}
+        queued, running = int(queued or 0), int(running or 0)
+    count = waits.get('count', 0)
+    return {
+        'queued': queued,
+        'running': running,
+        'jobs': count,
+        'avg_wait_ms': round(waits.get('total_ms', 0) / count) if count else 0,
+        'max_wait_ms': waits.get('max_ms', 0),
+    }
+
+
+class ReplyWorker:
+    """
+    Consumer for the Redis reply queue: `concurrency` threads, each handling
+    one job at a time (subject to the fleet-wide caps). `handler(job)` runs
+    inside an app context.
+    """
+
+    def __init__(self, app, handler, concurrency: int = 4):
+        self.app = app
+        self.handler = handler
+        self.concurrency = max(1, concurrency)
+        self.per_clinic_cap, self.global_cap = _limits(app.config)
+        self._stop = threading.Event()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def run(self) -> None:
+        """Run until stop() (or KeyboardInterrupt); blocks the calling thread."""
+        with self.app.app_context():
+            client = _get_redis_client()
+        if client is None:
+            logger.error('chat worker: REDIS_URL not configured, nothing to consume')
+            return
+
+        workers = [
+            threading.Thread(target=self._serve, args=(client,), name=f'chat-worker-{i}', daemon=True)
+            for i in range(self.concurrency)
+        ]
+        for t in workers:
+            t.start()
+        try:
+            while not self._stop.wait(_STATS_INTERVAL):
+                self._reclaim(client)
+                with self.app.app_context():
+                    stats = queue_stats()
+                if stats:
+                    logger.info(
+                        'chat queue: depth=%s in_progress=%s oldest_age=%ss clinics=%s',
+                        stats['depth'], stats['in_progress'], stats['oldest_age_seconds'], stats['clinics'],
+                    )
+        except KeyboardInterrupt:
+            self.stop()
+        for t in workers:
+            t.join(timeout=60)
+
+    # -- internals ---------------------------------------------------------
+
+    def _reclaim(self, client) -> None:
+        try:
+            requeued = _script(client, 'reclaim', _RECLAIM_SCRIPT)(
+                keys=[_RUNNING_KEY, _JOBS_KEY, _LEASES_KEY, _FAIR_KEY, _VCLOCK_KEY, _READY_KEY],
+                args=[time.time(), _QUEUE_KEY],
+            )
+            if requeued:
+                logger.warning('chat worker: requeued %s reply jobs with expired leases', requeued)
+        except Exception:
+            logger.exception('chat worker: reclaiming expired jobs failed')
+
+    def _take(self, client):
+        raw = _script(client, 'take', _TAKE_SCRIPT)(
+            keys=[_FAIR_KEY, _VCLOCK_KEY, _WEIGHTS_KEY, _RUNNING_KEY, _JOBS_KEY, _LEASES_KEY],
+            args=[_QUEUE_KEY, self.per_clinic_cap, self.global_cap, time.time() + _JOB_LEASE],
+        )
+        return json.loads(raw) if raw else None
+
+    def _release(self, client, job: dict) -> None:
+        _script(client, 'release', _RELEASE_SCRIPT)(
+            keys=[_RUNNING_KEY, _JOBS_KEY, _LEASES_KEY, _READY_KEY],
+            args=[job['id'], job['clinic_id']],
+        )
+
+    def _serve(self, client) -> None:
+        self._reclaim(client)
+        while not self._stop.is_set():
+            try:
+                job = self._take(client)
+                if job is None:
+                    # Woken by new jobs or freed slots
+                    client.blpop([_READY_KEY], timeout=_READY_BLOCK)
+                    continue
+            except Exception:
+                logger.exception('chat worker: reading the reply queue failed')
+                self._stop.wait(2)
+                continue
+            try:
+                with self.app.app_context():
+                    _record_wait(job['clinic_id'], time.time() - job['enqueued_at'])
+                    self.handler(job)
+            except Exception:
+                # The handler deals with its own (LLM/send) failures; anything
+                # escaping is a bug that a retry wouldn't fix.
+                logger.exception('chat worker: job %s failed', job['id'])
+            finally:
+                try:
+                    self._release(client, job)
+                except Exception:
+                    logger.exception('chat worker: releasing job %s failed (lease will expire)', job['id'])
+
+
+# ---------------------------------------------------------------------------
+# In-process pool (no chat-worker / no Redis)
+# ---------------------------------------------------------------------------
+
+class LocalReplyPool:
+    """The same fair-share policy over threads of this process."""
+
+    def __init__(self, app, handler, threads: int = 4):
+        self.app = app
+        self.handler = handler
+        self.per_clinic_cap, global_cap = _limits(app.config)
+        self.threads = max(1, min(threads, global_cap))
+        self._cond = threading.Condition()
+        self._queues: dict[str, deque] = {}
+        self._vtime: dict[str, float] = {}
+        self._vclock = 0.0
+        self._running: dict[str, int] = {}
+        for i in range(self.threads):
+            threading.Thread(target=self._serve, name=f'chat-reply-{i}', daemon=True).start()
+
+    def submit(self, job: dict) -> None:
+        job = _new_job(job)
+        clinic_id = job['clinic_id']
+        with self._cond:
+            self._queues.setdefault(clinic_id, deque()).append(job)
+            self._vtime.setdefault(clinic_id, self._vclock)
+            self._cond.notify()
+
+    def counts(self, clinic_id: str) -> tuple:
+        with self._cond:
+            return len(self._queues.get(clinic_id) or ()), self._running.get(clinic_id, 0)
+
+    def _take(self) -> dict:
+        with self._cond:
+            while True:
+                eligible = [
+                    c for c, q in self._queues.items()
+                    if q and self._running.get(c, 0) < self.per_clinic_cap
+                ]
+                if eligible:
+                    clinic_id = min(eligible, key=self._vtime.__getitem__)
+                    job = self._queues[clinic_id].popleft()
+                    self._vclock = self._vtime[clinic_id]
+                    if self._queues[clinic_id]:
+                        self._vtime[clinic_id] += 1 / clinic_weight(self.app.config, clinic_id)
+                    else:
+                        # Idle clinics re-enter at the clock; no banked credit
+                        del self._queues[clinic_id]
+                        del self._vtime[clinic_id]
+                    self._running[clinic_id] = self._running.get(clinic_id, 0) + 1
+                    return job
+                self._cond.wait()
+
+    def _serve(self) -> None:
+        while True:
+            job = self._take()
+            try:
+                with self.app.app_context():
+                    _record_wait(job['clinic_id'], time.time() - job['enqueued_at'])
+                    self.handler(job)
+            except Exception:
+                logger.exception('reply pool: job for conversation %s failed', job.get('conversation_id'))
+            finally:
+                with self._cond:
+                    clinic_id = job['clinic_id']
+                    self._running[clinic_id] -= 1
+                    if not self._running[clinic_id]:
+                        del self._running[clinic_id]
+                    self._cond.notify_all()
+
+
+_local_pools: dict = {}
+_local_pools_lock = threading.Lock()
+
+
+def local_pool(app, handler) -> LocalReplyPool:
+    """This process's reply pool for `app` (created on first use)."""
+    with _local_pools_lock:
+        pool = _local_pools.get(id(app))
+        if pool is None:
+            pool = _local_pools[id(app)] = LocalReplyPool(app, handler)
+        return pool
+
+
+def _local_pool_counts(clinic_id: str) -> tuple:
+    pool = _local_pools.get(id(current_app._get_current_object()))
+    return pool.counts(clinic_id) if pool else (0, 0)
@@ -0,0 +1,225 @@
+"""
+Ranked search over a clinic's conversations: message content, patient name
+and phone number.
+
+On PostgreSQL this runs on the indexes from migration 26: a GIN index on
+`to_tsvector('portuguese', content)` for word matches (stemmed, so
+"clareamentos" finds "clareamento") ranked with `ts_rank`, and pg_trgm GIN
+indexes that make the substring fallback (`ILIKE '%term%'` on content,
+patient name and phone) an index scan instead of a sequential one. Snippets
+come from `ts_headline`.
+
+Other dialects (the in-memory SQLite used by tests) fall back to plain
+substring matching with snippets cut in Python, same result shape.
+"""
+import logging
+import re
+
+from app import db
+from app.models import Conversation, ConversationMessage, Patient
+
+logger = logging.getLogger(__name__)
+
+TS_CONFIG = 'portuguese'
+# ts_headline markers around matched words. Control characters can't show
+# up in WhatsApp text, so they are split out safely into highlight ranges
+# instead of shipping HTML built from patient-controlled content.
+_HL_START = '\x02'
+_HL_STOP = '\x03'
+_HEADLINE_OPTIONS = (
+    f'StartSel="{_HL_START}", StopSel="{_HL_STOP}", '
+    'MaxWords=18, MinWords=8, MaxFragments=1, FragmentDelimiter=" ... "'
+)
+SNIPPET_CONTEXT_CHARS = 60
+
+
+def _ts_config():
+    # Inlined rather than bound, so the expression is textually the one the
+    # GIN index was built on (migration 26) and the planner can match it
+    return db.literal_column(f"'{TS_CONFIG}'::regconfig")
+
+
+def _tsvector(column):
+    return db.func.to_tsvector(_ts_config(), db.func.coalesce(column, db.literal_column("''")))
+
+
+def _escape_like(term: str) -> str:
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _split_highlights(marked: str) -> dict:
+    """Turn marker-delimited text into {'snippet', 'highlights': [[start, end], ...]}."""
+    snippet = []
+    highlights = []
+    pos = 0
+    start = None
+    for ch in marked:
+        if ch == _HL_START:
+            start = pos
+        elif ch == _HL_STOP:
+            if start is not None and pos > start:
+                highlights.append([start, pos])
+            start = None
+        else:
+            snippet.append(ch)
+            pos += 1
+    return {'snippet': ''.join(snippet), 'highlights': highlights}
+
+
+def _python_snippet(content: str, term: str) -> dict:
+    """Snippet around the first case-insensitive occurrence of `term`."""
+    content = content or ''
+    match = re.search(re.escape(term), content, re.IGNORECASE)
+    if not match:
+        return {'snippet': content[:2 * SNIPPET_CONTEXT_CHARS], 'highlights': []}
+
+    begin = max(match.start() - SNIPPET_CONTEXT_CHARS, 0)
+    end = min(match.end() + SNIPPET_CONTEXT_CHARS, len(content))
+    prefix = '... ' if begin > 0 else ''
+    suffix = ' ...' if end < len(content) else ''
+    offset = len(prefix) - begin
+    return {
+        'snippet': prefix + content[begin:end] + suffix,
+        'highlights': [[match.start() + offset, match.end() + offset]],
+    }
+
+
+class ConversationSearchService:
+    """Clinic-scoped conversation search (inbox search box, assistant tool)."""
+
+    def __init__(self, clinic):
+        self.clinic = clinic
+
+    @property
+    def _is_postgres(self) -> bool:
+        return db.engine.dialect.name == 'postgresql'
+
+    def _like(self, term: str) -> str:
+        return f'%{_escape_like(term)}%'
+
+    def _message_match(self, term: str):
+        """(match clause, rank expression) for messages matching `term`."""
+        like = ConversationMessage.content.ilike(self._like(term), escape='\\')
+        if not self._is_postgres:
+            return like, db.literal(1.0)
+
+        tsquery = db.func.websearch_to_tsquery(_ts_config(), term)
+        document = _tsvector(ConversationMessage.content)
+        # Substring hits (partial words, phone-like tokens) rank below word hits
+        rank = db.func.greatest(
+            db.func.ts_rank(document, tsquery),
+            db.case((like, 0.05), else_=0.0),
+        )
+        return db.or_(document.op('@@')(tsquery), like), rank
+
+    def conversations_query(self, term: str, base_query=None):
+        """
+        Conversations matching `term` in any message, the patient name or the
+        phone number, best-ranked first (most recent activity breaks ties).
+        `base_query` lets callers keep their own filters (status etc.).
+        """
+        term = term.strip()
+        message_match, message_rank = self._message_match(term)
+        ranked = db.session.query(
+            ConversationMessage.conversation_id.label('conversation_id'),
+            db.func.max(message_rank).label('rank'),
+        ).filter(
+            ConversationMessage.clinic_id == self.clinic.id,
+            message_match,
+        ).group_by(ConversationMessage.conversation_id).subquery()
+
+        like = self._like(term)
+        identity_match = db.or_(
+            Patient.name.ilike(like, escape='\\'),
+            Patient.phone.ilike(like, escape='\\'),
+            Conversation.phone_number.ilike(like, escape='\\'),
+        )
+        # A name/phone hit is what the user most likely typed for
+        score = db.func.coalesce(ranked.c.rank, 0.0) + db.case((identity_match, 1.0), else_=0.0)
+
+        query = base_query if base_query is not None else Conversation.query.filter_by(clinic_id=self.clinic.id)
+        return query.join(
+            Patient, Conversation.patient_id == Patient.id, isouter=True
+        ).join(
+            ranked, ranked.c.conversation_id == Conversation.id, isouter=True
+        ).filter(
+            db.or_(ranked.c.conversation_id.isnot(None), identity_match)
+        ).order_by(score.desc(), Conversation.last_message_at.desc())
+
+    def snippets(self, conversation_ids: list, term: str) -> dict:
+        """
+        Best-matching message per conversation as {conversation_id (str):
+        {'message_id', 'snippet', 'highlights'}} - one query for the page.
+        """
+        if not conversation_ids:
+            return {}
+        return {
+            hit['conversation_id']: hit
+            for hit in self._best_messages(term.strip(), conversation_ids=conversation_ids)
+        }
+
+    def search_messages(self, term: str, limit: int = 10, patient_id=None) -> list:
+        """Top matching messages across the clinic (one per conversation), ranked."""
+        return self._best_messages(term.strip(), patient_id=patient_id, limit=limit)
+
+    def _best_messages(self, term: str, conversation_ids=None, patient_id=None, limit: int = None) -> list:
+        message_match, rank = self._message_match(term)
+        query = db.session.query(
+            ConversationMessage, rank.label('rank')
+        ).filter(
+            ConversationMessage.clinic_id == self.clinic.id,
+            message_match,
+        )
+        if conversation_ids is not None:
+            query = query.filter(ConversationMessage.conversation_id.in_(conversation_ids))
+        if patient_id is not None:
+            query = query.join(
+                Conversation, Conversation.id == ConversationMessage.conversation_id
+            ).filter(Conversation.patient_id == patient_id)
+
+        if self._is_postgres:
+            best = query.order_by(
+                ConversationMessage.conversation_id,
+                db.desc('rank'),
+                ConversationMessage.timestamp.desc(),
+            ).distinct(ConversationMessage.conversation_id).subquery()
+            # DISTINCT ON forces conversation_id ordering; re-rank outside it,
+            # and only build headlines for the winning message of each
+            headline = db.func.ts_headline(
+                _ts_config(), db.func.coalesce(best.c.content, db.literal_column("''")),
+                db.func.websearch_to_tsquery(_ts_config(), term), _HEADLINE_OPTIONS,
+            )
+            rows = db.session.query(
+                db.aliased(ConversationMessage, best), best.c.rank, headline
+            ).order_by(best.c.rank.desc(), best.c.timestamp.desc())
+            if limit:
+                rows = rows.limit(limit)
+            rows = rows.all()
+        else:
+            seen = set()
+            rows = []
+            for message, message_rank in query.order_by(ConversationMessage.timestamp.desc()):
+                if message.conversation_id in seen:
+                    continue
+                seen.add(message.conversation_id)
+                rows.append((message, message_rank, None))
+                if limit and len(rows) >= limit:
+                    break
+
+        hits = []
+        for message, message_rank, headline in rows:
+            # ts_headline only marks word (stem) matches - substring-only
+            # hits come back unmarked, so cut those around the substring
+            if headline and _HL_START in headline:
+                snippet = _split_highlights(headline)
+            else:
+                snippet = _python_snippet(message.content, term)
+            hits.append({
+                'conversation_id': str(message.conversation_id),
+                'message_id': message.message_id,
+                'role': message.role,
+                'timestamp': message.timestamp.isoformat() + 'Z' if message.timestamp else None,
+                'rank': float(message_rank or 0),
+                **snippet,
+            })
+        return hits
@@ -0,0 +1,118 @@
+"""
+Background generation of the conversation summaries the agent relies on.
+
+Two light-model completions used to run on the patient's reply path:
+
+- the rolling summary (everything older than the token-budgeted history
+  window, kept in conversation.context) was refreshed before the reply was
+  even started, whenever the history crossed the window;
+- the handoff summary for a human takeover was generated inside the
+  transfer_to_human tool, before the transfer message went out.
+
+Both now run here, on a small thread pool. The rolling summary is refreshed
+once a turn has been answered - while the conversation is idle waiting for
+the patient - and the next reply uses whatever summary is current. The
+handoff summary is attached to its BotTransfer when ready and pushed to the
+dashboard as a 'transfer_summary' event.
+
+SUMMARY_ASYNC=false runs both inline, with the caller's service and
+session (used by the test suite).
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+
+from app import db
+from app.models import BotTransfer, Clinic, Conversation
+from app.services.conversation_service import TEST_PHONE_PREFIX
+from app.services.realtime_service import publish_event
+
+logger = logging.getLogger(__name__)
+
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='summary-worker')
+
+
+def needs_rolling_summary(conversation, cut: int) -> bool:
+    """Whether messages before position `cut` aren't covered by the stored summary yet."""
+    return cut > 0 and (conversation.context or {}).get('summary_upto', 0) < cut
+
+
+def schedule_rolling_summary(service, conversation, cut: int) -> str:
+    """
+    Summarize every message before position `cut` (where the turn's history
+    window started) if the stored summary doesn't cover them yet. `service`
+    is the caller's ClaudeService. Returns 'skipped', 'inline' or 'scheduled'.
+    """
+    if not needs_rolling_summary(conversation, cut):
+        return 'skipped'
+    if not current_app.config.get('SUMMARY_ASYNC', True):
+        _refresh_rolling_summary(service, conversation, cut)
+        return 'inline'
+    _submit(refresh_rolling_summary, service, str(conversation.id), cut)
+    return 'scheduled'
+
+
+def schedule_handoff_summary(service, conversation, transfer) -> str:
+    """Generate the human-handoff summary for `transfer`. Returns 'inline' or 'scheduled'."""
+    if not current_app.config.get('SUMMARY_ASYNC', True):
+        _attach_handoff_summary(service, conversation, transfer)
+        return 'inline'
+    _submit(attach_handoff_summary, service, str(conversation.id), str(transfer.id))
+    return 'scheduled'
+
+
+def _submit(job, service, *args) -> None:
+    app = current_app._get_current_object()
+    _executor.submit(job, app, service, str(service.clinic.id), *args)
+
+
+# Inline runs use the caller's service and session objects as they are. The
+# pool side reloads the rows on its own app context and session, and binds a
+# copy of the caller's service to them (same client and overrides).
+
+def refresh_rolling_summary(app, service, clinic_id: str, cid: str, cut: int) -> None:
+    with app.app_context():
+        clinic = db.session.get(Clinic, clinic_id)
+        conversation = db.session.get(Conversation, cid)
+        if not clinic or not conversation:
+            return
+        _refresh_rolling_summary(service._bound_to(clinic), conversation, cut)
+
+
+def attach_handoff_summary(app, service, clinic_id: str, cid: str, transfer_id: str) -> None:
+    with app.app_context():
+        clinic = db.session.get(Clinic, clinic_id)
+        conversation = db.session.get(Conversation, cid)
+        transfer = db.session.get(BotTransfer, transfer_id)
+        if not clinic or not conversation or not transfer:
+            return
+        _attach_handoff_summary(service._bound_to(clinic), conversation, transfer)
+
+
+def _refresh_rolling_summary(service, conversation, cut: int) -> None:
+    try:
+        service.refresh_rolling_summary(conversation, cut)
+    except Exception:
+        logger.exception('Rolling summary job failed for conversation %s', conversation.id)
+        db.session.rollback()
+
+
+def _attach_handoff_summary(service, conversation, transfer) -> None:
+    try:
+        summary = service.summarize_conversation_for_handoff(conversation)
+        if not summary:
+            return
+        transfer.summary = summary
+        db.session.commit()
+    except Exception:
+        logger.exception('Handoff summary job failed for conversation %s', conversation.id)
+        db.session.rollback()
+        return
+
+    if not conversation.phone_number.startswith(TEST_PHONE_PREFIX):
+        publish_event(str(service.clinic.id), 'transfer_summary', {
+            'conversation_id': str(conversation.id),
+            'transfer_id': str(transfer.id),
+            'summary': summary,
+        })
@@ -0,0 +1,91 @@
+"""
+Redis-first idempotency for Evolution `messages.upsert` webhooks.
+
+Evolution retries deliveries it considers slow and echoes messages sent
+through its own API back as fromMe upserts, so the same WhatsApp message id
+routinely arrives more than once. A `SET NX EX` on (instance, message id) at
+the very top of the handler turns those into a single Redis round-trip
+instead of a clinic lookup, a conversation lookup and a message query.
+
+Keys go through two states:
+
+- 'processing' (short TTL) while a delivery is being handled. If the
+  handling fails the key is released, so Evolution's next retry gets through
+  rather than being swallowed. A delivery that finds a 'processing' key is
+  NOT answered as a duplicate - the holder may have crashed or been killed
+  mid-handling, and its key outlives the webhook-stream lease - so it falls
+  back to the stored-message check instead.
+- 'done' (long TTL) once the message is stored. Ids of messages this
+  platform sends itself are marked 'done' too, at the moment their id is
+  recorded, so the echo of our own send is recognized the same way.
+
+`claim()` returns None when Redis is unavailable; callers then fall back to
+the indexed database check (ConversationService.find_message_by_evolution_id).
+"""
+import logging
+
+from app.services.realtime_service import _get_redis_client
+
+logger = logging.getLogger(__name__)
+
+_KEY = 'sdental:webhook:seen:{instance}:{message_id}'
+_PROCESSING_TTL = 120        # longer than any inline handling (media download, transcription)
+_DONE_TTL = 3 * 24 * 3600    # comfortably beyond Evolution's retry horizon
+
+
+def _key(instance: str, message_id: str) -> str:
+    return _KEY.format(instance=instance or '', message_id=message_id)
+
+
+def claim(instance: str, message_id: str):
+    """
+    Try to become the one delivery handling this message. True: go ahead.
+    False: already handled ('done' - duplicate). None: no Redis, nothing to
+    key on, or another delivery is (or was, before crashing) handling it -
+    check the database instead.
+    """
+    if not message_id:
+        return None
+    client = _get_redis_client()
+    if client is None:
+        return None
+    try:
+        key = _key(instance, message_id)
+        if client.set(key, 'processing', nx=True, ex=_PROCESSING_TTL):
+            return True
+        raw = client.get(key)
+        value = raw.decode() if isinstance(raw, bytes) else raw
+        return False if value == 'done' else None
+    except Exception as e:
+        logger.warning('webhook dedup: redis claim failed, using database check (%s)', e)
+        return None
+
+
+def complete(instance: str, message_id: str) -> None:
+    """Mark a message as handled for good (also used for ids of messages we send)."""
+    if not message_id:
+        return
+    client = _get_redis_client()
+    if client is None:
+        return
+    try:
+        client.set(_key(instance, message_id), 'done', ex=_DONE_TTL)
+    except Exception:
+        pass
+
+
+def release(instance: str, message_id: str) -> None:
+    """Drop a 'processing' claim after a failure so a retry can be handled."""
+    if not message_id:
+        return
+    client = _get_redis_client()
+    if client is None:
+        return
+    try:
+        key = _key(instance, message_id)
+        raw = client.get(key)
+        value = raw.decode() if isinstance(raw, bytes) else raw
+        if value == 'processing':
+            client.delete(key)
+    except Exception:
+        pass
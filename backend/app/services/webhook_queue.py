@@ -0,0 +1,276 @@
+"""
+Durable ingestion queue for Evolution API webhooks.
+
+With WEBHOOK_ASYNC_INGEST on, the webhook route only authenticates the call,
+appends the raw payload to a Redis Stream and answers 202 - clinic lookup,
+dedup, storage and any synchronous sends happen in `flask webhook-worker`
+instead of inside Evolution's request timeout. A slow database then shows up
+as queue lag, not as Evolution retries piling up on top of each other.
+
+Ordering and delivery guarantees:
+
+- Payloads are spread over WEBHOOK_QUEUE_PARTITIONS streams by a hash of
+  (instance, remote JID), so everything about one chat lands in the same
+  partition, in arrival order.
+- Each partition has exactly one active consumer fleet-wide: a worker must
+  hold the partition's lease (SET NX with a TTL, renewed while it works) to
+  read it. Entries are handled strictly in order; a failure stops the
+  partition (nothing after it is processed) until the retry succeeds, which
+  keeps per-conversation ordering intact.
+- Consumers are named after the partition, not the process, and every read
+  starts by re-reading the consumer's own pending list. Entries a crashed
+  worker had read but not acknowledged are therefore redelivered to whoever
+  takes the lease over - at-least-once. The handlers are idempotent on the
+  WhatsApp message id (duplicate deliveries are detected), so a redelivery
+  is harmless.
+- An entry that keeps failing is moved to a dead-letter stream after
+  WEBHOOK_QUEUE_MAX_ATTEMPTS so one poison payload can't wedge its partition.
+
+Without Redis there is nothing durable to queue into: `enqueue()` returns
+None and the route keeps processing inline, as before.
+"""
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import zlib
+
+from flask import current_app
+
+from app.services.realtime_service import _get_redis_client
+
+logger = logging.getLogger(__name__)
+
+_STREAM_KEY = 'sdental:webhook:stream:{n}'
+_LEASE_KEY = 'sdental:webhook:lease:{n}'
+_ATTEMPTS_KEY = 'sdental:webhook:attempts'
+_DEAD_LETTER_KEY = 'sdental:webhook:dead'
+_GROUP = 'webhook-workers'
+
+_STREAM_MAXLEN = 100_000     # approximate cap per partition (XADD MAXLEN ~)
+_LEASE_TTL = 120             # seconds; renewed before every entry
+_READ_COUNT = 50
+_READ_BLOCK_MS = 1000
+_RETRY_DELAY = 2.0           # pause before re-reading a partition after a failure
+
+
+def _partitions() -> int:
+    return max(1, int(current_app.config.get('WEBHOOK_QUEUE_PARTITIONS', 8)))
+
+
+def partition_for(payload: dict, partitions: int) -> int:
+    """
+    Partition for a payload: same instance + chat -> same partition. ACK
+    batches and instance-level events (connection/presence without a chat)
+    key on the instance alone.
+    """
+    instance = str(payload.get('instance') or '')
+    data = payload.get('data')
+    if isinstance(data, list):
+        data = data[0] if data else {}
+    data = data if isinstance(data, dict) else {}
+    remote_jid = (data.get('key') or {}).get('remoteJid') or data.get('id') or ''
+    return zlib.crc32(f'{instance}|{remote_jid}'.encode()) % partitions
+
+
+def enqueue(payload: dict):
+    """
+    Append a webhook payload to its partition stream. Returns the stream
+    entry id, or None when Redis is unavailable (caller processes inline).
+    """
+    client = _get_redis_client()
+    if client is None:
+        return None
+
+    partition = partition_for(payload, _partitions())
+    try:
+        return client.xadd(
+            _STREAM_KEY.format(n=partition),
+            {'payload': json.dumps(payload), 'enqueued_at': repr(time.time())},
+            maxlen=_STREAM_MAXLEN,
+            approximate=True,
+        )
+    except Exception as e:
+        logger.warning('webhook queue: enqueue failed, processing inline (%s)', e)
+        return None
+
+
+class WebhookWorker:
+    """
+    Consumer for the webhook partitions. Each thread serves a fixed slice of
+    partitions (i, i + threads, ...) and only reads those whose lease it
+    holds, so several worker processes can run side by side safely.
+
+    `handler(payload) -> bool` does the actual processing inside an app
+    context and returns False for a retryable failure.
+    """
+
+    def __init__(self, app, handler, threads: int = 4):
+        self.app = app
+        self.handler = handler
+        with app.app_context():
+            self.partitions = _partitions()
+            self.max_attempts = int(app.config.get('WEBHOOK_QUEUE_MAX_ATTEMPTS', 5))
+        self.threads = max(1, min(threads, self.partitions))
+        self.owner = f'{socket.gethostname()}:{os.getpid()}'
+        self._stop = threading.Event()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def run(self) -> None:
+        """Run until stop() (or KeyboardInterrupt); blocks the calling thread."""
+        workers = [
+            threading.Thread(
+                target=self._serve, args=(list(range(i, self.partitions, self.threads)),),
+                name=f'webhook-worker-{i}', daemon=True,
+            )
+            for i in range(self.threads)
+        ]
+        for t in workers:
+            t.start()
+        try:
+            while any(t.is_alive() for t in workers):
+                for t in workers:
+                    t.join(timeout=1)
+        except KeyboardInterrupt:
+            self.stop()
+            for t in workers:
+                t.join(timeout=_LEASE_TTL)
+
+    # -- internals ---------------------------------------------------------
+
+    def _serve(self, partitions: list) -> None:
+        with self.app.app_context():
+            client = _get_redis_client()
+        if client is None:
+            logger.error('webhook worker: REDIS_URL not configured, nothing to consume')
+            return
+
+        for n in partitions:
+            self._ensure_group(client, n)
+
+        while not self._stop.is_set():
+            worked = False
+            for n in partitions:
+                if not self._hold_lease(client, n):
+                    continue
+                try:
+                    worked = self._drain(client, n) or worked
+                except Exception:
+                    logger.exception('webhook worker: partition %s failed', n)
+                    time.sleep(_RETRY_DELAY)
+            if not worked:
+                # Nothing leased or nothing to do: the blocking read already
+                # waited if we held a lease, otherwise back off briefly.
+                self._stop.wait(0.2)
+
+        for n in partitions:
+            self._release_lease(client, n)
+
+    @staticmethod
+    def _ensure_group(client, n: int) -> None:
+        try:
+            client.xgroup_create(_STREAM_KEY.format(n=n), _GROUP, id='0', mkstream=True)
+        except Exception as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+
+    def _hold_lease(self, client, n: int) -> bool:
+        key = _LEASE_KEY.format(n=n)
+        if client.set(key, self.owner, nx=True, ex=_LEASE_TTL):
+            return True
+        current = client.get(key)
+        if isinstance(current, bytes):
+            current = current.decode()
+        if current == self.owner:
+            client.expire(key, _LEASE_TTL)
+            return True
+        return False
+
+    def _release_lease(self, client, n: int) -> None:
+        key = _LEASE_KEY.format(n=n)
+        try:
+            current = client.get(key)
+            if isinstance(current, bytes):
+                current = current.decode()
+            if current == self.owner:
+                client.delete(key)
+        except Exception:
+            pass
+
+    def _drain(self, client, n: int) -> bool:
+        """
+        Process one batch of partition `n`: pending (unacknowledged)
+        entries first, then new ones. Returns True if anything was handled.
+        """
+        stream = _STREAM_KEY.format(n=n)
+        consumer = f'partition-{n}'
+
+        entries = self._read(client, stream, consumer, '0', block=None)
+        if not entries:
+            entries = self._read(client, stream, consumer, '>', block=_READ_BLOCK_MS)
+        if not entries:
+            return False
+
+        for entry_id, fields in entries:
+            if self._stop.is_set() or not self._hold_lease(client, n):
+                return True
+            if not self._handle_entry(client, stream, entry_id, fields):
+                # Keep ordering: don't skip past a failed entry. It stays
+                # pending and is retried first on the next pass.
+                time.sleep(_RETRY_DELAY)
+                return True
+        return True
+
+    @staticmethod
+    def _read(client, stream: str, consumer: str, last_id: str, block):
+        response = client.xreadgroup(_GROUP, consumer, {stream: last_id}, count=_READ_COUNT, block=block)
+        if not response:
+            return []
+        _, entries = response[0]
+        # Pending-list reads return entries trimmed away by MAXLEN as (id, None)
+        return [(entry_id, fields) for entry_id, fields in entries if fields]
+
+    def _handle_entry(self, client, stream: str, entry_id, fields: dict) -> bool:
+        entry_key = entry_id.decode() if isinstance(entry_id, bytes) else str(entry_id)
+        raw = fields.get(b'payload', fields.get('payload'))
+        try:
+            payload = json.loads(raw)
+        except (TypeError, ValueError):
+            logger.error('webhook worker: dropping undecodable entry %s', entry_key)
+            self._dead_letter(client, stream, entry_id, fields, 'undecodable')
+            return True
+
+        attempts = client.hincrby(_ATTEMPTS_KEY, entry_key, 1)
+        ok = False
+        try:
+            with self.app.app_context():
+                ok = self.handler(payload)
+        except Exception:
+            logger.exception('webhook worker: entry %s raised', entry_key)
+
+        if ok:
+            client.xack(stream, _GROUP, entry_id)
+            client.hdel(_ATTEMPTS_KEY, entry_key)
+            return True
+
+        if attempts >= self.max_attempts:
+            logger.error('webhook worker: entry %s failed %s times, dead-lettering', entry_key, attempts)
+            self._dead_letter(client, stream, entry_id, fields, 'max_attempts')
+            return True
+        return False
+
+    @staticmethod
+    def _dead_letter(client, stream: str, entry_id, fields: dict, reason: str) -> None:
+        entry_key = entry_id.decode() if isinstance(entry_id, bytes) else str(entry_id)
+        client.xadd(
+            _DEAD_LETTER_KEY,
+            {**fields, 'source': stream, 'entry_id': entry_key, 'reason': reason},
+            maxlen=_STREAM_MAXLEN,
+            approximate=True,
+        )
+        client.xack(stream, _GROUP, entry_id)
+        client.hdel(_ATTEMPTS_KEY, entry_key)
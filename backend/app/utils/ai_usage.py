@@ -15,6 +15,7 @@ model's pricing and any prompt-cache discount (far more useful than a raw
 token count for answering "am I wasting money").
 """
 import logging
+from typing import Optional
 
 from app import db
 from app.models import AiUsageLog
@@ -26,13 +27,31 @@ logger = logging.getLogger(__name__)
 USAGE_INCLUDE_COST = {"include": True}
 
 
-def record_ai_usage(clinic_id, service: str, task: str, model: str, response) -> None:
+def record_ai_usage(clinic_id, service: str, task: str, model: str, response, cache_hit: bool = False,
+                    history: Optional[dict] = None) -> None:
     """
     Persist the token/cost usage of a completion response. Best-effort and
     defensive: usage tracking must never break the AI call it's measuring,
     so any failure here is logged and swallowed.
+
+    With cache_hit=True (response None) it records a call we answered from
+    a result cache: a zero-cost row, so hits and misses can be counted per
+    task.
+
+    `history` ({'messages': int, 'tokens': int}) records the size of the
+    conversation history packed into the prompt, for agent turns.
     """
     try:
+        if cache_hit:
+            db.session.add(AiUsageLog(
+                clinic_id=clinic_id, service=service, task=task, model=model,
+                prompt_tokens=0, completion_tokens=0, total_tokens=0, cost_usd=0,
+                cache_hit=True,
+            ))
+            db.session.commit()
+            logger.info('ai_usage clinic=%s service=%s task=%s model=%s cache_hit=true', clinic_id, service, task, model)
+            return
+
         usage = getattr(response, 'usage', None)
         if usage is None:
             return
@@ -52,14 +71,27 @@ def record_ai_usage(clinic_id, service: str, task: str, model: str, response) ->
             total_tokens=getattr(usage, 'total_tokens', None),
             cached_tokens=cached_tokens,
             cost_usd=getattr(usage, 'cost', None),
+            history_messages=(history or {}).get('messages'),
+            history_tokens=(history or {}).get('tokens'),
         )
         db.session.add(log)
         db.session.commit()
 
         logger.info(
-            'ai_usage clinic=%s service=%s task=%s model=%s total_tokens=%s cached_tokens=%s cost_usd=%s',
+            'ai_usage clinic=%s service=%s task=%s model=%s total_tokens=%s cached_tokens=%s cost_usd=%s '
+            'history_messages=%s history_tokens=%s',
             clinic_id, service, task, model, log.total_tokens, log.cached_tokens, log.cost_usd,
+            log.history_messages, log.history_tokens,
         )
     except Exception:
         db.session.rollback()
         logger.exception('Failed to record AI usage (clinic=%s service=%s task=%s)', clinic_id, service, task)
+
+
+def log_tool_memo_stats(clinic_id, service: str, task: str, tool_calls: int, memo_hits: int) -> None:
+    """Log how many of a turn's tool calls were answered from the turn's tool-result memo."""
+    if tool_calls:
+        logger.info(
+            'ai_usage clinic=%s service=%s task=%s tool_calls=%s tool_memo_hits=%s',
+            clinic_id, service, task, tool_calls, memo_hits,
+        )
@@ -0,0 +1,102 @@
+"""
+Process-wide pooled HTTP sessions.
+
+Module-level `requests.post`/`requests.get` open a new TCP (and TLS)
+connection for every call. For the Evolution gateway that's paid on every
+send, presence update, media download and history page - twice for the
+common presence+send pair. `get_session()` hands out one keep-alive
+`requests.Session` per origin and process, whose connection pool is reused
+by every thread.
+
+`pool_stats()` reports, per origin, how many requests went out and how many
+connections had to be opened for them; every process logs it at most once
+per STATS_LOG_INTERVAL (a low reuse_ratio means keep-alive isn't working -
+a proxy or the gateway closing idle connections early).
+"""
+import logging
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+DEFAULT_POOL_SIZE = 20
+STATS_LOG_INTERVAL = 300      # seconds
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_sessions: dict = {}          # (pid, origin) -> Session
+_last_stats_log = time.monotonic()
+
+
+def _origin(url: str) -> str:
+    parts = urlsplit(url or '')
+    return f'{parts.scheme}://{parts.netloc}'
+
+
+def get_session(base_url: str, pool_size: int = DEFAULT_POOL_SIZE) -> requests.Session:
+    """The shared session for `base_url`'s origin (created on first use)."""
+    # Keyed by pid too: a session inherited through fork() shares sockets
+    # with the parent.
+    key = (os.getpid(), _origin(base_url))
+    session = _sessions.get(key)
+    if session is None:
+        with _lock:
+            session = _sessions.get(key)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=4,
+                    pool_maxsize=pool_size,
+                    # Only connection failures are retried here (nothing was
+                    # sent yet); status/read retries are up to the caller.
+                    max_retries=Retry(total=1, connect=1, read=0, status=0, other=0, raise_on_status=False),
+                )
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                _sessions[key] = session
+    _maybe_log_stats()
+    return session
+
+
+def _maybe_log_stats() -> None:
+    global _last_stats_log
+    now = time.monotonic()
+    if now - _last_stats_log < STATS_LOG_INTERVAL:
+        return
+    with _lock:
+        if now - _last_stats_log < STATS_LOG_INTERVAL:
+            return
+        _last_stats_log = now
+    for origin, stats in pool_stats().items():
+        logger.info(
+            'http pool %s: requests=%s connections_opened=%s reuse_ratio=%s',
+            origin, stats['requests'], stats['connections_opened'], stats['reuse_ratio'],
+        )
+
+
+def pool_stats() -> dict:
+    """{origin: {'requests', 'connections_opened', 'reuse_ratio'}} for this process."""
+    pid = os.getpid()
+    stats = {}
+    for (owner, origin), session in list(_sessions.items()):
+        if owner != pid:
+            continue
+        sent = opened = 0
+        for adapter in {id(a): a for a in session.adapters.values()}.values():
+            pools = adapter.poolmanager.pools
+            for pool_key in list(pools.keys()):
+                pool = pools.get(pool_key)
+                if pool is not None:
+                    sent += pool.num_requests
+                    opened += pool.num_connections
+        stats[origin] = {
+            'requests': sent,
+            'connections_opened': opened,
+            'reuse_ratio': round(1 - opened / sent, 3) if sent else 0.0,
+        }
+    return stats
@@ -0,0 +1,54 @@
+"""
+Process-wide OpenRouter (OpenAI-compatible) clients.
+
+Every `openai.OpenAI(...)` owns its own httpx connection pool, so building
+one per ClaudeService/AssistantService - i.e. per reply, proactive message,
+summary, classification and transcription - paid a fresh TLS handshake to
+openrouter.ai on every call. `get_openai_client()` keeps one client per
+(api_key, base_url) and process; clinics with their own key get their own
+client, everyone on the platform key shares one. Connections are kept
+alive between calls and use HTTP/2 when `h2` is installed.
+
+The clients are thread-safe; only per-request options (timeouts, headers)
+should be varied per call, via `client.with_options(...)`.
+"""
+import importlib.util
+import os
+import threading
+from collections import OrderedDict
+
+import httpx
+import openai
+
+MAX_CLIENTS = 64              # distinct (api key, base url) pairs kept per process
+
+_HTTP2 = importlib.util.find_spec('h2') is not None
+
+_lock = threading.Lock()
+_clients: OrderedDict = OrderedDict()   # (pid, api_key, base_url) -> OpenAI
+
+
+def get_openai_client(api_key: str, base_url: str) -> openai.OpenAI:
+    """The shared client for this key and endpoint (created on first use)."""
+    # Keyed by pid too: a client inherited through fork() shares sockets
+    # with the parent.
+    key = (os.getpid(), api_key, base_url)
+    with _lock:
+        client = _clients.get(key)
+        if client is not None:
+            _clients.move_to_end(key)
+            return client
+        client = openai.OpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            http_client=openai.DefaultHttpxClient(
+                http2=_HTTP2,
+                limits=httpx.Limits(max_connections=50, max_keepalive_connections=20, keepalive_expiry=60),
+            ),
+        )
+        _clients[key] = client
+        # Least recently used clients are just dropped: one may still be
+        # mid-request in another thread, and it closes when collected.
+        while len(_clients) > MAX_CLIENTS:
+            _clients.popitem(last=False)
+        return client
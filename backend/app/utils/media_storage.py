@@ -0,0 +1,187 @@
+"""
+Content-addressed blob storage for MediaAsset bytes.
+
+Media used to live in `media_assets.data` (bytea, up to MAX_MEDIA_BYTES per
+row) - bloating WAL, backups and pg_dump, and every /api/media read pulled
+the whole blob through the ORM. Rows now keep only metadata plus the
+SHA-256 of the content; the bytes live in a MediaStorage backend under that
+hash, so identical stickers and forwarded images are stored once.
+
+Backends (MEDIA_STORAGE_BACKEND):
+
+- 'local': files under MEDIA_STORAGE_PATH, fanned out as ab/cd/<sha256>.
+  Only for a single host whose web and worker processes share a persistent
+  volume. Unset falls back to <instance>/media, which is fine for
+  development but NOT persistent on container platforms.
+- 's3': any S3-compatible store (AWS, MinIO, R2...) via boto3 - MEDIA_S3_*.
+
+Production refuses to start (config.validate_config), and the migration
+that moves blobs out of Postgres refuses to run, unless one of these is
+explicitly configured - see `persistent_storage_problem`.
+
+Blobs are immutable and written before the row referencing them commits; a
+rolled-back write at worst leaves an unreferenced blob behind, never a row
+without content.
+"""
+import hashlib
+import logging
+import os
+import tempfile
+from typing import Optional
+
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class MediaStorage:
+    """Interface: blobs keyed by the SHA-256 hex digest of their content."""
+
+    def put(self, data: bytes) -> str:
+        """Store `data` (no-op if already present). Returns its key."""
+        raise NotImplementedError
+
+    def exists(self, key: str) -> bool:
+        raise NotImplementedError
+
+    def get(self, key: str) -> bytes:
+        return b''.join(self.iter_chunks(key))
+
+    def iter_chunks(self, key: str, start: int = 0, end: int = None):
+        """Yield the blob's bytes [start, end] (inclusive, like HTTP ranges) in chunks."""
+        raise NotImplementedError
+
+
+class LocalMediaStorage(MediaStorage):
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key[2:4], key)
+
+    def put(self, data: bytes) -> str:
+        key = content_hash(data)
+        path = self._path(key)
+        if os.path.exists(path):
+            return key
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write-then-rename so a concurrent reader never sees a partial file
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+        return key
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self._path(key))
+
+    def iter_chunks(self, key: str, start: int = 0, end: int = None):
+        with open(self._path(key), 'rb') as f:
+            f.seek(start)
+            remaining = None if end is None else end - start + 1
+            while remaining is None or remaining > 0:
+                chunk = f.read(CHUNK_SIZE if remaining is None else min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+
+
+class S3MediaStorage(MediaStorage):
+    def __init__(self, bucket: str, prefix: str = '', **client_kwargs):
+        try:
+            import boto3
+        except ImportError as e:
+            raise RuntimeError('MEDIA_STORAGE_BACKEND=s3 requires boto3 (pip install boto3)') from e
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+        self.client = boto3.client('s3', **{k: v for k, v in client_kwargs.items() if v})
+
+    def _object_key(self, key: str) -> str:
+        return f'{self.prefix}/{key}' if self.prefix else key
+
+    def put(self, data: bytes) -> str:
+        key = content_hash(data)
+        if not self.exists(key):
+            self.client.put_object(Bucket=self.bucket, Key=self._object_key(key), Body=data)
+        return key
+
+    def exists(self, key: str) -> bool:
+        from botocore.exceptions import ClientError
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._object_key(key))
+            return True
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+
+    def iter_chunks(self, key: str, start: int = 0, end: int = None):
+        params = {'Bucket': self.bucket, 'Key': self._object_key(key)}
+        if start or end is not None:
+            params['Range'] = f'bytes={start}-{"" if end is None else end}'
+        body = self.client.get_object(**params)['Body']
+        try:
+            yield from body.iter_chunks(CHUNK_SIZE)
+        finally:
+            body.close()
+
+
+def persistent_storage_problem(config) -> Optional[str]:
+    """
+    Why the configured media store can't be trusted to keep blobs across
+    deploys and processes, or None when it is explicitly configured.
+    """
+    backend = (config.get('MEDIA_STORAGE_BACKEND') or '').lower()
+    if backend == 's3':
+        return None if config.get('MEDIA_S3_BUCKET') else 'MEDIA_STORAGE_BACKEND=s3 requires MEDIA_S3_BUCKET'
+    if backend == 'local':
+        if config.get('MEDIA_STORAGE_PATH'):
+            return None
+        return (
+            'MEDIA_STORAGE_BACKEND=local requires MEDIA_STORAGE_PATH on a persistent volume '
+            'shared by the web, webhook-worker and chat-worker processes'
+        )
+    if not backend:
+        return (
+            'MEDIA_STORAGE_BACKEND is not set - media would go to the instance folder, '
+            'which is lost on every deploy (set s3 + MEDIA_S3_*, or local + MEDIA_STORAGE_PATH)'
+        )
+    return f'Unknown MEDIA_STORAGE_BACKEND: {backend}'
+
+
+def _build_storage(app) -> MediaStorage:
+    backend = (app.config.get('MEDIA_STORAGE_BACKEND') or 'local').lower()
+    if backend == 's3':
+        return S3MediaStorage(
+            app.config['MEDIA_S3_BUCKET'],
+            prefix=app.config.get('MEDIA_S3_PREFIX') or '',
+            endpoint_url=app.config.get('MEDIA_S3_ENDPOINT_URL'),
+            region_name=app.config.get('MEDIA_S3_REGION'),
+            aws_access_key_id=app.config.get('MEDIA_S3_ACCESS_KEY_ID'),
+            aws_secret_access_key=app.config.get('MEDIA_S3_SECRET_ACCESS_KEY'),
+        )
+    if backend != 'local':
+        raise RuntimeError(f'Unknown MEDIA_STORAGE_BACKEND: {backend}')
+    return LocalMediaStorage(app.config.get('MEDIA_STORAGE_PATH') or os.path.join(app.instance_path, 'media'))
+
+
+def get_media_storage() -> MediaStorage:
+    """The app's configured storage backend (built once per app)."""
+    app = current_app._get_current_object()
+    storage = app.extensions.get('media_storage')
+    if storage is None:
+        storage = app.extensions['media_storage'] = _build_storage(app)
+    return storage
@@ -0,0 +1,26 @@
+"""
+Fast local estimate of how many tokens a piece of text costs a model.
+
+Used to pack conversation history into a token budget without a round trip
+to the provider or a model-specific tokenizer dependency. Byte-level BPE
+tokenizers average roughly 4 UTF-8 bytes per token on Portuguese text
+(accents and emoji take more bytes, and also more tokens), so the byte
+count is a cheap estimate that errs on the high side for chat messages.
+"""
+import math
+
+BYTES_PER_TOKEN = 4
+# Role marker and separators every chat message adds on top of its content
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text: str) -> int:
+    if not text:
+        return 0
+    return math.ceil(len(text.encode('utf-8')) / BYTES_PER_TOKEN)
+
+
+def estimate_message_tokens(message: dict) -> int:
+    """Estimated tokens of one {'role', 'content'} chat message."""
+    content = message.get('content')
+    return MESSAGE_OVERHEAD_TOKENS + estimate_tokens(content if isinstance(content, str) else str(content or ''))
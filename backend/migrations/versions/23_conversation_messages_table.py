@@ -0,0 +1,154 @@
+"""conversation_messages: append-only message table replacing conversations.messages JSONB
+
+Creates conversation_messages, backfills it from every conversation's JSONB
+array (preserving message ids, evolution ids, statuses and timestamps, in
+array order) and drops the old column. Downgrade rebuilds the JSONB arrays
+from the table.
+
+Revision ID: 23_conversation_messages
+Revises: 22_security_hardening
+Create Date: 2026-10-16
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+revision = '23_conversation_messages'
+down_revision = '22_security_hardening'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'conversation_messages',
+        sa.Column('id', sa.BigInteger(), primary_key=True, autoincrement=True),
+        sa.Column('message_id', sa.String(length=32), nullable=False),
+        sa.Column(
+            'conversation_id', postgresql.UUID(as_uuid=True),
+            sa.ForeignKey('conversations.id', ondelete='CASCADE'), nullable=False
+        ),
+        sa.Column(
+            'clinic_id', postgresql.UUID(as_uuid=True),
+            sa.ForeignKey('clinics.id', ondelete='CASCADE'), nullable=False
+        ),
+        sa.Column('evolution_id', sa.String(length=128), nullable=True),
+        sa.Column('role', sa.String(length=20), nullable=False),
+        sa.Column('content', sa.Text(), nullable=True),
+        sa.Column('message_type', sa.String(length=20), nullable=False, server_default='text'),
+        sa.Column('status', sa.String(length=20), nullable=False, server_default='sent'),
+        sa.Column('media_url', sa.Text(), nullable=True),
+        sa.Column('media_mimetype', sa.String(length=120), nullable=True),
+        sa.Column('caption', sa.Text(), nullable=True),
+        sa.Column('sent_via', sa.String(length=30), nullable=True),
+        sa.Column('timestamp', sa.DateTime(), nullable=False),
+    )
+
+    # Backfill in array order. Entries missing an id (very old data) or
+    # sharing one (after truncation to 32 chars) get a fresh hex id so the unique index below can be built;
+    # unparseable timestamps fall back to the conversation's own timestamps.
+    op.execute("""
+        INSERT INTO conversation_messages (
+            message_id, conversation_id, clinic_id, evolution_id, role, content,
+            message_type, status, media_url, media_mimetype, caption, sent_via, timestamp
+        )
+        SELECT
+            CASE
+                WHEN src.msg_id IS NULL OR src.dup_rank > 1
+                    THEN md5(src.conversation_id::text || ':' || src.ord::text)
+                ELSE src.msg_id
+            END,
+            src.conversation_id,
+            src.clinic_id,
+            left(src.value->>'evolution_id', 128),
+            COALESCE(src.value->>'role', 'user'),
+            src.value->>'content',
+            COALESCE(src.value->>'type', 'text'),
+            COALESCE(src.value->>'status', 'sent'),
+            src.value->>'media_url',
+            left(src.value->>'media_mimetype', 120),
+            src.value->>'caption',
+            src.value->>'sent_via',
+            COALESCE(
+                CASE
+                    WHEN src.value->>'timestamp' ~ '^\\d{4}-\\d{2}-\\d{2}T'
+                        THEN (rtrim(src.value->>'timestamp', 'Z'))::timestamp
+                END,
+                src.last_message_at,
+                src.created_at
+            )
+        FROM (
+            SELECT
+                c.id AS conversation_id,
+                c.clinic_id,
+                c.last_message_at,
+                c.created_at,
+                m.value,
+                m.ord,
+                -- Truncated to the column width before ranking, so ids that
+                -- only differ past 32 chars count as duplicates too
+                left(NULLIF(m.value->>'id', ''), 32) AS msg_id,
+                ROW_NUMBER() OVER (
+                    PARTITION BY left(NULLIF(m.value->>'id', ''), 32) ORDER BY c.id, m.ord
+                ) AS dup_rank
+            FROM conversations c
+            CROSS JOIN LATERAL jsonb_array_elements(
+                CASE WHEN jsonb_typeof(c.messages) = 'array' THEN c.messages ELSE '[]'::jsonb END
+            ) WITH ORDINALITY AS m(value, ord)
+        ) src
+        ORDER BY src.conversation_id, src.ord;
+    """)
+
+    op.create_index(
+        'ix_conversation_messages_message_id', 'conversation_messages', ['message_id'], unique=True
+    )
+    op.create_index(
+        'ix_conversation_messages_conversation_ts', 'conversation_messages',
+        ['conversation_id', 'timestamp', 'id']
+    )
+    op.create_index(
+        'ix_conversation_messages_conversation_evolution', 'conversation_messages',
+        ['conversation_id', 'evolution_id']
+    )
+
+    op.drop_column('conversations', 'messages')
+
+
+def downgrade():
+    op.add_column(
+        'conversations',
+        sa.Column('messages', postgresql.JSONB(astext_type=sa.Text()), nullable=True)
+    )
+    op.execute("""
+        UPDATE conversations c
+        SET messages = agg.messages
+        FROM (
+            SELECT
+                conversation_id,
+                jsonb_agg(
+                    jsonb_strip_nulls(jsonb_build_object(
+                        'id', message_id,
+                        'role', role,
+                        'content', content,
+                        'timestamp', to_char(timestamp, 'YYYY-MM-DD"T"HH24:MI:SS.US') || 'Z',
+                        'status', status,
+                        'type', message_type,
+                        'media_url', media_url,
+                        'media_mimetype', media_mimetype,
+                        'caption', caption,
+                        'sent_via', sent_via
+                    )) || jsonb_build_object('evolution_id', evolution_id)
+                    ORDER BY timestamp, id
+                ) AS messages
+            FROM conversation_messages
+            GROUP BY conversation_id
+        ) agg
+        WHERE agg.conversation_id = c.id;
+    """)
+    op.execute("UPDATE conversations SET messages = '[]'::jsonb WHERE messages IS NULL;")
+
+    op.drop_index('ix_conversation_messages_conversation_evolution', table_name='conversation_messages')
+    op.drop_index('ix_conversation_messages_conversation_ts', table_name='conversation_messages')
+    op.drop_index('ix_conversation_messages_message_id', table_name='conversation_messages')
+    op.drop_table('conversation_messages')
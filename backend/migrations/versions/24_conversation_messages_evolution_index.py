@@ -0,0 +1,27 @@
+"""conversation_messages: clinic-wide (clinic_id, evolution_id) index for ACK matching
+
+Delivery/read ACK webhooks only carry the WhatsApp message id; this index
+resolves it to the single message row without loading any conversation.
+
+Revision ID: 24_messages_evolution_index
+Revises: 23_conversation_messages
+Create Date: 2026-10-16
+"""
+from alembic import op
+
+
+revision = '24_messages_evolution_index'
+down_revision = '23_conversation_messages'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(
+        'ix_conversation_messages_clinic_evolution', 'conversation_messages',
+        ['clinic_id', 'evolution_id']
+    )
+
+
+def downgrade():
+    op.drop_index('ix_conversation_messages_clinic_evolution', table_name='conversation_messages')
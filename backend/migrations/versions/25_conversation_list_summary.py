@@ -0,0 +1,73 @@
+"""conversations: denormalized inbox summary columns
+
+Adds last_message_preview/role/type, unread_count and message_count, kept
+current on every message write, and backfills them from
+conversation_messages so the conversation list renders without touching
+the message table.
+
+Revision ID: 25_conversation_list_summary
+Revises: 24_messages_evolution_index
+Create Date: 2026-10-16
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '25_conversation_list_summary'
+down_revision = '24_messages_evolution_index'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('conversations', sa.Column('last_message_preview', sa.String(length=160), nullable=True))
+    op.add_column('conversations', sa.Column('last_message_role', sa.String(length=20), nullable=True))
+    op.add_column('conversations', sa.Column('last_message_type', sa.String(length=20), nullable=True))
+    op.add_column(
+        'conversations',
+        sa.Column('unread_count', sa.Integer(), nullable=False, server_default='0')
+    )
+    op.add_column(
+        'conversations',
+        sa.Column('message_count', sa.Integer(), nullable=False, server_default='0')
+    )
+
+    op.execute("""
+        UPDATE conversations c
+        SET message_count = agg.total,
+            unread_count = agg.unread
+        FROM (
+            SELECT
+                m.conversation_id,
+                COUNT(*) AS total,
+                COUNT(*) FILTER (
+                    WHERE m.role = 'user'
+                      AND (cv.last_read_at IS NULL OR m.timestamp > cv.last_read_at)
+                ) AS unread
+            FROM conversation_messages m
+            JOIN conversations cv ON cv.id = m.conversation_id
+            GROUP BY m.conversation_id
+        ) agg
+        WHERE agg.conversation_id = c.id;
+    """)
+    op.execute("""
+        UPDATE conversations c
+        SET last_message_preview = NULLIF(left(COALESCE(last.content, last.caption, ''), 160), ''),
+            last_message_role = last.role,
+            last_message_type = last.message_type
+        FROM (
+            SELECT DISTINCT ON (conversation_id)
+                conversation_id, content, caption, role, message_type
+            FROM conversation_messages
+            ORDER BY conversation_id, timestamp DESC, id DESC
+        ) last
+        WHERE last.conversation_id = c.id;
+    """)
+
+
+def downgrade():
+    op.drop_column('conversations', 'message_count')
+    op.drop_column('conversations', 'unread_count')
+    op.drop_column('conversations', 'last_message_type')
+    op.drop_column('conversations', 'last_message_role')
+    op.drop_column('conversations', 'last_message_preview')
@@ -0,0 +1,49 @@
+"""Full-text and trigram indexes for conversation search
+
+Portuguese tsvector GIN index over conversation_messages.content (ranked
+word search) plus pg_trgm GIN indexes on message content, patient name and
+phone numbers, so the inbox search's ILIKE '%term%' fallbacks are index
+scans instead of sequential scans over every message.
+
+The tsvector expression must match ConversationSearchService._message_match
+exactly for the planner to use the index.
+
+Revision ID: 26_conversation_search_indexes
+Revises: 25_conversation_list_summary
+Create Date: 2026-10-16
+"""
+from alembic import op
+
+
+revision = '26_conversation_search_indexes'
+down_revision = '25_conversation_list_summary'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm;')
+
+    op.execute("""
+        CREATE INDEX ix_conversation_messages_content_fts ON conversation_messages
+        USING gin (to_tsvector('portuguese', COALESCE(content, '')));
+    """)
+    op.execute("""
+        CREATE INDEX ix_conversation_messages_content_trgm ON conversation_messages
+        USING gin (content gin_trgm_ops);
+    """)
+    op.execute('CREATE INDEX ix_patients_name_trgm ON patients USING gin (name gin_trgm_ops);')
+    op.execute('CREATE INDEX ix_patients_phone_trgm ON patients USING gin (phone gin_trgm_ops);')
+    op.execute(
+        'CREATE INDEX ix_conversations_phone_number_trgm ON conversations '
+        'USING gin (phone_number gin_trgm_ops);'
+    )
+
+
+def downgrade():
+    op.execute('DROP INDEX IF EXISTS ix_conversations_phone_number_trgm;')
+    op.execute('DROP INDEX IF EXISTS ix_patients_phone_trgm;')
+    op.execute('DROP INDEX IF EXISTS ix_patients_name_trgm;')
+    op.execute('DROP INDEX IF EXISTS ix_conversation_messages_content_trgm;')
+    op.execute('DROP INDEX IF EXISTS ix_conversation_messages_content_fts;')
+    # pg_trgm is left installed: other objects may depend on it.
@@ -0,0 +1,88 @@
+"""Move media asset bytes out of Postgres into the content-addressed media store
+
+media_assets.data (bytea, up to 8MB per row) is replaced by sha256 + size;
+the bytes are written to the configured MediaStorage backend
+(MEDIA_STORAGE_BACKEND / MEDIA_STORAGE_PATH / MEDIA_S3_*). The upgrade
+refuses to run while there are blobs to copy and no persistent store is
+explicitly configured - the instance-folder fallback lives on the
+container's ephemeral disk and would lose every copied blob on the next
+deploy.
+
+Each blob is read back and checked against its hash before the row is
+pointed at it. The legacy data column is only made nullable here (new rows
+don't write it); it is dropped by 31_drop_media_assets_legacy_data once
+every copy has been verified again.
+
+Revision ID: 27_media_assets_content_store
+Revises: 26_conversation_search_indexes
+Create Date: 2026-10-16
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '27_media_assets_content_store'
+down_revision = '26_conversation_search_indexes'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 100
+
+
+def upgrade():
+    from flask import current_app
+    from app.utils.media_storage import content_hash, get_media_storage, persistent_storage_problem
+
+    op.add_column('media_assets', sa.Column('sha256', sa.String(length=64), nullable=True))
+    op.add_column('media_assets', sa.Column('size', sa.Integer(), nullable=True))
+    op.alter_column('media_assets', 'data', nullable=True)
+
+    bind = op.get_bind()
+    pending = bind.execute(sa.text('SELECT count(*) FROM media_assets WHERE sha256 IS NULL')).scalar()
+    if pending:
+        problem = persistent_storage_problem(current_app.config)
+        if problem:
+            raise RuntimeError(f'Refusing to move {pending} media blobs out of the database: {problem}')
+
+        storage = get_media_storage()
+        while True:
+            rows = bind.execute(sa.text(
+                'SELECT id, data FROM media_assets WHERE sha256 IS NULL LIMIT :n'
+            ), {'n': BATCH_SIZE}).fetchall()
+            if not rows:
+                break
+            for asset_id, data in rows:
+                data = bytes(data or b'')
+                sha256 = storage.put(data)
+                if content_hash(storage.get(sha256)) != sha256:
+                    raise RuntimeError(f'Media asset {asset_id} did not read back intact from the media store')
+                bind.execute(sa.text(
+                    'UPDATE media_assets SET sha256 = :sha, size = :size WHERE id = :id'
+                ), {'sha': sha256, 'size': len(data), 'id': asset_id})
+
+    op.alter_column('media_assets', 'sha256', nullable=False)
+    op.alter_column('media_assets', 'size', nullable=False)
+    op.create_index('ix_media_assets_sha256', 'media_assets', ['sha256'])
+
+
+def downgrade():
+    from app.utils.media_storage import get_media_storage
+
+    # Rows created after the upgrade only have their bytes in the store
+    storage = get_media_storage()
+    bind = op.get_bind()
+    while True:
+        rows = bind.execute(sa.text(
+            'SELECT id, sha256 FROM media_assets WHERE data IS NULL LIMIT :n'
+        ), {'n': BATCH_SIZE}).fetchall()
+        if not rows:
+            break
+        for asset_id, sha256 in rows:
+            bind.execute(sa.text(
+                'UPDATE media_assets SET data = :data WHERE id = :id'
+            ), {'data': storage.get(sha256), 'id': asset_id})
+
+    op.alter_column('media_assets', 'data', nullable=False)
+    op.drop_index('ix_media_assets_sha256', table_name='media_assets')
+    op.drop_column('media_assets', 'size')
+    op.drop_column('media_assets', 'sha256')
@@ -0,0 +1,51 @@
+"""Transcript cache for voice notes and cache-hit flag on AI usage logs
+
+audio_transcripts stores each successful transcription under (clinic,
+SHA-256 of the decoded audio, model) so identical audio is never sent to
+the transcription model twice. ai_usage_logs.cache_hit marks the zero-cost
+rows recorded for cache hits.
+
+Revision ID: 28_audio_transcript_cache
+Revises: 27_media_assets_content_store
+Create Date: 2026-10-16
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+revision = '28_audio_transcript_cache'
+down_revision = '27_media_assets_content_store'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'audio_transcripts',
+        sa.Column('id', postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column(
+            'clinic_id', postgresql.UUID(as_uuid=True),
+            sa.ForeignKey('clinics.id', ondelete='CASCADE'), nullable=False
+        ),
+        sa.Column('sha256', sa.String(length=64), nullable=False),
+        sa.Column('model', sa.String(length=100), nullable=False),
+        sa.Column('transcript', sa.Text(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+    )
+    op.create_index(
+        'ix_audio_transcripts_lookup', 'audio_transcripts',
+        ['clinic_id', 'sha256', 'model'], unique=True
+    )
+
+    op.add_column(
+        'ai_usage_logs',
+        sa.Column('cache_hit', sa.Boolean(), nullable=False, server_default=sa.false())
+    )
+
+
+def downgrade():
+    op.drop_column('ai_usage_logs', 'cache_hit')
+    op.drop_index('ix_audio_transcripts_lookup', table_name='audio_transcripts')
+    op.drop_table('audio_transcripts')
@@ -0,0 +1,29 @@
+"""Clinic config version for the compiled AI prompt cache
+
+clinics.config_version is bumped whenever anything the agent's system
+prompt is compiled from changes (clinic name/services/hours, professionals,
+pipeline stages); cached prompt bundles are keyed by it.
+
+Revision ID: 29_clinic_config_version
+Revises: 28_audio_transcript_cache
+Create Date: 2026-10-16
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '29_clinic_config_version'
+down_revision = '28_audio_transcript_cache'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        'clinics',
+        sa.Column('config_version', sa.Integer(), nullable=False, server_default='0')
+    )
+
+
+def downgrade():
+    op.drop_column('clinics', 'config_version')
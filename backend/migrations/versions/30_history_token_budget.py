@@ -0,0 +1,31 @@
+"""Token-budgeted agent history
+
+clinics.agent_history_token_budget overrides AGENT_HISTORY_TOKEN_BUDGET for
+a clinic (estimated tokens of recent messages sent verbatim each turn).
+ai_usage_logs.history_messages/history_tokens record how much history was
+packed into each agent call.
+
+Revision ID: 30_history_token_budget
+Revises: 29_clinic_config_version
+Create Date: 2026-10-16
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '30_history_token_budget'
+down_revision = '29_clinic_config_version'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('clinics', sa.Column('agent_history_token_budget', sa.Integer(), nullable=True))
+    op.add_column('ai_usage_logs', sa.Column('history_messages', sa.Integer(), nullable=True))
+    op.add_column('ai_usage_logs', sa.Column('history_tokens', sa.Integer(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('ai_usage_logs', 'history_tokens')
+    op.drop_column('ai_usage_logs', 'history_messages')
+    op.drop_column('clinics', 'agent_history_token_budget')
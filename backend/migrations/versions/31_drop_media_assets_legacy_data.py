@@ -0,0 +1,75 @@
+"""Drop media_assets.data once every blob is verified in the media store
+
+27_media_assets_content_store copied the bytes out of Postgres but kept
+the column. Before it is dropped, every row that still carries its legacy
+bytes is checked against the configured store: the blob must read back
+with the row's hash and match the bytes in the column. Any mismatch aborts
+the upgrade with the column intact.
+
+Revision ID: 31_drop_media_assets_legacy_data
+Revises: 30_history_token_budget
+Create Date: 2026-10-16
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '31_drop_media_assets_legacy_data'
+down_revision = '30_history_token_budget'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 100
+
+
+def upgrade():
+    from flask import current_app
+    from app.utils.media_storage import content_hash, get_media_storage, persistent_storage_problem
+
+    bind = op.get_bind()
+    pending = bind.execute(sa.text('SELECT count(*) FROM media_assets WHERE data IS NOT NULL')).scalar()
+    if pending:
+        problem = persistent_storage_problem(current_app.config)
+        if problem:
+            raise RuntimeError(f'Refusing to drop the bytes of {pending} media assets: {problem}')
+
+        storage = get_media_storage()
+        last_id = None
+        while True:
+            query = 'SELECT id, sha256, data FROM media_assets WHERE data IS NOT NULL'
+            params = {'n': BATCH_SIZE}
+            if last_id is not None:
+                query += ' AND id > :last_id'
+                params['last_id'] = last_id
+            rows = bind.execute(sa.text(query + ' ORDER BY id LIMIT :n'), params).fetchall()
+            if not rows:
+                break
+            for asset_id, sha256, data in rows:
+                try:
+                    stored = storage.get(sha256)
+                except Exception as e:
+                    raise RuntimeError(f'Media asset {asset_id} is missing from the media store') from e
+                if content_hash(stored) != sha256 or content_hash(bytes(data)) != sha256:
+                    raise RuntimeError(f'Media asset {asset_id} does not match its copy in the media store')
+            last_id = rows[-1][0]
+
+    op.drop_column('media_assets', 'data')
+
+
+def downgrade():
+    from app.utils.media_storage import get_media_storage
+
+    op.add_column('media_assets', sa.Column('data', sa.LargeBinary(), nullable=True))
+
+    storage = get_media_storage()
+    bind = op.get_bind()
+    while True:
+        rows = bind.execute(sa.text(
+            'SELECT id, sha256 FROM media_assets WHERE data IS NULL LIMIT :n'
+        ), {'n': BATCH_SIZE}).fetchall()
+        if not rows:
+            break
+        for asset_id, sha256 in rows:
+            bind.execute(sa.text(
+                'UPDATE media_assets SET data = :data WHERE id = :id'
+            ), {'data': storage.get(sha256), 'id': asset_id})
@@ -1,20 +1,22 @@
 """
 Tests for the AI cost/token-waste fixes: usage tracking (AiUsageLog),
 the tool-calling loop's iteration cap, prompt-caching request structure,
-model tiering for internal/classification tasks, and the short-TTL cache
-on redundant per-message DB lookups.
+model tiering for internal/classification tasks, the versioned prompt
+bundle (and the prompt text read from it), parallel read-only tool calls
+and their per-turn memo, the background handoff summary and the
+token-budgeted history window.
 """
 import json
+import threading
 from types import SimpleNamespace
 from unittest.mock import patch
 
 from app import db
-from app.models import AiUsageLog, AiUsageService, Professional, PipelineStage
-from app.services.claude_service import ClaudeService, MAX_TOOL_ROUNDS as CLAUDE_MAX_ROUNDS
+from app.models import AiUsageLog, AiUsageService, BotTransfer, Clinic, Professional, PipelineStage
+from app.services.claude_service import ClaudeService, ToolResultMemo, MAX_TOOL_ROUNDS as CLAUDE_MAX_ROUNDS
 from app.services.assistant_service import AssistantService, MAX_TOOL_ROUNDS as ASSISTANT_MAX_ROUNDS
 from app.services.conversation_service import ConversationService
 from app.utils.ai_usage import record_ai_usage
-from app.utils.cache import cache
 
 
 # ---------------------------------------------------------------------- #
@@ -96,6 +98,29 @@ class TestRecordAiUsage:
             assert AiUsageLog.query.count() >= 0
 
 
+class TestTranscriptCache:
+    def test_identical_audio_is_transcribed_once(self, app, sample_clinic):
+        import base64
+
+        with app.app_context():
+            sample_clinic.openrouter_api_key = 'test-key'
+            service = ClaudeService(sample_clinic)
+            audio = base64.b64encode(b'same-voice-note').decode()
+
+            patcher, mock_create = _mock_create(service)
+            try:
+                mock_create.return_value = FakeResponse('stop', content='quero remarcar')
+                first = service.transcribe_audio(audio, 'audio/ogg')
+                second = ClaudeService(sample_clinic).transcribe_audio(audio, 'audio/ogg')
+            finally:
+                patcher.stop()
+
+            assert first == second == 'quero remarcar'
+            assert mock_create.call_count == 1
+            logs = AiUsageLog.query.filter_by(clinic_id=sample_clinic.id, task='transcribe_audio').all()
+            assert sorted(log.cache_hit for log in logs) == [False, True]
+
+
 class TestClaudeServiceToolLoopCap:
     def test_stops_after_max_rounds_and_transfers_to_human(self, app, sample_clinic, sample_patient):
         with app.app_context():
@@ -187,6 +212,233 @@ class TestClaudeServicePromptCaching:
             db.session.commit()
 
 
+class TestPromptBundle:
+    def test_bundle_is_reused_until_config_changes(self, app, sample_clinic, sample_patient):
+        with app.app_context():
+            # This context has its own session: work on a clinic attached to
+            # it, so commits here flush (and refresh) the instance under test
+            clinic = db.session.get(Clinic, sample_clinic.id)
+            clinic.openrouter_api_key = 'test-key'
+            conversation = ConversationService(clinic).get_or_create_conversation(sample_patient.phone)
+            version = clinic.config_version
+
+            patcher = patch.object(ClaudeService, '_compile_prompt_bundle', autospec=True,
+                                   side_effect=ClaudeService._compile_prompt_bundle)
+            compile_mock = patcher.start()
+            try:
+                prompts = []
+                for _ in range(2):
+                    service = ClaudeService(clinic)
+                    create_patcher, mock_create = _mock_create(service)
+                    try:
+                        mock_create.return_value = FakeResponse('stop', content='ok')
+                        service.process_message(conversation, 'oi')
+                    finally:
+                        create_patcher.stop()
+                    prompts.append(mock_create.call_args.kwargs['messages'][0]['content'][0]['text'])
+                assert compile_mock.call_count == 1
+                assert prompts[0] == prompts[1]
+
+                professional = Professional(clinic_id=clinic.id, name='Dr. Versão', active=True)
+                db.session.add(professional)
+                db.session.commit()
+                assert clinic.config_version == version + 1
+
+                bundle = ClaudeService(clinic)._prompt_bundle()
+                assert compile_mock.call_count == 2
+                assert 'Dr. Versão' in bundle['static_block']
+            finally:
+                patcher.stop()
+
+            db.session.delete(professional)
+            db.session.commit()
+
+    def test_settings_change_bumps_config_version(self, app, sample_clinic):
+        with app.app_context():
+            clinic = db.session.get(Clinic, sample_clinic.id)
+            version = clinic.config_version
+            clinic.openrouter_api_key = 'unrelated-key'
+            db.session.commit()
+            assert clinic.config_version == version
+
+            clinic.services = [{'name': 'Clareamento', 'duration': 60}]
+            db.session.commit()
+            assert clinic.config_version == version + 1
+
+    def test_bundle_is_returned_as_a_copy(self, app, sample_clinic):
+        with app.app_context():
+            clinic = db.session.get(Clinic, sample_clinic.id)
+            clinic.openrouter_api_key = 'test-key'
+            service = ClaudeService(clinic)
+            bundle = service._prompt_bundle()
+            bundle['tools'].pop()
+            bundle['prompt_vars']['clinic_name'] = 'changed'
+
+            fresh = service._prompt_bundle()
+            assert len(fresh['tools']) == len(bundle['tools']) + 1
+            assert fresh['prompt_vars']['clinic_name'] == sample_clinic.name
+
+
+class TestParallelToolCalls:
+    def test_read_only_calls_run_in_pool_and_writes_stay_inline(self, app, sample_clinic, sample_patient):
+        with app.app_context():
+            sample_clinic.openrouter_api_key = 'test-key'
+            conversation = ConversationService(sample_clinic).get_or_create_conversation(sample_patient.phone)
+            service = ClaudeService(sample_clinic)
+            ran_on = {}
+
+            def fake_execute(self, tool_name, tool_input, conversation):
+                label = f"{tool_name}:{tool_input.get('date', '')}"
+                ran_on[label] = threading.current_thread().name
+                return label
+
+            calls = [
+                ('check_availability', {'date': '2030-01-07'}),
+                ('check_availability', {'date': '2030-01-08'}),
+                ('cancel_appointment', {'appointment_id': 'x'}),
+                ('list_professionals', {}),
+            ]
+            app.config['AGENT_PARALLEL_TOOLS'] = True
+            try:
+                with patch.object(ClaudeService, '_execute_tool', fake_execute):
+                    results = service._run_tool_calls(calls, conversation)
+            finally:
+                app.config['AGENT_PARALLEL_TOOLS'] = False
+
+            assert results == [
+                'check_availability:2030-01-07', 'check_availability:2030-01-08',
+                'cancel_appointment:', 'list_professionals:',
+            ]
+            caller = threading.current_thread().name
+            assert ran_on['check_availability:2030-01-07'].startswith('agent-tool')
+            assert ran_on['check_availability:2030-01-08'].startswith('agent-tool')
+            # mutating tools, and a lone read-only call, run on the caller's session
+            assert ran_on['cancel_appointment:'] == caller
+            assert ran_on['list_professionals:'] == caller
+
+
+class TestToolResultMemo:
+    def test_repeats_are_memoized_until_an_appointment_changes(self, app, sample_clinic, sample_patient):
+        with app.app_context():
+            sample_clinic.openrouter_api_key = 'test-key'
+            conversation = ConversationService(sample_clinic).get_or_create_conversation(sample_patient.phone)
+            service = ClaudeService(sample_clinic)
+            executed = []
+
+            def fake_execute(self, tool_name, tool_input, conversation):
+                executed.append(tool_name)
+                return f'{tool_name} #{len(executed)}'
+
+            memo = ToolResultMemo()
+            with patch.object(ClaudeService, '_execute_tool', fake_execute):
+                first = service._run_tool_calls([
+                    ('check_availability', {'date': '2030-01-07', 'professional_name': 'Dra. Ana'}),
+                    ('check_availability', {'date': '2030-01-07', 'professional_name': ' dra. ana '}),
+                ], conversation, memo)
+                second = service._run_tool_calls([
+                    ('check_availability', {'date': '2030-01-07', 'professional_name': 'Dra. Ana'}),
+                    ('cancel_appointment', {'appointment_id': 'x'}),
+                    ('check_availability', {'date': '2030-01-07', 'professional_name': 'Dra. Ana'}),
+                ], conversation, memo)
+
+            assert first == ['check_availability #1', 'check_availability #1']
+            assert second == ['check_availability #1', 'cancel_appointment #2', 'check_availability #3']
+            assert executed == ['check_availability', 'cancel_appointment', 'check_availability']
+            assert memo.calls == 5
+            assert memo.hits == 2
+
+
+class TestHandoffSummary:
+    def test_summary_is_attached_to_the_transfer_and_published(self, app, sample_clinic, sample_patient):
+        with app.app_context():
+            sample_clinic.openrouter_api_key = 'test-key'
+            conversation = ConversationService(sample_clinic).get_or_create_conversation(sample_patient.phone)
+            ConversationService(sample_clinic).add_message(conversation, 'user', 'estou com muita dor')
+            service = ClaudeService(sample_clinic)
+
+            with patch.object(ClaudeService, 'summarize_conversation_for_handoff',
+                              return_value='- Paciente com dor forte') as summarize, \
+                    patch('app.services.summary_pipeline.publish_event') as publish:
+                result = service._tool_transfer_to_human({'reason': 'dor'}, conversation)
+
+            assert result == 'Conversa transferida para atendimento humano.'
+            summarize.assert_called_once()
+            transfer = BotTransfer.query.filter_by(conversation_id=conversation.id).one()
+            assert transfer.summary == '- Paciente com dor forte'
+            publish.assert_called_once()
+            event_type, payload = publish.call_args.args[1:]
+            assert event_type == 'transfer_summary'
+            assert payload['transfer_id'] == str(transfer.id)
+
+
+class TestHistoryWindow:
+    def test_packs_recent_messages_within_the_token_budget(self, app, sample_clinic, sample_patient):
+        with app.app_context():
+            conversation_service = ConversationService(sample_clinic)
+            conversation = conversation_service.get_or_create_conversation(sample_patient.phone)
+            conversation_service.add_message(conversation, 'user', 'texto colado ' * 400)
+            for i in range(6):
+                conversation_service.add_message(conversation, 'user' if i % 2 == 0 else 'assistant', f'mensagem {i}')
+
+            window = conversation_service.get_history_window(conversation, token_budget=500)
+
+            assert [m['content'] for m in window['messages']] == [f'mensagem {i}' for i in range(6)]
+            assert window['start'] == conversation.message_count - 6
+            assert 0 < window['tokens'] <= 500
+
+    def test_newest_message_is_kept_even_over_budget(self, app, sample_clinic, sample_patient):
+        with app.app_context():
+            conversation_service = ConversationService(sample_clinic)
+            conversation = conversation_service.get_or_create_conversation(sample_patient.phone)
+            conversation_service.add_message(conversation, 'user', 'oi')
+            conversation_service.add_message(conversation, 'user', 'texto colado ' * 400)
+
+            window = conversation_service.get_history_window(conversation, token_budget=500)
+
+            assert len(window['messages']) == 1
+            assert window['start'] == conversation.message_count - 1
+
+    def test_turn_records_history_size_in_usage_log(self, app, sample_clinic, sample_patient):
+        with app.app_context():
+            sample_clinic.openrouter_api_key = 'test-key'
+            service = ClaudeService(sample_clinic)
+            conversation = ConversationService(sample_clinic).get_or_create_conversation(sample_patient.phone)
+
+            patcher, mock_create = _mock_create(service)
+            try:
+                mock_create.return_value = FakeResponse('stop', content='ok')
+                service.process_message(conversation, 'quero marcar uma limpeza')
+            finally:
+                patcher.stop()
+
+            log = AiUsageLog.query.filter_by(clinic_id=sample_clinic.id, task='process_message').one()
+            assert log.history_messages == 1
+            assert log.history_tokens > 0
+
+    def test_rolling_summary_covers_everything_since_summary_upto(self, app, sample_clinic, sample_patient):
+        with app.app_context():
+            sample_clinic.openrouter_api_key = 'test-key'
+            service = ClaudeService(sample_clinic)
+            conversation_service = ConversationService(sample_clinic)
+            conversation = conversation_service.get_or_create_conversation(sample_patient.phone)
+            for i in range(130):
+                conversation_service.add_message(conversation, 'user' if i % 2 == 0 else 'assistant', f'mensagem {i}')
+            conversation_service.update_context(conversation, {'summary': 'resumo inicial', 'summary_upto': 5})
+
+            with patch('app.services.claude_service.SUMMARY_CHUNK_MESSAGES', 50), \
+                    patch.object(ClaudeService, '_complete', side_effect=['resumo 1', 'resumo 2', 'resumo 3']) as complete:
+                service.refresh_rolling_summary(conversation, 125)
+
+            transcripts = [c.args[1] for c in complete.call_args_list]
+            assert len(transcripts) == 3
+            assert 'resumo inicial' in transcripts[0] and 'Assistente: mensagem 5' in transcripts[0]
+            assert 'mensagem 4\n' not in transcripts[0]
+            assert 'resumo 1' in transcripts[1] and 'mensagem 55' in transcripts[1]
+            assert 'mensagem 124' in transcripts[2] and 'mensagem 125' not in transcripts[2]
+            assert conversation.context['summary'] == 'resumo 3'
+            assert conversation.context['summary_upto'] == 125
+
+
 class TestClaudeServiceModelTiering:
     def test_classify_conversation_funnel_uses_light_model(self, app, sample_clinic, sample_patient):
         with app.app_context():
@@ -224,6 +476,18 @@ class TestClaudeServiceModelTiering:
             assert mock_create.call_args.kwargs['model'] == app.config['OPENROUTER_MODEL']
 
 
+class TestSharedOpenRouterClient:
+    def test_services_reuse_one_client_per_key(self, app, sample_clinic):
+        with app.app_context():
+            sample_clinic.openrouter_api_key = 'shared-key'
+            first = ClaudeService(sample_clinic)
+            assert ClaudeService(sample_clinic).client is first.client
+            assert AssistantService(sample_clinic).client is first.client
+
+            sample_clinic.openrouter_api_key = 'other-key'
+            assert ClaudeService(sample_clinic).client is not first.client
+
+
 class TestAssistantServiceToolLoopCap:
     def test_stops_after_max_rounds(self, app, sample_clinic):
         with app.app_context():
@@ -278,49 +542,38 @@ class TestAssistantServicePromptCaching:
             db.session.commit()
 
 
-class TestShortTtlDbCache:
-    def test_professionals_text_is_cached_across_calls(self, app, sample_clinic):
+class TestPromptTextFromBundle:
+    def test_professionals_text_follows_config_changes(self, app, sample_clinic):
         with app.app_context():
-            cache.clear()
-            from app.services.claude_service import _cached_active_professionals_text
-
-            professional = Professional(clinic_id=sample_clinic.id, name='Dra. Cache', active=True)
+            clinic = db.session.get(Clinic, sample_clinic.id)
+            clinic.openrouter_api_key = 'test-key'
+            professional = Professional(clinic_id=clinic.id, name='Dra. Bundle', active=True)
             db.session.add(professional)
             db.session.commit()
 
-            first = _cached_active_professionals_text(str(sample_clinic.id))
-            assert 'Dra. Cache' in first
+            assert 'Dra. Bundle' in ClaudeService(clinic)._format_professionals()
 
-            # Deactivate without invalidating the cache - a cache hit should
-            # still return the stale (pre-deactivation) text within the TTL.
+            # No TTL to wait out: the deactivation bumps the config version
             professional.active = False
             db.session.commit()
-
-            second = _cached_active_professionals_text(str(sample_clinic.id))
-            assert second == first
+            assert 'Dra. Bundle' not in ClaudeService(clinic)._format_professionals()
 
             db.session.delete(professional)
             db.session.commit()
-            cache.clear()
 
-    def test_pipeline_stages_text_is_cached_across_calls(self, app, sample_clinic):
+    def test_pipeline_stages_text_follows_config_changes(self, app, sample_clinic):
         with app.app_context():
-            cache.clear()
-            from app.services.claude_service import _cached_pipeline_stages_text
-
-            stage = PipelineStage(clinic_id=sample_clinic.id, name='Estágio Cache', order=0)
+            clinic = db.session.get(Clinic, sample_clinic.id)
+            clinic.openrouter_api_key = 'test-key'
+            stage = PipelineStage(clinic_id=clinic.id, name='Estágio Bundle', order=0)
             db.session.add(stage)
             db.session.commit()
 
-            first = _cached_pipeline_stages_text(str(sample_clinic.id))
-            assert 'Estágio Cache' in first
+            assert 'Estágio Bundle' in ClaudeService(clinic)._format_pipeline_stages()
 
             stage.name = 'Nome Alterado'
             db.session.commit()
-
-            second = _cached_pipeline_stages_text(str(sample_clinic.id))
-            assert second == first  # still the cached, pre-rename value
+            assert 'Nome Alterado' in ClaudeService(clinic)._format_pipeline_stages()
 
             db.session.delete(stage)
             db.session.commit()
-            cache.clear()
@@ -17,7 +17,7 @@ from unittest.mock import patch
 from app.utils.datetime_utils import utcnow
 from app import db
 from app.models import (
-    AssistantConversation, AssistantMemory, Patient, PipelineStage,
+    AssistantConversation, AssistantMemory, Conversation, Patient, PipelineStage,
     Appointment, AppointmentStatus, Professional,
 )
 from app.services.assistant_service import AssistantService
@@ -227,6 +227,30 @@ class TestAssistantServiceTools:
             db.session.delete(stage)
             db.session.commit()
 
+    def test_get_conversation_transcript_by_topic(self, app, sample_clinic, sample_patient):
+        with app.app_context():
+            conversation = Conversation(
+                clinic_id=sample_clinic.id, patient_id=sample_patient.id,
+                phone_number=sample_patient.phone, context={}
+            )
+            db.session.add(conversation)
+            db.session.commit()
+            conversation.add_message('user', 'Bom dia')
+            conversation.add_message('user', 'Quanto custa o Clareamento dental?')
+            db.session.commit()
+
+            sample_clinic.openrouter_api_key = 'test-key'
+            service = AssistantService(sample_clinic)
+            result = json.loads(service._tool_get_conversation_transcript({'query': 'clareamento'}))
+
+            assert result['matches'][0]['patient_name'] == 'Test Patient'
+            assert 'Clareamento' in result['matches'][0]['snippet']
+            assert [m['content'] for m in result['transcript']][0] == 'Bom dia'
+            assert 'Nenhuma conversa' in service._tool_get_conversation_transcript({'query': 'implante'})
+
+            db.session.delete(conversation)
+            db.session.commit()
+
     def test_get_billing_status(self, app, sample_clinic):
         with app.app_context():
             sample_clinic.openrouter_api_key = 'test-key'
@@ -154,3 +154,82 @@ class TestMetricsCollector:
             assert 'no_show_rate' in metrics['appointments']
             assert 'top_services' in metrics
             assert isinstance(metrics['top_services'], list)
+
+
+class TestBulkSend:
+    """Concurrent, paced bulk sends used by reminder runs and batch outreach."""
+
+    def test_fans_out_with_bounded_concurrency(self, app, sample_clinic, monkeypatch):
+        import asyncio
+
+        from app.services.evolution_service import EvolutionService
+
+        state = {'in_flight': 0, 'peak': 0, 'calls': []}
+
+        async def fake_send(self, client, phone, message):
+            state['calls'].append(phone)
+            state['in_flight'] += 1
+            state['peak'] = max(state['peak'], state['in_flight'])
+            await asyncio.sleep(0.02)
+            state['in_flight'] -= 1
+            if phone == '5511900000003' and state['calls'].count(phone) == 1:
+                return {'error': '503 Service Unavailable', 'status_code': 503}
+            return {'key': {'id': f'BULK_{phone}'}}
+
+        monkeypatch.setattr(EvolutionService, 'send_message_async', fake_send)
+        monkeypatch.setattr('app.services.outbound_queue.random.uniform', lambda a, b: 0)
+
+        with app.app_context():
+            phones = [f'551190000000{i}' for i in range(6)]
+            results = EvolutionService(sample_clinic).send_messages_bulk(
+                [(phone, 'Lembrete') for phone in phones], concurrency=2
+            )
+
+        assert [r['key']['id'] for r in results] == [f'BULK_{phone}' for phone in phones]
+        assert state['peak'] == 2
+        # The transient 503 was retried
+        assert state['calls'].count('5511900000003') == 2
+
+    def test_retry_past_the_time_budget_is_deferred(self, app, sample_clinic, monkeypatch):
+        import time
+
+        from app.services import outbound_queue
+        from app.services.evolution_service import EvolutionService
+
+        calls = []
+
+        async def fake_send(self, client, phone, message):
+            calls.append(phone)
+            return {'error': '429 Too Many Requests', 'status_code': 429, 'retry_after': 30}
+
+        monkeypatch.setattr(EvolutionService, 'send_message_async', fake_send)
+
+        with app.app_context():
+            started = time.monotonic()
+            results = outbound_queue.send_bulk(
+                [(EvolutionService(sample_clinic), '5511900000001', 'Lembrete')], time_budget=5,
+            )
+
+        # The 30s back-off would overrun the budget: deferred instead of slept on
+        assert results[0]['deferred'] is True
+        assert calls == ['5511900000001']
+        assert time.monotonic() - started < 5
+
+    def test_proactive_batch_past_deadline_leaves_requests_for_next_run(self, app, sample_clinic, monkeypatch):
+        import time
+
+        with app.app_context():
+            clinic = db.session.get(Clinic, sample_clinic.id)
+            patient = Patient(clinic_id=clinic.id, name='Ana Souza', phone='5511977776666')
+            db.session.add(patient)
+            db.session.commit()
+
+            service = OutreachService(clinic)
+            monkeypatch.setattr(service, '_compose', lambda **kw: pytest.fail('composed past the deadline'))
+            outcomes = service.send_proactive_batch(
+                [{'patient': patient, 'objective': 'retorno', 'action_type': AgentActionType.RECALL}],
+                deadline=time.monotonic() - 1,
+            )
+
+            assert outcomes == [None]
+            assert AgentAction.query.filter_by(patient_id=patient.id).count() == 0
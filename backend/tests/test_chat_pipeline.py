@@ -11,6 +11,7 @@ import base64
 import hashlib
 import hmac
 import json
+import time
 from unittest.mock import patch
 
 import pytest
@@ -73,6 +74,108 @@ class TestWebhookIdempotency:
         # And the AI replied exactly once
         assert MockClaude.return_value.process_message.call_count == 1
 
+    def test_redis_claim_answers_duplicates_before_the_database(self, app, db_session, wa_clinic):
+        from unittest.mock import MagicMock
+        from sqlalchemy import event
+
+        client = MagicMock()
+        client.set.return_value = None  # SET NX lost: already seen
+        client.get.return_value = b'done'
+        statements = []
+
+        def count(*args, **kwargs):
+            statements.append(args)
+
+        with patch('app.services.webhook_dedup._get_redis_client', return_value=client):
+            event.listen(db.engine, 'before_cursor_execute', count)
+            try:
+                response = post_webhook(app, text_upsert('pipe-instance', '5511900010012', 'oi', 'RDUP_1'))
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', count)
+
+        assert response.get_json()['status'] == 'duplicate'
+        assert statements == []
+
+    def test_stale_processing_claim_falls_back_to_the_database(self, app, db_session, wa_clinic):
+        """A delivery whose handler died mid-processing must not be acked as a duplicate."""
+        from unittest.mock import MagicMock
+
+        client = MagicMock()
+        client.set.return_value = None       # key exists...
+        client.get.return_value = b'processing'  # ...but was never completed
+
+        with patch('app.services.webhook_dedup._get_redis_client', return_value=client), \
+             patch('app.services.message_processor.ClaudeService') as MockClaude, \
+             patch('app.services.message_processor.EvolutionService') as MockEvo:
+            MockClaude.return_value.process_message.return_value = 'Olá!'
+            MockEvo.return_value.send_message.return_value = {'key': {'id': 'REPLY_STALE'}}
+            response = post_webhook(app, text_upsert('pipe-instance', '5511900010014', 'oi', 'RDUP_3'))
+
+        assert response.status_code == 200
+        assert response.get_json().get('status') != 'duplicate'
+        conversation = Conversation.query.filter_by(
+            clinic_id=wa_clinic.id, phone_number='5511900010014'
+        ).first()
+        assert [m['content'] for m in conversation.messages if m['role'] == 'user'] == ['oi']
+        # Not our claim to release
+        client.delete.assert_not_called()
+
+    def test_failed_handling_releases_the_claim(self, app, db_session, wa_clinic):
+        from unittest.mock import MagicMock
+
+        client = MagicMock()
+        client.set.return_value = True
+        client.get.return_value = b'processing'
+
+        with patch('app.services.webhook_dedup._get_redis_client', return_value=client), \
+             patch('app.routes.webhook.ConversationService', side_effect=RuntimeError('db down')):
+            response = post_webhook(app, text_upsert('pipe-instance', '5511900010013', 'oi', 'RDUP_2'))
+
+        assert response.status_code == 500
+        # The retry must not be mistaken for a duplicate
+        client.delete.assert_called_once_with('sdental:webhook:seen:pipe-instance:RDUP_2')
+
+    def test_unmatched_instance_is_not_marked_done(self, app, db_session, wa_clinic):
+        """A 404 stored nothing: the redelivery (once the instance is linked) is processed."""
+        class FakeRedis:
+            def __init__(self):
+                self.keys = {}
+
+            def set(self, key, value, nx=False, ex=None):
+                if nx and key in self.keys:
+                    return None
+                self.keys[key] = value.encode()
+                return True
+
+            def get(self, key):
+                return self.keys.get(key)
+
+            def delete(self, key):
+                self.keys.pop(key, None)
+
+        client = FakeRedis()
+        payload = text_upsert('unlinked-instance', '5511900010015', 'oi', 'RDUP_404')
+
+        with patch('app.services.webhook_dedup._get_redis_client', return_value=client), \
+             patch('app.services.message_processor.ClaudeService') as MockClaude, \
+             patch('app.services.message_processor.EvolutionService') as MockEvo:
+            MockClaude.return_value.process_message.return_value = 'Olá!'
+            MockEvo.return_value.send_message.return_value = {'key': {'id': 'REPLY_404'}}
+
+            first = post_webhook(app, payload)
+            assert first.status_code == 404
+
+            wa_clinic.evolution_instance_name = 'unlinked-instance'
+            db.session.commit()
+            second = post_webhook(app, payload)
+
+        assert second.status_code == 200
+        assert second.get_json()['status'] != 'duplicate'
+        conversation = Conversation.query.filter_by(
+            clinic_id=wa_clinic.id, phone_number='5511900010015'
+        ).first()
+        assert [m['content'] for m in conversation.messages if m['role'] == 'user'] == ['oi']
+
     def test_own_api_echo_does_not_pause_bot(self, app, db_session, wa_clinic):
         """The webhook echo of a bot reply must not be treated as a human takeover."""
         with patch('app.services.message_processor.ClaudeService') as MockClaude, \
@@ -113,6 +216,248 @@ class TestWebhookIdempotency:
         assert reply['evolution_id'] == 'ECHO_10'
 
 
+class TestAsyncIngest:
+    def test_queued_payload_returns_202(self, app, db_session, wa_clinic):
+        app.config['WEBHOOK_ASYNC_INGEST'] = True
+        try:
+            with patch('app.routes.webhook.webhook_queue.enqueue', return_value='1-0') as mock_enqueue:
+                response = post_webhook(app, text_upsert('pipe-instance', '5511900010020', 'oi', 'Q_1'))
+        finally:
+            app.config['WEBHOOK_ASYNC_INGEST'] = False
+
+        assert response.status_code == 202
+        mock_enqueue.assert_called_once()
+        # Nothing is stored until the worker runs
+        assert Conversation.query.filter_by(
+            clinic_id=wa_clinic.id, phone_number='5511900010020'
+        ).first() is None
+
+    def test_without_redis_processes_inline(self, app, db_session, wa_clinic):
+        wa_clinic.agent_enabled = False
+        db.session.commit()
+        app.config['WEBHOOK_ASYNC_INGEST'] = True
+        try:
+            response = post_webhook(app, text_upsert('pipe-instance', '5511900010021', 'oi', 'Q_2'))
+        finally:
+            app.config['WEBHOOK_ASYNC_INGEST'] = False
+            wa_clinic.agent_enabled = True
+            db.session.commit()
+
+        assert response.status_code == 200
+        assert response.get_json()['status'] == 'stored'
+
+    def test_worker_acks_processed_entries_and_keeps_failures_pending(self, app, db_session, wa_clinic):
+        from unittest.mock import MagicMock
+        from app.services.webhook_queue import WebhookWorker, partition_for
+
+        payload = text_upsert('pipe-instance', '5511900010022', 'oi', 'Q_3')
+        # Same chat -> same partition, whatever the message
+        assert partition_for(payload, 8) == partition_for(
+            text_upsert('pipe-instance', '5511900010022', 'outra', 'Q_4'), 8
+        )
+
+        client = MagicMock()
+        client.hincrby.return_value = 1
+        fields = {b'payload': json.dumps(payload).encode()}
+
+        worker = WebhookWorker(app, lambda p: True, threads=1)
+        assert worker._handle_entry(client, 'stream', b'1-0', fields) is True
+        client.xack.assert_called_once()
+
+        client.reset_mock()
+        client.hincrby.return_value = 1
+        failing = WebhookWorker(app, lambda p: False, threads=1)
+        assert failing._handle_entry(client, 'stream', b'2-0', fields) is False
+        client.xack.assert_not_called()
+
+        # Out of attempts: dead-lettered and acknowledged
+        client.hincrby.return_value = failing.max_attempts
+        assert failing._handle_entry(client, 'stream', b'2-0', fields) is True
+        client.xadd.assert_called_once()
+        client.xack.assert_called_once()
+
+    def test_queued_payload_handler_runs_webhook_logic(self, app, db_session, wa_clinic):
+        from app.routes.webhook import handle_queued_payload
+
+        wa_clinic.agent_enabled = False
+        db.session.commit()
+        try:
+            ok = handle_queued_payload(text_upsert('pipe-instance', '5511900010023', 'fila', 'Q_5'))
+        finally:
+            wa_clinic.agent_enabled = True
+            db.session.commit()
+
+        assert ok is True
+        conversation = Conversation.query.filter_by(
+            clinic_id=wa_clinic.id, phone_number='5511900010023'
+        ).first()
+        assert conversation.last_message_preview == 'fila'
+
+
+class TestReplyQueue:
+    def test_reply_is_handed_to_chat_worker(self, app, db_session, wa_clinic):
+        from app.services import message_processor
+
+        app.config.update(CHAT_WORKER_QUEUE=True, MESSAGE_AGGREGATION_SECONDS=0.01)
+        try:
+            with patch('app.services.message_processor.reply_queue.enqueue', return_value='1-0') as mock_enqueue, \
+                 patch('app.services.message_processor._executor') as mock_executor, \
+                 patch('app.services.message_processor.ClaudeService') as MockClaude, \
+                 patch('app.services.message_processor.EvolutionService') as MockEvo:
+                MockClaude.return_value.process_message.return_value = 'Oi! Em que posso ajudar?'
+                MockEvo.return_value.send_message.return_value = {'key': {'id': 'RQ_REPLY'}}
+
+                response = post_webhook(app, text_upsert('pipe-instance', '5511900010030', 'oi', 'RQ_1'))
+                assert response.get_json()['mode'] == 'scheduled'
+
+                # The dispatcher hands the job over once the window ends
+                deadline = time.time() + 2
+                while not mock_enqueue.called and time.time() < deadline:
+                    time.sleep(0.01)
+                # Only the typing indicator ran in the web process
+                assert mock_executor.submit.call_count == 1
+                MockClaude.return_value.process_message.assert_not_called()
+
+                job = mock_enqueue.call_args.args[0]
+                message_processor.run_reply_job(job)
+        finally:
+            app.config.update(CHAT_WORKER_QUEUE=False, MESSAGE_AGGREGATION_SECONDS=0.0)
+
+        MockClaude.return_value.process_message.assert_called_once()
+        MockEvo.return_value.send_message.assert_called_once()
+
+
+class TestReplyTimers:
+    def test_new_messages_push_the_deadline_back_up_to_the_cap(self):
+        from app.services.message_processor import _LocalTimers, _MAX_WAIT_EXTENSION
+
+        timers = _LocalTimers()
+        assert timers.schedule('c1', {'phone': '1'}, window=0.05) is True
+        assert timers.schedule('c1', {'phone': '1'}, window=0.05) is False
+        assert timers.pop_due() == []
+
+        time.sleep(0.06)
+        assert timers.pop_due() == ['c1']
+        assert timers.take_meta('c1') == {'phone': '1'}
+
+        # A long window can't push a burst past the cap
+        timers.schedule('c2', {}, window=_MAX_WAIT_EXTENSION * 10)
+        assert timers._due['c2'] <= time.time() + _MAX_WAIT_EXTENSION
+
+
+class TestOutboundQueue:
+    def test_lower_lanes_leave_tokens_for_replies(self, app):
+        from app.services.outbound_queue import Lane, _try_take
+
+        app.config.update(EVOLUTION_SEND_RATE=0.001, EVOLUTION_SEND_BURST=3)
+        try:
+            with app.app_context():
+                assert _try_take('lane-instance', Lane.OUTREACH) == 0
+                assert _try_take('lane-instance', Lane.OUTREACH) > 0
+                assert _try_take('lane-instance', Lane.REMINDER) == 0
+                assert _try_take('lane-instance', Lane.REPLY) == 0
+        finally:
+            app.config.update(EVOLUTION_SEND_RATE=1000.0, EVOLUTION_SEND_BURST=1000)
+
+    def test_rate_limited_send_is_retried_and_recorded(self, app, db_session, wa_clinic):
+        with patch('app.services.message_processor.ClaudeService') as MockClaude, \
+             patch('app.services.message_processor.EvolutionService') as MockEvo, \
+             patch('app.services.outbound_queue.time.sleep') as mock_sleep:
+            MockClaude.return_value.process_message.return_value = 'Tenho às 9h.'
+            MockEvo.return_value.instance_name = 'pipe-instance'
+            MockEvo.return_value.send_message.side_effect = [
+                {'error': '429 Too Many Requests', 'status_code': 429, 'retry_after': 2},
+                {'key': {'id': 'PACED_1'}},
+            ]
+
+            post_webhook(app, text_upsert('pipe-instance', '5511900010040', 'tem horário?', 'PACE_1'))
+
+        assert MockEvo.return_value.send_message.call_count == 2
+        mock_sleep.assert_any_call(2)
+        db.session.expire_all()
+        conversation = Conversation.query.filter_by(
+            clinic_id=wa_clinic.id, phone_number='5511900010040'
+        ).first()
+        reply = conversation.messages[-1]
+        assert reply['evolution_id'] == 'PACED_1'
+        assert reply['status'] == 'sent'
+
+
+class TestFairReplyPool:
+    def test_busy_clinic_does_not_starve_others(self, app):
+        import threading
+
+        from app.services.reply_queue import LocalReplyPool, clinic_queue_stats
+
+        gate = threading.Event()
+        done = threading.Semaphore(0)
+        order = []
+
+        def handler(job):
+            gate.wait(2)
+            order.append(job['clinic_id'])
+            done.release()
+
+        pool = LocalReplyPool(app, handler, threads=1)
+        for _ in range(6):
+            pool.submit({'clinic_id': 'busy-clinic', 'conversation_id': 'x'})
+        time.sleep(0.05)  # first job taken and blocked on the gate
+        for _ in range(2):
+            pool.submit({'clinic_id': 'quiet-clinic', 'conversation_id': 'y'})
+        gate.set()
+        for _ in range(8):
+            assert done.acquire(timeout=2)
+
+        # The quiet clinic's replies interleave instead of waiting out the burst
+        assert order[:5].count('quiet-clinic') == 2
+        with app.app_context():
+            assert clinic_queue_stats('quiet-clinic')['jobs'] == 2
+
+
+class TestInstanceCache:
+    def test_unknown_instance_presence_skips_database(self, app, db_session, wa_clinic):
+        from sqlalchemy import event
+
+        payload = {
+            'event': 'presence.update',
+            'instance': 'ghost-instance',
+            'data': {'id': '5511900010030@s.whatsapp.net', 'presences': {}},
+        }
+        post_webhook(app, payload)  # first one resolves (and caches) the miss
+
+        statements = []
+
+        def count(*args, **kwargs):
+            statements.append(args)
+
+        event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            response = post_webhook(app, payload)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count)
+
+        assert response.get_json()['reason'] == 'Clinic not found'
+        assert statements == []
+
+    def test_clinic_changes_invalidate_entry(self, app, db_session, wa_clinic):
+        from app.services.instance_cache import lookup_instance
+
+        assert lookup_instance('pipe-instance')['active'] is True
+
+        wa_clinic.active = False
+        db.session.commit()
+        assert lookup_instance('pipe-instance')['active'] is False
+
+        wa_clinic.active = True
+        wa_clinic.evolution_instance_name = 'pipe-instance-renamed'
+        db.session.commit()
+        assert lookup_instance('pipe-instance') is None
+        assert lookup_instance('pipe-instance-renamed')['id'] == str(wa_clinic.id)
+
+        wa_clinic.evolution_instance_name = 'pipe-instance'
+        db.session.commit()
+
+
 class TestStoreAlwaysSemantics:
     def test_agent_disabled_still_stores_message(self, app, db_session, wa_clinic):
         wa_clinic.agent_enabled = False
@@ -135,7 +480,7 @@ class TestStoreAlwaysSemantics:
              patch('app.services.message_processor.EvolutionService') as MockEvo, \
              patch('app.services.message_processor.time.sleep'):
             MockClaude.return_value.process_message.return_value = 'Podemos amanhã às 14h.'
-            MockEvo.return_value.send_message.return_value = {'error': 'instance down'}
+            MockEvo.return_value.send_message.return_value = {'error': 'instance down', 'status_code': 503}
 
             post_webhook(app, text_upsert('pipe-instance', '5511900010005', 'tem vaga?', 'FAIL_1'))
 
@@ -211,22 +556,24 @@ class TestAudioTranscription:
     def test_transcribed_audio_keeps_bot_in_the_loop(self, app, db_session, wa_clinic):
         fake_b64 = base64.b64encode(b'fake-ogg-bytes').decode()
 
-        with patch('app.routes.webhook.EvolutionService') as MockEvoRoute, \
-             patch('app.routes.webhook.ClaudeService') as MockClaudeRoute, \
+        with patch('app.services.media_pipeline.EvolutionService') as MockEvoMedia, \
+             patch('app.services.media_pipeline.ClaudeService') as MockClaudeMedia, \
              patch('app.services.message_processor.ClaudeService') as MockClaudeProc, \
-             patch('app.services.message_processor.EvolutionService') as MockEvoProc:
-            MockEvoRoute.return_value.get_media_base64.return_value = {
+             patch('app.services.message_processor.EvolutionService') as MockEvoProc, \
+             patch('app.services.conversation_service.publish_event') as mock_publish:
+            MockEvoMedia.return_value.get_media_base64.return_value = {
                 'base64': fake_b64, 'mimetype': 'audio/ogg'
             }
-            MockClaudeRoute.return_value.transcribe_audio.return_value = 'quero marcar uma limpeza'
+            MockClaudeMedia.return_value.transcribe_audio.return_value = 'quero marcar uma limpeza'
             MockClaudeProc.return_value.process_message.return_value = 'Claro! Que dia prefere?'
             MockEvoProc.return_value.send_message.return_value = {'key': {'id': 'R_AUDIO'}}
 
             response = post_webhook(app, self._audio_payload('AUD_1'))
 
         body = response.get_json()
-        assert body.get('transcribed') is True
+        assert body['reason'] == 'Voice note queued for transcription'
 
+        db.session.expire_all()
         conversation = Conversation.query.filter_by(
             clinic_id=wa_clinic.id, phone_number='5511900010007'
         ).first()
@@ -239,21 +586,98 @@ class TestAudioTranscription:
         assert audio_msg['media_url'].startswith('/api/media/')
         assert MediaAsset.query.filter_by(clinic_id=wa_clinic.id).count() >= 1
 
+        # Placeholder first, then the patched version; the reply came after
+        events = [c.args[1] for c in mock_publish.call_args_list]
+        assert events.index('new_message') < events.index('message_updated')
+        assert events.count('new_message') == 2
+        MockClaudeProc.return_value.process_message.assert_called_once()
+
     def test_transcription_failure_falls_back_to_human(self, app, db_session, wa_clinic):
-        with patch('app.routes.webhook.EvolutionService') as MockEvoRoute, \
-             patch('app.routes.webhook.ClaudeService') as MockClaudeRoute:
-            MockEvoRoute.return_value.get_media_base64.return_value = {
+        with patch('app.services.media_pipeline.EvolutionService') as MockEvoMedia, \
+             patch('app.services.media_pipeline.ClaudeService') as MockClaudeMedia, \
+             patch('app.services.message_processor.ClaudeService') as MockClaudeProc:
+            MockEvoMedia.return_value.get_media_base64.return_value = {
                 'base64': base64.b64encode(b'x').decode(), 'mimetype': 'audio/ogg'
             }
-            MockClaudeRoute.return_value.transcribe_audio.return_value = None
+            MockClaudeMedia.return_value.transcribe_audio.return_value = None
 
-            response = post_webhook(app, self._audio_payload('AUD_2'))
+            post_webhook(app, self._audio_payload('AUD_2'))
 
-        assert response.get_json()['reason'] == 'Media message routed to human'
+        MockClaudeProc.return_value.process_message.assert_not_called()
+        db.session.expire_all()
         conversation = Conversation.query.filter_by(
             clinic_id=wa_clinic.id, phone_number='5511900010007'
         ).first()
         assert conversation.status == ConversationStatus.TRANSFERRED_TO_HUMAN
+        audio_msg = conversation.messages[-1]
+        assert audio_msg['content'] == 'Audio enviado'
+        assert audio_msg['media_url'].startswith('/api/media/')
+
+
+    def test_lost_ingest_job_is_recovered_by_the_sweep(self, app, db_session, wa_clinic):
+        """A placeholder whose background job died with its process is retried."""
+        from datetime import timedelta
+        from app.models import ConversationMessage
+        from app.services.media_pipeline import recover_stalled_media
+        from app.utils.datetime_utils import utcnow
+
+        with patch('app.routes.webhook.schedule_media_ingest', return_value='scheduled'):
+            post_webhook(app, self._audio_payload('AUD_LOST'))  # job never runs
+
+        row = ConversationMessage.query.filter_by(evolution_id='AUD_LOST').one()
+        row.timestamp = utcnow() - timedelta(minutes=15)
+        db.session.commit()
+
+        with patch('app.services.media_pipeline.EvolutionService') as MockEvoMedia, \
+             patch('app.services.media_pipeline.ClaudeService') as MockClaudeMedia, \
+             patch('app.services.message_processor.ClaudeService') as MockClaudeProc, \
+             patch('app.services.message_processor.EvolutionService') as MockEvoProc:
+            MockEvoMedia.return_value.get_media_base64.return_value = {
+                'base64': base64.b64encode(b'lost-ogg').decode(), 'mimetype': 'audio/ogg'
+            }
+            MockClaudeMedia.return_value.transcribe_audio.return_value = 'pode ser amanhã?'
+            MockClaudeProc.return_value.process_message.return_value = 'Pode sim!'
+            MockEvoProc.return_value.send_message.return_value = {'key': {'id': 'R_LOST'}}
+
+            assert recover_stalled_media() == 1
+            # Patched now - a second sweep leaves it alone
+            assert recover_stalled_media() == 0
+
+        db.session.expire_all()
+        row = ConversationMessage.query.filter_by(evolution_id='AUD_LOST').one()
+        assert row.content == 'pode ser amanhã?'
+        assert row.media_url.startswith('/api/media/')
+        MockClaudeProc.return_value.process_message.assert_called_once()
+
+    def test_recovery_is_submitted_to_the_ingest_pool(self, app, db_session, wa_clinic):
+        """The sweep only queues work, and doesn't resubmit what is still in flight."""
+        from datetime import timedelta
+        from app.models import ConversationMessage
+        from app.services import media_pipeline
+        from app.utils.datetime_utils import utcnow
+
+        with patch('app.routes.webhook.schedule_media_ingest', return_value='scheduled'):
+            post_webhook(app, self._audio_payload('AUD_POOL'))
+
+        row = ConversationMessage.query.filter_by(evolution_id='AUD_POOL').one()
+        row.timestamp = utcnow() - timedelta(minutes=15)
+        db.session.commit()
+
+        app.config['MEDIA_INGEST_ASYNC'] = True
+        try:
+            with patch.object(media_pipeline, '_executor') as executor, \
+                 patch.object(media_pipeline, 'ingest_media') as ingest:
+                assert media_pipeline.recover_stalled_media() == 1
+                assert media_pipeline.recover_stalled_media() == 0  # still queued
+                ingest.assert_not_called()
+                executor.submit.assert_called_once()
+                job, *args = executor.submit.call_args.args
+                job(*args)  # the pool runs it
+                ingest.assert_called_once()
+                assert media_pipeline.recover_stalled_media() == 1  # finished, still unpatched
+        finally:
+            app.config['MEDIA_INGEST_ASYNC'] = False
+            media_pipeline._recovering.clear()
 
 
 class TestManualTakeover:
@@ -313,13 +737,17 @@ class TestUnreadTracking:
             if c['id'] == str(conversation.id)
         )
         assert item['unread_count'] == 2
+        assert item['message_count'] == 3
+        assert item['last_message_preview'] == 'segunda'
+        assert item['last_message_role'] == 'user'
+        assert 'messages' not in item
 
         marked = client.post(f'/api/conversations/{conversation.id}/read', headers=auth_headers)
         assert marked.status_code == 200
         assert marked.get_json()['unread_count'] == 0
 
         db.session.refresh(conversation)
-        assert conversation.unread_count() == 0
+        assert conversation.unread_count == 0
 
 
 class TestQuickReplies:
@@ -380,6 +808,82 @@ class TestMediaEndpoint:
         assert response.mimetype == 'image/png'
         assert response.data == b'\x89PNG-fake'
 
+    def test_conditional_and_range_requests(self, app, client, auth_headers, db_session, wa_clinic):
+        asset = MediaAsset(clinic_id=wa_clinic.id, mimetype='audio/ogg', data=b'0123456789')
+        db.session.add(asset)
+        db.session.commit()
+        url = f'/api/media/{asset.id}'
+
+        full = client.get(url, headers=auth_headers)
+        etag = full.headers['ETag']
+        assert etag == f'"{asset.sha256}"'
+        assert full.headers['Accept-Ranges'] == 'bytes'
+
+        cached = client.get(url, headers={**auth_headers, 'If-None-Match': etag})
+        assert cached.status_code == 304
+        assert cached.data == b''
+
+        partial = client.get(url, headers={**auth_headers, 'Range': 'bytes=2-5'})
+        assert partial.status_code == 206
+        assert partial.data == b'2345'
+        assert partial.headers['Content-Range'] == 'bytes 2-5/10'
+
+        tail = client.get(url, headers={**auth_headers, 'Range': 'bytes=-3'})
+        assert tail.data == b'789'
+
+        stale = client.get(url, headers={**auth_headers, 'Range': 'bytes=2-5', 'If-Range': '"other"'})
+        assert stale.status_code == 200
+        assert stale.data == b'0123456789'
+
+        fresh = client.get(url, headers={**auth_headers, 'Range': 'bytes=2-5', 'If-Range': etag})
+        assert fresh.status_code == 206
+
+        unsatisfiable = client.get(url, headers={**auth_headers, 'Range': 'bytes=20-30'})
+        assert unsatisfiable.status_code == 416
+        assert unsatisfiable.headers['Content-Range'] == 'bytes */10'
+
+    def test_if_range_date_must_match_last_modified(self, app, client, auth_headers, db_session, wa_clinic):
+        asset = MediaAsset(clinic_id=wa_clinic.id, mimetype='audio/ogg', data=b'0123456789')
+        db.session.add(asset)
+        db.session.commit()
+        url = f'/api/media/{asset.id}'
+
+        last_modified = client.get(url, headers=auth_headers).headers['Last-Modified']
+        current = client.get(url, headers={**auth_headers, 'Range': 'bytes=2-5', 'If-Range': last_modified})
+        assert current.status_code == 206
+        assert current.data == b'2345'
+
+        older = client.get(url, headers={
+            **auth_headers, 'Range': 'bytes=2-5', 'If-Range': 'Wed, 21 Oct 2015 07:28:00 GMT',
+        })
+        assert older.status_code == 200
+        assert older.data == b'0123456789'
+
+        weak = client.get(url, headers={**auth_headers, 'Range': 'bytes=2-5', 'If-Range': f'W/"{asset.sha256}"'})
+        assert weak.status_code == 200
+
+    def test_identical_content_is_stored_once(self, app, db_session, wa_clinic):
+        from app.utils.media_storage import get_media_storage
+
+        first = MediaAsset(clinic_id=wa_clinic.id, mimetype='image/webp', data=b'same-sticker')
+        second = MediaAsset(clinic_id=wa_clinic.id, mimetype='image/webp', data=b'same-sticker')
+        db.session.add_all([first, second])
+        db.session.commit()
+
+        assert first.sha256 == second.sha256
+        assert first.size == len(b'same-sticker')
+        assert get_media_storage().exists(first.sha256)
+        assert second.data == b'same-sticker'
+
+    def test_storage_must_be_explicitly_persistent(self):
+        from app.utils.media_storage import persistent_storage_problem
+
+        assert persistent_storage_problem({})
+        assert persistent_storage_problem({'MEDIA_STORAGE_BACKEND': 'local'})
+        assert persistent_storage_problem({'MEDIA_STORAGE_BACKEND': 's3'})
+        assert persistent_storage_problem({'MEDIA_STORAGE_BACKEND': 'local', 'MEDIA_STORAGE_PATH': '/data/media'}) is None
+        assert persistent_storage_problem({'MEDIA_STORAGE_BACKEND': 's3', 'MEDIA_S3_BUCKET': 'media'}) is None
+
     def test_requires_auth(self, app, client, db_session, wa_clinic):
         asset = MediaAsset(clinic_id=wa_clinic.id, mimetype='image/png', data=b'x')
         db.session.add(asset)
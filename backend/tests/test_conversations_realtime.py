@@ -5,11 +5,13 @@ messages and the WhatsApp webhook handling that feeds them.
 import hmac
 import hashlib
 import json
+from unittest.mock import patch
 
 import pytest
 
 from app import db
-from app.models import Conversation
+from app.models import Conversation, ConversationMessage
+from app.services.conversation_service import ConversationService
 
 
 def webhook_headers(app, payload: dict):
@@ -78,6 +80,131 @@ class TestMessageModelHelpers:
             assert updated['evolution_id'] == 'WA999'
             assert conversation.messages[0]['evolution_id'] is None
 
+    def test_messages_are_stored_as_rows(self, app, db_session, sample_clinic):
+        with app.app_context():
+            conversation = Conversation(
+                clinic_id=sample_clinic.id,
+                phone_number='5511900000004',
+                context={}
+            )
+            db.session.add(conversation)
+            db.session.commit()
+
+            first = conversation.add_message('user', 'um')
+            conversation.add_message('assistant', 'dois')
+            conversation.add_message('user', 'tres')
+            db.session.commit()
+
+            rows = ConversationMessage.query.filter_by(conversation_id=conversation.id).all()
+            assert len(rows) == 3
+            assert all(r.clinic_id == sample_clinic.id for r in rows)
+            assert conversation.message_count == 3
+            assert [m['content'] for m in conversation.recent_messages(2)] == ['dois', 'tres']
+            assert conversation.last_message(role='assistant')['content'] == 'dois'
+            assert conversation.find_message(first['id'])['content'] == 'um'
+
+    def test_counters_increment_in_sql(self, app, db_session, sample_clinic):
+        """A concurrent writer's bump isn't overwritten by a stale in-memory count."""
+        with app.app_context():
+            conversation = Conversation(
+                clinic_id=sample_clinic.id,
+                phone_number='5511900000006',
+                context={}
+            )
+            db.session.add(conversation)
+            db.session.commit()
+            assert conversation.message_count == 0
+
+            # Another process appends a message meanwhile
+            db.session.execute(
+                Conversation.__table__.update()
+                .where(Conversation.__table__.c.id == conversation.id)
+                .values(message_count=Conversation.__table__.c.message_count + 1,
+                        unread_count=Conversation.__table__.c.unread_count + 1)
+            )
+
+            conversation.add_message('user', 'oi')
+            db.session.commit()
+
+            assert conversation.message_count == 2
+            assert conversation.unread_count == 2
+
+    def test_counters_read_back_as_ints_before_commit(self, app, db_session, sample_clinic):
+        with app.app_context():
+            conversation = Conversation(
+                clinic_id=sample_clinic.id,
+                phone_number='5511900000007',
+                context={}
+            )
+            db.session.add(conversation)
+            db.session.commit()
+
+            conversation.add_message('user', 'oi')
+            conversation.add_message('assistant', 'olá!')
+
+            assert conversation.message_count == 2
+            assert conversation.unread_count == 1
+            assert conversation.to_dict()['message_count'] == 2
+            window = ConversationService(sample_clinic).get_history_window(conversation, token_budget=500)
+            assert window['start'] == 0
+            db.session.commit()
+
+    def test_search_matches_message_content(self, client, auth_headers, db_session, sample_clinic):
+        conversation = Conversation(
+            clinic_id=sample_clinic.id,
+            phone_number='5511900000005',
+            context={}
+        )
+        db.session.add(conversation)
+        db.session.commit()
+        conversation.add_message('user', 'queria saber do clareamento')
+        db.session.commit()
+
+        response = client.get('/api/conversations?search=clareamento', headers=auth_headers)
+
+        items = {c['id']: c for c in response.get_json()['conversations']}
+        hit = items[str(conversation.id)]
+        start, end = hit['search_highlights'][0]
+        assert hit['search_snippet'][start:end] == 'clareamento'
+
+        by_phone = client.get('/api/conversations?search=900000005', headers=auth_headers)
+        assert str(conversation.id) in [c['id'] for c in by_phone.get_json()['conversations']]
+
+        none = client.get('/api/conversations?search=100%25', headers=auth_headers)
+        assert none.get_json()['conversations'] == []
+
+    def test_detail_paginates_messages_with_before_cursor(self, client, auth_headers, db_session, sample_clinic):
+        conversation = Conversation(
+            clinic_id=sample_clinic.id,
+            phone_number='5511900000006',
+            context={}
+        )
+        db.session.add(conversation)
+        db.session.commit()
+        for i in range(5):
+            conversation.add_message('user', f'msg {i}')
+        db.session.commit()
+
+        url = f'/api/conversations/{conversation.id}'
+        latest = client.get(f'{url}?limit=2', headers=auth_headers).get_json()
+        assert [m['content'] for m in latest['messages']] == ['msg 3', 'msg 4']
+        assert latest['has_more_messages'] is True
+
+        older = client.get(
+            f"{url}?limit=2&before={latest['next_before']}", headers=auth_headers
+        ).get_json()
+        assert [m['content'] for m in older['messages']] == ['msg 1', 'msg 2']
+
+        oldest = client.get(
+            f"{url}?limit=2&before={older['next_before']}", headers=auth_headers
+        ).get_json()
+        assert [m['content'] for m in oldest['messages']] == ['msg 0']
+        assert oldest['has_more_messages'] is False
+        assert oldest['next_before'] is None
+
+        bad = client.get(f'{url}?before=nope', headers=auth_headers)
+        assert bad.status_code == 400
+
 
 class TestWebhookMediaMessage:
     def test_inbound_image_is_stored_and_transfers_to_human(self, app, db_session, sample_clinic):
@@ -147,6 +274,80 @@ class TestWebhookMediaMessage:
         assert conversation.find_message('WA_ACK_1')['status'] == 'read'
 
 
+    def test_ack_matches_message_in_older_conversation(self, app, db_session, sample_clinic):
+        """ACKs resolve by evolution_id alone, even for a completed, older conversation."""
+        sample_clinic.evolution_instance_name = 'test-instance-3'
+        db.session.commit()
+
+        older = Conversation(
+            clinic_id=sample_clinic.id,
+            phone_number='5511900000011',
+            status='completed',
+            context={}
+        )
+        db.session.add(older)
+        db.session.commit()
+        older.add_message('assistant', 'lembrete', evolution_id='WA_ACK_OLD')
+        db.session.commit()
+
+        payload = {
+            'event': 'messages.update',
+            'instance': 'test-instance-3',
+            'data': [
+                {'key': {'id': 'WA_ACK_OLD'}, 'update': {'status': 'DELIVERY_ACK'}},
+                {'key': {'id': 'WA_UNKNOWN'}, 'update': {'status': 'READ'}},
+            ]
+        }
+        headers, body = webhook_headers(app, payload)
+        response = app.test_client().post('/api/webhook/evolution', data=body, headers=headers)
+
+        assert response.get_json()['updated'] == 1
+        db.session.refresh(older)
+        assert older.find_message('WA_ACK_OLD')['status'] == 'delivered'
+
+
+    def test_ack_batch_coalesces_and_ignores_downgrades(self, app, db_session, sample_clinic):
+        sample_clinic.evolution_instance_name = 'test-instance-4'
+        db.session.commit()
+
+        conversation = Conversation(
+            clinic_id=sample_clinic.id,
+            phone_number='5511900000012',
+            context={}
+        )
+        db.session.add(conversation)
+        db.session.commit()
+        conversation.add_message('assistant', 'um', evolution_id='WA_B1')
+        conversation.add_message('assistant', 'dois', evolution_id='WA_B2')
+        db.session.commit()
+        conversation.update_message_status('WA_B2', 'read')
+        db.session.commit()
+
+        payload = {
+            'event': 'messages.update',
+            'instance': 'test-instance-4',
+            'data': [
+                {'key': {'id': 'WA_B1'}, 'update': {'status': 'DELIVERY_ACK'}},
+                {'key': {'id': 'WA_B1'}, 'update': {'status': 'READ'}},
+                {'key': {'id': 'WA_B2'}, 'update': {'status': 'DELIVERY_ACK'}},
+            ]
+        }
+        headers, body = webhook_headers(app, payload)
+        with patch('app.services.conversation_service.publish_event') as mock_publish:
+            response = app.test_client().post('/api/webhook/evolution', data=body, headers=headers)
+
+        assert response.get_json()['updated'] == 1
+        mock_publish.assert_called_once()
+        event_payload = mock_publish.call_args.args[2]
+        assert event_payload['conversation_id'] == str(conversation.id)
+        assert [u['status'] for u in event_payload['updates']] == ['read']
+
+        db.session.refresh(conversation)
+        assert conversation.find_message('WA_B1')['status'] == 'read'
+        # 'delivered' after 'read' is a downgrade and must not be applied
+        assert conversation.find_message('WA_B2')['status'] == 'read'
+
+
 class TestSendMediaEndpoint:
     def test_rejects_invalid_media_type(self, client, auth_headers, sample_clinic):
         conversation = Conversation(
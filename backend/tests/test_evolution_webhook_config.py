@@ -35,7 +35,7 @@ class TestSetWebhookAuthHeader:
                 captured['payload'] = json
                 return FakeResponse()
 
-            monkeypatch.setattr(evolution_service_module.requests, 'post', fake_post)
+            monkeypatch.setattr(evolution_service_module.requests.Session, 'post', lambda session, *a, **kw: fake_post(*a, **kw))
 
             service = EvolutionService(sample_clinic)
             service.set_webhook('https://backend.example.com/api/webhook/evolution')
@@ -58,7 +58,7 @@ class TestSetWebhookAuthHeader:
                 captured['payload'] = json
                 return FakeResponse()
 
-            monkeypatch.setattr(evolution_service_module.requests, 'post', fake_post)
+            monkeypatch.setattr(evolution_service_module.requests.Session, 'post', lambda session, *a, **kw: fake_post(*a, **kw))
 
             service = EvolutionService(sample_clinic)
             service.set_webhook('https://backend.example.com/api/webhook/evolution')
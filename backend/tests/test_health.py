@@ -25,6 +25,9 @@ class TestHealthCheck:
         assert 'status' in data
         assert 'checks' in data
         assert 'database' in data['checks']
+        # Unauthenticated: no operational diagnostics
+        assert 'chat_queue' not in data
+        assert 'http_pools' not in data
 
     def test_health_live(self, client):
         """Test liveness check."""
@@ -33,3 +36,51 @@ class TestHealthCheck:
         assert response.status_code == 200
         data = response.get_json()
         assert data['status'] == 'alive'
+
+    def test_http_pool_reuses_connections(self, client):
+        """Requests to the same origin share one keep-alive connection and show up in the pool stats."""
+        import threading
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        from app.utils.http_pool import get_session, pool_stats
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                self.send_response(200)
+                self.send_header('Content-Length', '2')
+                self.end_headers()
+                self.wfile.write(b'{}')
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f'http://127.0.0.1:{server.server_port}'
+        try:
+            session = get_session(base_url)
+            assert get_session(base_url + '/other/path') is session
+            session.post(f'{base_url}/chat/sendPresence', json={}, timeout=5)
+            session.post(f'{base_url}/message/sendText', json={}, timeout=5)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        stats = pool_stats()[base_url]
+        assert stats['requests'] == 2
+        assert stats['connections_opened'] == 1
+
+    def test_http_pool_stats_are_logged_periodically(self, caplog):
+        import logging
+        from unittest.mock import patch
+
+        from app.utils import http_pool
+
+        http_pool.get_session('http://pool-log.invalid')
+        with patch.object(http_pool, 'STATS_LOG_INTERVAL', 0), \
+             caplog.at_level(logging.INFO, logger='app.utils.http_pool'):
+            http_pool.get_session('http://pool-log.invalid')
+        assert 'http pool http://pool-log.invalid' in caplog.text
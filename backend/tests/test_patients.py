@@ -139,3 +139,40 @@ class TestRestorePatient:
         assert response.status_code == 200
         data = response.get_json()
         assert data['patient']['deleted_at'] is None
+
+
+class TestErasePatient:
+    """Tests for POST /api/patients/<id>/erase"""
+
+    def test_erase_removes_voice_note_transcripts(self, app, client, auth_headers, sample_clinic, sample_patient):
+        """Cached transcriptions of the patient's audio are erased; other patients' stay."""
+        from app import db
+        from app.models import AudioTranscript, Conversation, MediaAsset
+        from app.models.conversation import MessageType
+
+        own = MediaAsset(clinic_id=sample_clinic.id, mimetype='audio/ogg', data=b'patient voice note')
+        other = MediaAsset(clinic_id=sample_clinic.id, mimetype='audio/ogg', data=b'someone else')
+        db.session.add_all([own, other])
+        db.session.flush()
+        conversation = Conversation(
+            clinic_id=sample_clinic.id, phone_number=sample_patient.phone, patient_id=sample_patient.id
+        )
+        db.session.add(conversation)
+        db.session.flush()
+        conversation.add_message('user', 'quero remarcar para sexta', message_type=MessageType.AUDIO,
+                                 media_url=own.public_path, media_mimetype='audio/ogg')
+        db.session.add_all([
+            AudioTranscript(clinic_id=sample_clinic.id, sha256=own.sha256, model='m', transcript='quero remarcar para sexta'),
+            AudioTranscript(clinic_id=sample_clinic.id, sha256=other.sha256, model='m', transcript='outro paciente'),
+        ])
+        db.session.commit()
+
+        response = client.post(
+            f'/api/patients/{sample_patient.id}/erase',
+            headers=auth_headers,
+            json={'confirm': True}
+        )
+
+        assert response.status_code == 200
+        remaining = [t.transcript for t in AudioTranscript.query.filter_by(clinic_id=sample_clinic.id)]
+        assert remaining == ['outro paciente']
@@ -328,7 +328,7 @@ class TestFetchChatHistoryPagination:
                     return FakeResponse(records)
                 return FakeResponse([])
 
-            monkeypatch.setattr(evolution_service_module.requests, 'post', fake_post)
+            monkeypatch.setattr(evolution_service_module.requests.Session, 'post', lambda session, *a, **kw: fake_post(*a, **kw))
 
             service = EvolutionService(sample_clinic)
             result = service.fetch_chat_history('5511900000060', max_messages=5000)
@@ -25,9 +25,10 @@ import { QuickRepliesModal } from '@/components/conversations/quick-replies-moda
 import { useConversations } from '@/components/conversations/conversations-provider'
 
 // Long threads (post history-sync they can reach thousands of messages) are
-// rendered incrementally: last INITIAL_VISIBLE first, older on demand.
-const INITIAL_VISIBLE = 100
-const LOAD_EARLIER_STEP = 200
+// paginated by the API: the latest MESSAGES_PAGE first, older pages fetched
+// with a `before` cursor when the user scrolls to the top.
+const MESSAGES_PAGE = 50
+const LOAD_EARLIER_THRESHOLD_PX = 80
 
 function getMessageGroups(messages: Message[]) {
   const groups: { date: string; label: string; messages: Message[] }[] = []
@@ -70,6 +71,8 @@ export default function ConversationDetailPage() {
   } = useConversations()
 
   const [conversation, setConversation] = useState<Conversation | null>(null)
+  const conversationRef = useRef<Conversation | null>(null)
+  conversationRef.current = conversation
   const [loading, setLoading] = useState(true)
   const [showInfo, setShowInfo] = useState(false)
   const messagesEndRef = useRef<HTMLDivElement>(null)
@@ -84,7 +87,7 @@ export default function ConversationDetailPage() {
   const [movingStage, setMovingStage] = useState(false)
   const [quickReplies, setQuickReplies] = useState<QuickReply[]>([])
   const [showQuickReplies, setShowQuickReplies] = useState(false)
-  const [visibleCount, setVisibleCount] = useState(INITIAL_VISIBLE)
+  const [loadingEarlier, setLoadingEarlier] = useState(false)
   const [showNewMsgPill, setShowNewMsgPill] = useState(false)
   const initialScrollDoneRef = useRef(false)
   const pendingScrollAdjustRef = useRef<number | null>(null)
@@ -110,8 +113,25 @@ export default function ConversationDetailPage() {
 
   const fetchConversation = useCallback(async () => {
     try {
-      const response = await conversationsApi.get(conversationId)
-      setConversation(response.data)
+      const response = await conversationsApi.get(conversationId, { limit: MESSAGES_PAGE })
+      const latest = response.data as Conversation
+      // Refetches (after an action) return only the latest page: keep the
+      // older pages the user already loaded in front of it.
+      setConversation((prev) => {
+        if (!prev || prev.id !== latest.id || !prev.messages?.length || !latest.messages?.length) {
+          return latest
+        }
+        const latestIds = new Set(latest.messages.map((m) => m.id))
+        const firstIndex = prev.messages.findIndex((m) => m.id === latest.messages![0].id)
+        if (firstIndex <= 0) return latest
+        const older = prev.messages.slice(0, firstIndex).filter((m) => !latestIds.has(m.id))
+        return {
+          ...latest,
+          messages: [...older, ...latest.messages],
+          has_more_messages: prev.has_more_messages,
+          next_before: prev.next_before,
+        }
+      })
 
       const patient = response.data.patient
       setPatientForm({
@@ -132,7 +152,7 @@ export default function ConversationDetailPage() {
     setLoading(true)
     setShowInfo(false)
     setIsEditing(false)
-    setVisibleCount(INITIAL_VISIBLE)
+    setConversation(null)
     setShowNewMsgPill(false)
     initialScrollDoneRef.current = false
     fetchConversation()
@@ -159,22 +179,63 @@ export default function ConversationDetailPage() {
         }
       }
 
+      if (event.type === 'message_updated') {
+        // Media placeholder patched with its stored asset / transcript
+        const conversationIdInEvent = event.payload.conversation_id as string
+        if (conversationIdInEvent !== conversationId) return
+        const message = event.payload.message as Message
+        const status = event.payload.conversation_status as string
+        setConversation((prev) => {
+          if (!prev?.messages) return prev
+          return {
+            ...prev,
+            status: (status as Conversation['status']) || prev.status,
+            messages: prev.messages.map((m) => (m.id === message.id ? { ...m, ...message } : m))
+          }
+        })
+      }
+
       if (event.type === 'message_status') {
         const conversationIdInEvent = event.payload.conversation_id as string
         if (conversationIdInEvent !== conversationId) return
-        const messageId = event.payload.message_id as string
-        const status = event.payload.status as string
+        // ACK batches arrive coalesced ({updates: [...]}); single updates
+        // (e.g. a reply marked failed) carry message_id/status directly.
+        const updates = (event.payload.updates as { message_id: string; status: string }[] | undefined)
+          ?? [{ message_id: event.payload.message_id as string, status: event.payload.status as string }]
+        const statusById = new Map(updates.map((u) => [u.message_id, u.status]))
         setConversation((prev) => {
           if (!prev?.messages) return prev
           return {
             ...prev,
-            messages: prev.messages.map((m) => (m.id === messageId ? { ...m, status: status as Message['status'] } : m))
+            messages: prev.messages.map((m) => (
+              statusById.has(m.id) ? { ...m, status: statusById.get(m.id) as Message['status'] } : m
+            ))
+          }
+        })
+      }
+
+      if (event.type === 'transfer_summary') {
+        // The handoff summary is generated after the transfer itself
+        const conversationIdInEvent = event.payload.conversation_id as string
+        if (conversationIdInEvent !== conversationId) return
+        const transferId = event.payload.transfer_id as string
+        const summary = event.payload.summary as string
+        if (!conversationRef.current?.transfers?.some((t) => t.id === transferId)) {
+          // Transfer happened after the page loaded: pick it up with its summary
+          fetchConversation()
+          return
+        }
+        setConversation((prev) => {
+          if (!prev?.transfers) return prev
+          return {
+            ...prev,
+            transfers: prev.transfers.map((t) => (t.id === transferId ? { ...t, summary } : t))
           }
         })
       }
     })
     return unsubscribe
-  }, [subscribe, conversationId, markReadLocal])
+  }, [subscribe, conversationId, markReadLocal, fetchConversation])
 
   const isNearBottom = useCallback(() => {
     const el = scrollContainerRef.current
@@ -213,13 +274,42 @@ export default function ConversationDetailPage() {
     }
   }, [conversation?.messages, isNearBottom, scrollToBottom])
 
-  const handleLoadEarlier = () => {
+  const handleLoadEarlier = useCallback(async () => {
+    if (loadingEarlier || !conversation?.has_more_messages || !conversation.next_before) return
+    setLoadingEarlier(true)
+    try {
+      const response = await conversationsApi.get(conversationId, {
+        before: conversation.next_before,
+        limit: MESSAGES_PAGE,
+      })
+      const page = response.data as Conversation
+      const el = scrollContainerRef.current
+      // Anchor: remember the distance from the bottom, restore it after render
+      pendingScrollAdjustRef.current = el ? el.scrollHeight - el.scrollTop : null
+      setConversation((prev) => {
+        if (!prev || prev.id !== page.id) return prev
+        const known = new Set((prev.messages || []).map((m) => m.id))
+        const older = (page.messages || []).filter((m) => !known.has(m.id))
+        return {
+          ...prev,
+          messages: [...older, ...(prev.messages || [])],
+          has_more_messages: page.has_more_messages,
+          next_before: page.next_before,
+        }
+      })
+    } catch (error) {
+      console.error('Error fetching earlier messages:', error)
+    } finally {
+      setLoadingEarlier(false)
+    }
+  }, [conversationId, conversation?.has_more_messages, conversation?.next_before, loadingEarlier])
+
+  const handleScroll = () => {
     const el = scrollContainerRef.current
-    // Anchor: remember the distance from the bottom, restore it after render
-    pendingScrollAdjustRef.current = el ? el.scrollHeight - el.scrollTop : null
-    setVisibleCount((count) => count + LOAD_EARLIER_STEP)
-    // Force the effect to run even though messages identity didn't change
-    setConversation((prev) => (prev ? { ...prev } : prev))
+    if (isNearBottom()) setShowNewMsgPill(false)
+    if (el && el.scrollTop < LOAD_EARLIER_THRESHOLD_PX && initialScrollDoneRef.current) {
+      handleLoadEarlier()
+    }
   }
 
   const isTyping = typingConversationIds.has(conversationId)
@@ -413,9 +503,7 @@ export default function ConversationDetailPage() {
   }
 
   const allMessages = conversation.messages || []
-  const visibleMessages = allMessages.slice(-visibleCount)
-  const hiddenCount = allMessages.length - visibleMessages.length
-  const messageGroups = getMessageGroups(visibleMessages)
+  const messageGroups = getMessageGroups(allMessages)
 
   return (
     <div className="flex flex-col h-full min-h-0">
@@ -494,6 +582,11 @@ export default function ConversationDetailPage() {
               {conversation.transfers && conversation.transfers.length > 0 && (
                 <p className="text-[11px] text-muted-foreground">Motivo: {conversation.transfers[0].reason}</p>
               )}
+              {conversation.transfers?.[0]?.summary && (
+                <p className="text-[11px] text-muted-foreground whitespace-pre-line mt-1">
+                  {conversation.transfers[0].summary}
+                </p>
+              )}
             </div>
           </div>
           <div className="flex gap-2 shrink-0">
@@ -618,7 +711,7 @@ export default function ConversationDetailPage() {
       <div className="relative flex-1 min-h-0">
         <div
           ref={scrollContainerRef}
-          onScroll={() => { if (isNearBottom()) setShowNewMsgPill(false) }}
+          onScroll={handleScroll}
           className="h-full overflow-y-auto px-4 py-4 scrollbar-thin scrollbar-thumb-muted scrollbar-track-transparent bg-[radial-gradient(circle_at_1px_1px,hsl(var(--muted-foreground)/0.08)_1px,transparent_0)] bg-[size:20px_20px]"
         >
           {allMessages.length === 0 ? (
@@ -627,10 +720,10 @@ export default function ConversationDetailPage() {
             </div>
           ) : (
             <div className="space-y-4">
-              {hiddenCount > 0 && (
+              {conversation.has_more_messages && (
                 <div className="flex justify-center">
-                  <Button variant="outline" size="sm" onClick={handleLoadEarlier} className="h-7 text-xs">
-                    Carregar mensagens anteriores ({hiddenCount})
+                  <Button variant="outline" size="sm" onClick={handleLoadEarlier} disabled={loadingEarlier} className="h-7 text-xs">
+                    {loadingEarlier ? 'Carregando...' : 'Carregar mensagens anteriores'}
                   </Button>
                 </div>
               )}
@@ -491,8 +491,8 @@ export default function DashboardPage() {
                           {conv.urgent && <Badge variant="destructive" size="sm" dot>Urgente</Badge>}
                         </p>
                         <p className="text-sm text-muted-foreground truncate max-w-[220px]">
-                          {conv.messages && conv.messages.length > 0
-                            ? conv.messages[conv.messages.length - 1].content
+                          {conv.last_message_role
+                            ? conv.last_message_preview
                             : 'Sem mensagens'}
                         </p>
                       </div>
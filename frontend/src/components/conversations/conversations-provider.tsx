@@ -205,7 +205,10 @@ export function ConversationsProvider({ children }: { children: ReactNode }) {
             ...conv,
             status: conversationStatus || conv.status,
             last_message_at: message.timestamp,
-            messages: [message],
+            last_message_preview: (message.content || message.caption || '').slice(0, 160),
+            last_message_role: message.role,
+            last_message_type: message.type,
+            message_count: (conv.message_count || 0) + 1,
             unread_count: (conv.unread_count || 0) + (incrementUnread ? 1 : 0),
           }
           const next = [...prev]
@@ -219,6 +222,29 @@ export function ConversationsProvider({ children }: { children: ReactNode }) {
         }
       }
 
+      if (event.type === 'message_updated') {
+        // A media placeholder got its stored asset / transcript: refresh the
+        // preview if it is still the latest message, and the status (a voice
+        // note that couldn't be transcribed hands off to a human).
+        const conversationId = event.payload.conversation_id as string
+        const message = event.payload.message as Message
+        const conversationStatus = event.payload.conversation_status as Conversation['status']
+        setConversations((prev) => prev.map((c) => {
+          if (c.id !== conversationId) return c
+          const isLatest = c.last_message_at === message.timestamp
+          return {
+            ...c,
+            status: conversationStatus || c.status,
+            last_message_preview: isLatest
+              ? (message.content || message.caption || '').slice(0, 160)
+              : c.last_message_preview,
+          }
+        }))
+        if (conversationStatus === 'transferred_to_human') {
+          scheduleRefresh()
+        }
+      }
+
       if (event.type === 'typing') {
         const conversationId = event.payload.conversation_id as string
         const isTyping = Boolean(event.payload.is_typing)
@@ -1,5 +1,6 @@
 'use client'
 
+import type { ReactNode } from 'react'
 import Link from 'next/link'
 import { usePathname } from 'next/navigation'
 import { SearchField } from '@/components/ui/search-field'
@@ -38,23 +39,39 @@ function isRecent(conv: Conversation) {
   return Date.now() - new Date(conv.last_message_at).getTime() < 5 * 60 * 1000
 }
 
+function SearchSnippet({ snippet, highlights }: { snippet: string; highlights: [number, number][] }) {
+  const parts: ReactNode[] = []
+  let cursor = 0
+  highlights.forEach(([start, end], i) => {
+    if (start > cursor) parts.push(snippet.slice(cursor, start))
+    parts.push(<mark key={i} className="bg-primary/15 text-foreground rounded-sm px-0.5">{snippet.slice(start, end)}</mark>)
+    cursor = end
+  })
+  parts.push(snippet.slice(cursor))
+  return <span>{parts}</span>
+}
+
 function LastMessagePreview({ conv }: { conv: Conversation }) {
-  const last = conv.messages && conv.messages.length > 0 ? conv.messages[conv.messages.length - 1] : null
-  if (!last) return <span>Sem mensagens</span>
+  if (conv.search_snippet) {
+    return <SearchSnippet snippet={conv.search_snippet} highlights={conv.search_highlights || []} />
+  }
+
+  if (!conv.last_message_role) return <span>Sem mensagens</span>
 
-  const prefix = last.role === 'assistant' ? <span className="text-primary font-medium">Bot: </span> : null
+  const preview = conv.last_message_preview || ''
+  const prefix = conv.last_message_role === 'assistant' ? <span className="text-primary font-medium">Bot: </span> : null
 
-  if (last.type === 'image') {
-    return <span className="inline-flex items-center gap-1">{prefix}<ImageIcon className="h-3.5 w-3.5" /> Foto{last.caption ? `: ${last.caption}` : ''}</span>
+  if (conv.last_message_type === 'image') {
+    return <span className="inline-flex items-center gap-1">{prefix}<ImageIcon className="h-3.5 w-3.5" /> {preview || 'Foto'}</span>
   }
-  if (last.type === 'audio') {
+  if (conv.last_message_type === 'audio') {
     return <span className="inline-flex items-center gap-1">{prefix}<Mic className="h-3.5 w-3.5" /> Audio</span>
   }
-  if (last.type === 'document') {
+  if (conv.last_message_type === 'document') {
     return <span className="inline-flex items-center gap-1">{prefix}<FileText className="h-3.5 w-3.5" /> Documento</span>
   }
 
-  const content = last.content?.length > 60 ? `${last.content.substring(0, 60)}...` : last.content
+  const content = preview.length > 60 ? `${preview.substring(0, 60)}...` : preview
   return <span>{prefix}{content}</span>
 }
 
@@ -99,11 +99,11 @@ export function LinkPatientModal({ open, onOpenChange, onSuccess, stages }: Prop
           .forEach((conv: Conversation) => {
             // Get last message
             let lastMessage = 'Sem mensagens'
-            if (conv.messages && conv.messages.length > 0) {
-              const lastMsg = conv.messages[conv.messages.length - 1]
-              lastMessage = lastMsg.content.length > 50
-                ? lastMsg.content.substring(0, 50) + '...'
-                : lastMsg.content
+            if (conv.last_message_role) {
+              const preview = conv.last_message_preview || ''
+              lastMessage = preview.length > 50
+                ? preview.substring(0, 50) + '...'
+                : preview
             }
 
             results.push({
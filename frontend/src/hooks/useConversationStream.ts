@@ -3,7 +3,13 @@
 import { useEffect, useRef, useState } from 'react'
 import { conversationsApi, refreshAccessToken } from '@/lib/api'
 
-export type StreamEventType = 'new_message' | 'message_status' | 'typing' | 'connection_status'
+export type StreamEventType =
+  | 'new_message'
+  | 'message_updated'
+  | 'message_status'
+  | 'typing'
+  | 'connection_status'
+  | 'transfer_summary'
 
 export interface StreamEvent {
   type: StreamEventType
@@ -56,9 +62,11 @@ export function useConversationStream() {
       }
 
       es.addEventListener('new_message', emit('new_message'))
+      es.addEventListener('message_updated', emit('message_updated'))
       es.addEventListener('message_status', emit('message_status'))
       es.addEventListener('typing', emit('typing'))
       es.addEventListener('connection_status', emit('connection_status'))
+      es.addEventListener('transfer_summary', emit('transfer_summary'))
 
       es.onerror = () => {
         setConnected(false)
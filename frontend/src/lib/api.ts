@@ -230,7 +230,8 @@ export const conversationsApi = {
   list: (params?: { page?: number; per_page?: number; status?: string; needs_attention?: boolean; search?: string }) =>
     api.get('/conversations', { params }),
 
-  get: (id: string) => api.get(`/conversations/${id}`),
+  get: (id: string, params?: { before?: string; limit?: number }) =>
+    api.get(`/conversations/${id}`, { params }),
 
   transfer: (id: string, reason: string) =>
     api.post(`/conversations/${id}/transfer`, { reason }),
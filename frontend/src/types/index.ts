@@ -150,10 +150,23 @@ export interface Conversation {
   patient?: Patient
   phone_number: string
   messages?: Message[]
+  // Set by GET /conversations/:id, which returns one page of messages
+  has_more_messages?: boolean
+  next_before?: string | null
   context?: Record<string, unknown>
   status: ConversationStatus
   urgent?: boolean
   unread_count?: number
+  message_count?: number
+  // Inbox summary (list endpoint only)
+  last_message_preview?: string | null
+  last_message_role?: Message['role'] | null
+  last_message_type?: Message['type'] | null
+  // Set by the list endpoint when searching: best-matching message excerpt
+  // and [start, end) ranges of the matched words within it
+  search_snippet?: string
+  search_highlights?: [number, number][]
+  search_message_id?: string
   last_read_at?: string | null
   last_message_at: string
   created_at: string
@@ -195,6 +208,8 @@ export interface BotTransfer {
   id: string
   conversation_id: string
   reason: string
+  // AI handoff summary - generated after the transfer, arrives via SSE
+  summary?: string | null
   urgent?: boolean
   transferred_at: string
   resolved: boolean